@@ -1,29 +1,125 @@
 import os
 import logging
+import threading
+import numpy
 import ROOT
 
+from Cuts import Cuts
+from CutFlow import CutFlow
+from HistogramBank import HistogramBank
+from Dataset import openDataset
+from ColumnStore import ColumnStore
+from ColumnCache import ColumnCache
+from BranchUsage import usedBranches
+from SelectionIndex import SelectionIndexStore
+from ResultCache import ResultCache, resultContext
+from CutSweep import CutSweep
+from Profiler import newProfiler
+from ReadAhead import ReadAhead
+from HistogramSpec import HistogramSpec, FusedFill, branchHistograms
+from Columns import readColumns, entryRanges, fillHistogram, dimuonPairs, columnPairs, commonInstances, branchType, Instances
+
 class Analyzer(object):
     """Base Analyzer class. 
 
     The custom analyzers should inherit from this class
     """
-    def __init__(self):
+    # Histograms of the analysis, in writing order: ROOT name, title, binning and
+    # the expression filling them with the (selected) muons or their pairs
+    HISTOGRAMS = [
+        HistogramSpec('h_type', 'Number of Muons;Muon type;Number of muons', (4, 1, 5), '1', condition='Muon_isTrackerMuon == 1'),
+        HistogramSpec('h_type', None, None, '2', condition='Muon_isStandAloneMuon == 1'),
+        HistogramSpec('h_type', None, None, '3', condition='Muon_isGlobalMuon == 1'),
+        HistogramSpec('h_type', None, None, '4', condition='(Muon_isGlobalMuon == 1) & (Muon_isTrackerMuon == 1)'),
+        HistogramSpec('h_pt', 'Muons Transverse Momentun; Muon transverse momentum p_{T} (GeV); Number of muons', (50, 0, 200), 'Muon_pt'),
+        HistogramSpec('h_px', 'Muons x- Momentun; Muon momentum p_{x} (GeV); Number of muons', (50, -300, 300), 'Muon_px'),
+        HistogramSpec('h_py', 'Muons y- Momentun; Muon momentum p_{y} (GeV); Number of muons', (50, -300, 300), 'Muon_py'),
+        HistogramSpec('h_pz', 'Muons z- Momentun; Muon momentum p_{z} (GeV); Number of muons', (50, -300, 300), 'Muon_pz'),
+        HistogramSpec('h_eta', 'Pseudorapidity; Muon pseudorapidity #eta; Number of muons', (50, -5, 5), 'Muon_eta'),
+        HistogramSpec('h_energy', 'Muons Energy; Muon energy E (GeV); Number of muons', (50, -300, 300), 'Muon_energy'),
+        HistogramSpec('h_dz', 'Distance from Primary vertex Z; Muon distance d_{z} (cm); Number of muons', (50, -3, 3), 'Muon_distance'),
+        HistogramSpec('h_charge', 'Muons Charge; Muon charge q; Number of muons', (4, -2, 2), 'Muon_charge'),
+        HistogramSpec('h_normChi2', 'Muons Chi2/ndof; Muon track #chi^{2}/ndof; Number of muons', (50, 0, 100), 'Muon_normChi2'),
+        HistogramSpec('h_numberOfValidHits', 'Number of Valid Hits; Number of valid hits; Number of muons', (50, 0, 50), 'Muon_numberOfValidHits'),
+        HistogramSpec('h_numOfMatches', 'Number of muon chambers matched; Number of matched muon chambers; Number of muons', (10, 0, 10), 'Muon_numOfMatches'),
+        HistogramSpec('h_NValidHitsSATk', 'Number of hits in the muon chambers; Number of hits in the muon chambers; Number of muons', (60, 0, 60), 'Muon_NValidHitsSATk'),
+        HistogramSpec('h_dB', 'Impact Parameter; Muon transverse impact parameter |d_{xy}| (cm); Number of muons', (50, 0, 2), 'Muon_dB'),
+        HistogramSpec('h_isolation_sumPt', 'Muon tracker Isolation; Number of muons', (50, 0, 300), 'Muon_isolation_sumPt'),
+        HistogramSpec('h_isolation_emEt', 'Muon ECAL Isolation; Number of muons', (50, 0, 300), 'Muon_isolation_emEt'),
+        HistogramSpec('h_isolation_hadEt', 'Muon HCAL Isolation; Number of muons', (50, 0, 300), 'Muon_isolation_hadEt'),
+        HistogramSpec('h_isolation', 'Muon relative Isolation; Number of muons', (50, 0, 300), '(Muon_isolation_hadEt + Muon_isolation_emEt + Muon_isolation_sumPt)/Muon_pt'),
+        HistogramSpec('h_mass', 'Invariant mass; Invariant mass m_{#mu#mu} (GeV); Events', (150, 0, 300), 'mass', objects='pairs'),
+    ]
+    # Histograms filled with the value of one muon branch
+    MUON_HISTOGRAMS = branchHistograms(HISTOGRAMS)
+    # Branches read by the columnar mode
+    COLUMNS = [branch for histo, branch in MUON_HISTOGRAMS] + [
+        'Muon_isTrackerMuon', 'Muon_isStandAloneMuon', 'Muon_isGlobalMuon']
+    # Branches of the muon pairs, always read by the columnar mode
+    PAIR_COLUMNS = ['Muon_pt', 'Muon_px', 'Muon_py', 'Muon_pz', 'Muon_energy', 'Muon_charge']
+
+    # Attribute holding each histogram whose ROOT name differs from it
+    HISTOGRAM_ATTRIBUTES = {
+        'h_type': 'h_MuonType',
+        'h_type1': 'h_MuonType1',
+        'h_type2': 'h_MuonType2',
+        'h_type3': 'h_MuonType3',
+        'h_type4': 'h_MuonType4',
+    }
+
+    # Number of events read at once by the columnar mode
+    chunkSize = 100000
+
+    # Chunks read ahead by background threads while one is processed (0: read when needed), and
+    # number of reading threads, each with its own file handle (see readAhead)
+    readAheadDepth = 2
+    readAheadThreads = 1
+
+    # Bytes of the TTreeCache of the event loop, whose baskets are unzipped in parallel (0: no cache)
+    treeCacheSize = 30*1024**2
+
+    # Default input: the tree written by createTTree
+    dataset = "datafiles/mytree.root"
+
+    # Decompressed branches kept on disk between runs by the columnar mode (None: no cache)
+    cacheDirectory = "datafiles/columncache"
+    cacheSize = 2*1024**3
+
+    # Selection indices kept on disk, keyed by cut parameters and dataset (None: always scan)
+    selectionDirectory = "datafiles/selections"
+
+    # Histograms kept on disk by ProduceHistograms, keyed by their definition and inputs
+    resultDirectory = "datafiles/results"
+    resultSize = 512*1024**2
+
+    # Time the stages of the loops and write a run report next to the histograms (see Profiler)
+    profile = False
+
+    def __init__(self, dataset=None):
         """Create an analyzer.
         Parameters (also stored as attributes for later use):
+        dataset: ROOT file, or manifest of the shards of a parallel conversion (read as one chain)
         cfg_ana: configuration parameters for this analyzer (e.g. a pt cut)
         cfg_comp: configuration parameters for the data or MC component (e.g. DYJets)
         looperName: name of the Looper which runs this analyzer.
         Attributes:
         dirName : analyzer directory, where you can write anything you want
         """
-        self.file = ROOT.gROOT.GetListOfFiles().FindObject("mytree.root")
-        if not self.file or not self.file.IsOpen():
-            self.file = ROOT.TFile("datafiles/mytree.root", "read")
-        self.tree = self.file.Get("muons")
+        if dataset is not None:
+            self.dataset = dataset
+        self.profiler = newProfiler(self.profile, type(self).__name__)
+        self.file, self.tree = openDataset(self.dataset)
+        # A column store serves the event loop and the columnar mode, but no TTreeFormula
+        self.columnStore = isinstance(self.tree, ColumnStore)
+        # A column store is already decompressed: nothing to cache
+        self.columnCache = None
+        if self.cacheDirectory and not self.columnStore:
+            self.columnCache = ColumnCache(self.cacheDirectory, self.cacheSize, self.chunkSize)
         
         # Define aliases for mass and isolation
-        self.tree.SetAlias("MuonPair_mass", "((Muon_energy[0]+Muon_energy[1])**2 - (Muon_px[0]+Muon_px[1])**2 - (Muon_py[0]+Muon_py[1])**2 - (Muon_pz[0]+Muon_pz[1])**2)**(0.5)") 
-        self.tree.SetAlias("Muon_relIso", "(Muon_isolation_hadEt + Muon_isolation_emEt + Muon_isolation_sumPt)/Muon_pt")
+        if not self.columnStore:
+            self.tree.SetAlias("MuonPair_mass", "((Muon_energy[0]+Muon_energy[1])**2 - (Muon_px[0]+Muon_px[1])**2 - (Muon_py[0]+Muon_py[1])**2 - (Muon_pz[0]+Muon_pz[1])**2)**(0.5)") 
+            self.tree.SetAlias("Muon_relIso", "(Muon_isolation_hadEt + Muon_isolation_emEt + Muon_isolation_sumPt)/Muon_pt")
         
         # Get the number of entries(events) of the TTree (file.root)
         self.numEntries=self.tree.GetEntries()
@@ -45,11 +141,49 @@ class Analyzer(object):
         ''' 
         Executed after the analysis to write the histograms in the root file
         '''
-        self.rootfile= ROOT.TFile("datafiles/"+name, "RECREATE") 
-        print("*** writing file", self.rootfile)
-        self.WriteHistograms()
-        self.rootfile.Close()
+        with self.profiler.stage('write'):
+            self.rootfile= ROOT.TFile("datafiles/"+name, "RECREATE") 
+            print("*** writing file", self.rootfile)
+            self.WriteHistograms()
+            self.rootfile.Close()
         print("*** done")
+        if self.profiler.enabled:
+            for line in self.profiler.summary():
+                print(line)
+            self.profiler.write("datafiles/"+name+".profile.json")
+
+    def ProduceHistograms(self, name, fill, cuts=None):
+        '''
+        Write datafiles/name as endJob does, taking from the result cache every
+        histogram already computed with the same definition and inputs
+        name: output file, as for endJob
+        fill: function(names) running the analysis, filling at least the histograms
+              whose ROOT names are given (after beginJob); only called on a miss
+        cuts: Cuts object the histograms depend on
+        returns: ROOT names of the histograms which had to be computed
+        '''
+        cache = ResultCache(self.resultDirectory, self.resultSize)
+        context = resultContext(self, cuts)
+        cached = {}
+        for histo in self.Bank():
+            result = cache.get(histo, context)
+            if result is not None:
+                cached[histo.GetName()] = result
+        missing = [histo.GetName() for histo in self.Bank() if histo.GetName() not in cached]
+
+        if missing:
+            fill(missing)
+            self.FlushHistograms()
+            for histoName in missing:
+                cache.put(self.Histogram(histoName), context)
+            cache.evict()
+        # The analysis may have filled cached histograms too: they are taken from the cache
+        for histoName, result in cached.items():
+            histo = self.Histogram(histoName)
+            histo.Reset()
+            histo.Add(result)
+        self.endJob(name)
+        return missing
 
     def Setup(self):
         '''
@@ -61,80 +195,251 @@ class Analyzer(object):
 
         self.tree.GetEntry(0)
 
+        if self.columnStore:
+            # Same attribute names, bound to views of the memory-mapped columns
+            for name in self.tree.branches():
+                setattr(self, name, self.tree.view(name))
+            return
+
+        if self.tree.InheritsFrom("TChain"):
+            # The branches of a chain are replaced when it opens the next shard: bind vectors
+            # owned by the analyzer, whose address the chain keeps across shards
+            for br in self.tree.GetListOfBranches():
+                vector = ROOT.std.vector(branchType(self.tree, br.GetName()))()
+                self.tree.SetBranchAddress(br.GetName(), vector)
+                setattr(self, br.GetName(), vector)
+            self.tree.GetEntry(0)
+            return
+
         # Extract all branches and use it as datamembers of this class
         for br in self.tree.GetListOfBranches():
             setattr(self,br.GetName(),getattr(self.tree,br.GetName()))
         
+    def BranchNames(self):
+        if self.columnStore:
+            return self.tree.branches()
+        return [br.GetName() for br in self.tree.GetListOfBranches()]
+
+    def ActivateBranches(self, *args):
+        '''
+        Read only the branches used by the event loop: every other branch is disabled
+        and its attribute emptied, so GetEntry no longer reads and unpacks it.
+        To be called before the event loop (process), not before TTreeFormula methods
+        (Project, Draw), which need the branches of their own formulas.
+        args: extra arguments of process, e.g. the selector
+        returns: the active branches
+        '''
+        self.activeBranches = sorted(usedBranches(self, args))
+        self.bytesReadStart = ROOT.TFile.GetFileBytesRead()
+        if self.columnStore:
+            # Columns are mapped lazily: unused branches are never read anyway
+            return self.activeBranches
+        self.tree.SetBranchStatus("*", 0)
+        for name in self.activeBranches:
+            self.tree.SetBranchStatus(name, 1)
+        if self.treeCacheSize:
+            # GetEntry reads the baskets of the active branches ahead in a few large requests,
+            # and background threads unzip them before they are needed
+            ROOT.TTreeCacheUnzip.SetParallelUnzip(ROOT.TTreeCacheUnzip.kEnable)
+            self.tree.SetCacheSize(self.treeCacheSize)
+            for name in self.activeBranches:
+                self.tree.AddBranchToCache(name, True)
+            self.tree.StopCacheLearningPhase()
+        for name in self.BranchNames():
+            if name not in self.activeBranches:
+                getattr(self, name).clear()
+        return self.activeBranches
+
+    def BranchReport(self, entries=None):
+        '''
+        Branches read by the event loop since ActivateBranches
+        entries: number of entries processed (default: all of them)
+        returns: dictionary with
+            branches: list of {branch, active, bytes} with the bytes decompressed
+                      (estimated from the average uncompressed size of the branch)
+            decompressed: total bytes decompressed
+            bytesRead: bytes actually read from the files
+        '''
+        entries = self.numEntries if entries is None else entries
+        active = getattr(self, 'activeBranches', None) or self.BranchNames()
+        rows = []
+        for name in self.BranchNames():
+            decompressed = 0
+            if name in active and not self.columnStore:
+                branch = self.tree.GetBranch(name)
+                decompressed = int(branch.GetTotBytes()*float(entries)/max(branch.GetEntries(), 1))
+            rows.append({'branch': name, 'active': name in active, 'bytes': decompressed})
+        return {
+            'branches': rows,
+            'decompressed': sum(row['bytes'] for row in rows),
+            'bytesRead': ROOT.TFile.GetFileBytesRead() - getattr(self, 'bytesReadStart', 0),
+        }
+
     ### DEFINE AND FILL HISTOGRAMS ### 
 
     def DefineHistograms(self):
         '''Function that define the histograms for all and selected analyzers'''
         # Define and init the histograms for each branch as a TH1F object from ROOT
 
-        self.h_MuonType=ROOT.TH1F('h_type', 'Number of Muons;Muon type;Number of muons', 4, 1, 5)
+        self.fusedFill = FusedFill(self.HISTOGRAMS)
+        for histo in self.fusedFill.book():
+            setattr(self, self.HISTOGRAM_ATTRIBUTES.get(histo.GetName(), histo.GetName()), histo)
+        # Filled by FillHistogramsFromTree only, and added to h_type when written
         self.h_MuonType1=ROOT.TH1F( 'h_type1', 'Tracker muons', 4, 1, 5)
         self.h_MuonType2=ROOT.TH1F( 'h_type2', 'StandAlone muons', 4, 1, 5)
         self.h_MuonType3=ROOT.TH1F( 'h_type3', 'Global muons', 4, 1, 5)
         self.h_MuonType4=ROOT.TH1F( 'h_type4', 'Tracker or global muons', 4, 1, 5)
-        self.h_pt=ROOT.TH1F( 'h_pt', 'Muons Transverse Momentun; Muon transverse momentum p_{T} (GeV); Number of muons', 50, 0, 200 )
-        self.h_px=ROOT.TH1F( 'h_px', 'Muons x- Momentun; Muon momentum p_{x} (GeV); Number of muons', 50, -300, 300 )
-        self.h_py=ROOT.TH1F( 'h_py', 'Muons y- Momentun; Muon momentum p_{y} (GeV); Number of muons', 50, -300, 300 )
-        self.h_pz=ROOT.TH1F( 'h_pz', 'Muons z- Momentun; Muon momentum p_{z} (GeV); Number of muons', 50, -300, 300 )
-        self.h_eta=ROOT.TH1F( 'h_eta', 'Pseudorapidity; Muon pseudorapidity #eta; Number of muons', 50, -5 , 5 )
-        self.h_energy=ROOT.TH1F('h_energy','Muons Energy; Muon energy E (GeV); Number of muons', 50, -300,300)
-        self.h_dz=ROOT.TH1F('h_dz','Distance from Primary vertex Z; Muon distance d_{z} (cm); Number of muons', 50, -3,3)
-        self.h_charge=ROOT.TH1F('h_charge','Muons Charge; Muon charge q; Number of muons', 4,-2,2)
-        self.h_normChi2=ROOT.TH1F('h_normChi2', 'Muons Chi2/ndof; Muon track #chi^{2}/ndof; Number of muons', 50, 0,100)
-        self.h_numberOfValidHits=ROOT.TH1F('h_numberOfValidHits', 'Number of Valid Hits; Number of valid hits; Number of muons', 50, 0,50)
-        self.h_numOfMatches=ROOT.TH1F('h_numOfMatches', 'Number of muon chambers matched; Number of matched muon chambers; Number of muons',10, 0, 10)
-        self.h_NValidHitsSATk=ROOT.TH1F('h_NValidHitsSATk', 'Number of hits in the muon chambers; Number of hits in the muon chambers; Number of muons', 60, 0, 60)
-        self.h_dB=ROOT.TH1F('h_dB','Impact Parameter; Muon transverse impact parameter |d_{xy}| (cm); Number of muons',50,0,2)
-        self.h_isolation_sumPt=ROOT.TH1F('h_isolation_sumPt','Muon tracker Isolation; Number of muons',50, 0,300)
-        self.h_isolation_emEt=ROOT.TH1F('h_isolation_emEt','Muon ECAL Isolation; Number of muons',50, 0,300)
-        self.h_isolation_hadEt=ROOT.TH1F('h_isolation_hadEt','Muon HCAL Isolation; Number of muons',50, 0,300)
-        self.h_isolation=ROOT.TH1F('h_isolation','Muon relative Isolation; Number of muons',50, 0,300)
-        self.h_mass=ROOT.TH1F('h_mass', 'Invariant mass; Invariant mass m_{#mu#mu} (GeV); Events', 150, 0, 300)
 
         
         
+    def FillEvent(self, selected=None):
+        '''
+        Fill the histograms with the muons of the current event, and their pairs
+        selected: boolean array of the selected muons (None: every muon)
+        The event is buffered and binned with the next ones (see FusedFill).
+        '''
+        with self.profiler.stage('pairs'):
+            pairs = self.EventPairs() if self.Muon_pt.size() > 1 else None
+        with self.profiler.stage('fill'):
+            muons = dict((branch, numpy.asarray(getattr(self, branch))) for branch in self.fusedFill.branches())
+            self.fusedFill.append(muons, selected, pairs)
+
     def FillHistograms(self, particle):
-       
-        #self.relIso = self.Muon_isolation_hadEt[particle] + self.Muon_isolation_hadEt[particle] + self.Muon_isolation_sumPt[particle]/self.Muon_pt[particle]
-        self.h_isolation.Fill((self.Muon_isolation_hadEt[particle] + self.Muon_isolation_hadEt[particle] + self.Muon_isolation_sumPt[particle])/self.Muon_pt[particle])
-        '''Function that fill the histograms for each variable and particle in the event'''
-        
-        if self.Muon_isTrackerMuon[particle] == 1:
-            self.h_MuonType.Fill(1)
-            
-        if self.Muon_isStandAloneMuon[particle] == 1:
-            self.h_MuonType.Fill(2)
+        '''
+        Fill the muon histograms with one muon of the current event (not the mass),
+        for analyzers looping over the muons themselves: the muon is buffered like
+        the events of FillEvent, which fills a whole event at once
+        particle: index of the muon in the event
+        '''
+        with self.profiler.stage('fill'):
+            muons = dict((branch, numpy.asarray(getattr(self, branch))[particle:particle+1])
+                         for branch in self.fusedFill.branches())
+            self.fusedFill.append(muons)
+
+    def SelectHistograms(self, names):
+        '''
+        Fill only the rows of the histogram table filling these ROOT names, e.g. the
+        histograms missing from the result cache (see ProduceHistograms): the other
+        histograms stay empty, and the branches only they use are no longer read by
+        the columnar mode nor activated by ActivateBranches. To be called after beginJob.
+        '''
+        self.FlushHistograms()
+        self.HISTOGRAMS = [spec for spec in type(self).HISTOGRAMS if spec.name in names]
+        self.fusedFill = FusedFill(self.HISTOGRAMS)
+        self.COLUMNS = sorted(set(self.fusedFill.branches()) | set(self.PAIR_COLUMNS))
+
+    def FlushHistograms(self):
+        '''Add what the fused fill accumulated to the histograms'''
+        with self.profiler.stage('fill'):
+            self.fusedFill.flush(self.Histogram)
+
+    def Histogram(self, name):
+        '''Histogram defined in DefineHistograms, from its ROOT name'''
+        return getattr(self, self.HISTOGRAM_ATTRIBUTES.get(name, name))
+
+    def Bank(self):
+        '''HistogramBank with every histogram of the analyzer, before WriteHistograms'''
+        self.FlushHistograms()
+        return HistogramBank(histo for histo in vars(self).values() if isinstance(histo, ROOT.TH1))
+
+    def LoadBank(self, bank):
+        '''Add the histograms of a bank (e.g. merged partial results) to the analyzer ones'''
+        for histo in bank:
+            self.Histogram(histo.GetName()).Add(histo)
+
+    def chunks(self, chunkSize=None):
+        '''Ranges of entries (start, stop) processed at once by the columnar mode'''
+        return entryRanges(self.numEntries, chunkSize or self.chunkSize)
+
+    def readColumns(self, start, stop, branches=None):
+        '''Read the muon branches of the entries [start, stop) as JaggedArrays'''
+        with self.profiler.stage('read'):
+            columns = self.readColumnsFrom(self.tree, self.columnCache, start, stop, branches)
+        self.countBytes(columns)
+        return columns
+
+    def readColumnsFrom(self, tree, columnCache, start, stop, branches=None):
+        '''readColumns from another handle of the dataset, and its own column cache'''
+        if columnCache is not None:
+            return columnCache.readColumns(tree, self.dataset, branches or self.COLUMNS, start, stop)
+        return readColumns(tree, branches or self.COLUMNS, start, stop)
+
+    def countBytes(self, columns):
+        '''Count the bytes of columns read in the profile'''
+        if self.profiler.enabled:
+            self.profiler.counter('bytesDecompressed', sum(column.content.nbytes + column.offsets.nbytes
+                                                           for column in columns.values()))
+
+    def readAhead(self, ranges=None, branches=None):
+        '''
+        Columns of chunks of entries, read by background threads ahead of their
+        processing (see ReadAhead): for start, stop, columns in analysis.readAhead(): ...
+        Each thread reads with its own handle of the dataset; the chunks come in
+        the order of the ranges, so the results are those of readColumns.
+        ranges: (start, stop) of the chunks (default: chunks())
+        branches: branches to read (default: COLUMNS)
+        '''
+        if self.readAheadThreads > 0 and not self.columnStore:
+            ROOT.ROOT.EnableThreadSafety()
+        handles = threading.local()
+
+        def read(start, stop):
+            if not hasattr(handles, 'tree'):
+                handles.file, handles.tree = openDataset(self.dataset, newHandle=True)
+                handles.columnCache = None
+                if self.columnCache is not None:
+                    handles.columnCache = ColumnCache(self.cacheDirectory, self.cacheSize, self.chunkSize)
+            return self.readColumnsFrom(handles.tree, handles.columnCache, start, stop, branches)
+
+        def chunks():
+            for start, stop, columns in ReadAhead(read, self.chunks() if ranges is None else ranges,
+                                                  self.readAheadDepth, self.readAheadThreads, self.profiler):
+                self.countBytes(columns)
+                yield start, stop, columns
+        return chunks()
+
+    def FillFromColumns(self, columns, mask=None, pairs=None, fusedFill=None):
+        '''
+        Columnar version of FillEvent: fill the histograms for every muon of a
+        chunk at once, and the mass of their pairs
+        columns: dictionary {branch name: JaggedArray} from readColumns
+        mask: optional boolean array selecting the muons (instances of Muon_pt) to fill
+        pairs: columnPairs of the chunk, when already built
+        fusedFill: FusedFill accumulating the histograms instead of the analyzer one
+        Each histogram gets the muons where the branches it reads have a value,
+        as with tree.Project (see Columns.Instances).
+        '''
+        fusedFill = fusedFill or self.fusedFill
+        muons = Instances(columns)
+        if pairs is None:
+            with self.profiler.stage('pairs'):
+                pairs = columnPairs(columns)
+        with self.profiler.stage('fill'):
+            fusedFill.fill(muons, mask, pairs)
+
+    def EventPairs(self):
+        '''Pair columns (see dimuonPairs) of the muons in the current event'''
+        return dimuonPairs([0, self.Muon_pt.size()], self.Muon_px, self.Muon_py,
+                           self.Muon_pz, self.Muon_energy, self.Muon_charge)
+
+    def FillHistogramsFromTree(self, cuts = False, fused = False, histograms = None, index = False):
+        '''
+        Fill the histograms with tree.Project, one scan of the tree per histogram
+        cuts: Cuts object with the muon selection, False to take every muon
+        fused: read the tree only once instead (see FillHistogramsInOnePass)
+        histograms: ROOT names of the histograms to fill (default: all of them)
+        index: build and store the selection index of the cuts when there is none
+               yet (one more scan of the dataset); a stored index is always used
+        '''
+        if fused:
+            return self.FillHistogramsInOnePass(cuts)
+
+        def project(name, expression, selection):
+            if histograms is None or name in histograms:
+                # Reads, selects and fills in one TTreeFormula loop
+                with self.profiler.stage('project'):
+                    self.tree.Project(name, expression, selection)
 
-        if self.Muon_isGlobalMuon[particle] == 1: 
-            self.h_MuonType.Fill(3)
-        
-        if self.Muon_isGlobalMuon[particle] == 1 and self.Muon_isTrackerMuon[particle] == 1: 
-            self.h_MuonType.Fill(4)
-        
-        
-        self.h_pt.Fill(self.Muon_pt[particle])
-        self.h_px.Fill(self.Muon_px[particle])
-        self.h_py.Fill(self.Muon_py[particle])
-        self.h_pz.Fill(self.Muon_pz[particle])
-        self.h_eta.Fill(self.Muon_eta[particle])
-        self.h_energy.Fill(self.Muon_energy[particle])
-        self.h_dz.Fill(self.Muon_distance[particle])
-        self.h_charge.Fill(self.Muon_charge[particle])
-        self.h_normChi2.Fill(self.Muon_normChi2[particle])
-        self.h_numberOfValidHits.Fill(self.Muon_numberOfValidHits[particle])
-        self.h_numOfMatches.Fill(self.Muon_numOfMatches[particle])
-       	self.h_dB.Fill(self.Muon_dB[particle])
-        self.h_isolation_sumPt.Fill(self.Muon_isolation_sumPt[particle])
-       	self.h_isolation_emEt.Fill(self.Muon_isolation_emEt[particle])
-        self.h_isolation_hadEt.Fill(self.Muon_isolation_hadEt[particle])
-        self.h_NValidHitsSATk.Fill(self.Muon_NValidHitsSATk[particle])
-        
-    def FillHistogramsFromTree(self, cuts = False):
-        
         if cuts:
             selection_all = cuts.fullSelection()     # selection applied in all muons
             selection_0   = cuts.fullSelection("0")  # selection applied in leading muon
@@ -145,80 +450,177 @@ class Analyzer(object):
             selection_1   = "1"
         
         selection_pair = selection_0 + " && " + selection_1 + " && (Muon_charge[0]*Muon_charge[1] < 0)"
+
+        if cuts and self.selectionDirectory:
+            # Only the entries with a selected muon can fill the histograms
+            selection = self.SelectionIndex(cuts, build = index)
+            if selection is not None:
+                self.tree.SetEntryList(selection.entryList(self.tree))
         
-        self.tree.Project("h_type1", "1*(Muon_isTrackerMuon)", selection_all)
-        self.tree.Project("h_type2", "2*(Muon_isStandAloneMuon)", selection_all)
-        self.tree.Project("h_type3", "3*(Muon_isGlobalMuon)", selection_all)
-        self.tree.Project("h_type4", "4*(Muon_isTrackerMuon && Muon_isGlobalMuon)", selection_all)
+        project("h_type1", "1*(Muon_isTrackerMuon)", selection_all)
+        project("h_type2", "2*(Muon_isStandAloneMuon)", selection_all)
+        project("h_type3", "3*(Muon_isGlobalMuon)", selection_all)
+        project("h_type4", "4*(Muon_isTrackerMuon && Muon_isGlobalMuon)", selection_all)
         print("> h_type filled (1/19)")
-        self.tree.Project("h_pt", "Muon_pt", selection_all)
+        project("h_pt", "Muon_pt", selection_all)
         print("> h_pt filled (2/19)")
-        self.tree.Project("h_px", "Muon_px", selection_all)
+        project("h_px", "Muon_px", selection_all)
         print("> h_px filled (3/19)")
-        self.tree.Project("h_py", "Muon_py", selection_all)
+        project("h_py", "Muon_py", selection_all)
         print("> h_py filled (4/19)")
-        self.tree.Project("h_pz", "Muon_pz", selection_all)
+        project("h_pz", "Muon_pz", selection_all)
         print("> h_pz filled (5/19)")
-        self.tree.Project("h_eta", "Muon_eta", selection_all)
+        project("h_eta", "Muon_eta", selection_all)
         print("> h_eta filled (6/19)")
-        self.tree.Project("h_energy", "Muon_energy", selection_all)
+        project("h_energy", "Muon_energy", selection_all)
         print("> h_energy filled (7/19)")
-        self.tree.Project("h_dz", "Muon_distance", selection_all)
+        project("h_dz", "Muon_distance", selection_all)
         print("> h_dz filled (8/19)")
-        self.tree.Project("h_charge", "Muon_charge", selection_all)
+        project("h_charge", "Muon_charge", selection_all)
         print("> h_charge filled (9/19)")
-        self.tree.Project("h_normChi2", "Muon_normChi2", selection_all)
+        project("h_normChi2", "Muon_normChi2", selection_all)
         print("> h_normChi2 filled (10/19)")
-        self.tree.Project("h_numberOfValidHits", "Muon_numberOfValidHits", selection_all)
+        project("h_numberOfValidHits", "Muon_numberOfValidHits", selection_all)
         print("> h_numberOfValidHits filled (11/19)")
-        self.tree.Project("h_numOfMatches", "Muon_numOfMatches", selection_all)
+        project("h_numOfMatches", "Muon_numOfMatches", selection_all)
         print("> h_numOfMatches filled (12/19)")
-        self.tree.Project("h_NValidHitsSATk", "Muon_NValidHitsSATk", selection_all)
+        project("h_NValidHitsSATk", "Muon_NValidHitsSATk", selection_all)
         print("> h_NValidHitsSATk filled (13/19)")
-        self.tree.Project("h_dB", "Muon_dB", selection_all)
+        project("h_dB", "Muon_dB", selection_all)
         print("> h_dB filled (14/19)")
-        self.tree.Project("h_isolation_sumPt", "Muon_isolation_sumPt", selection_all)
+        project("h_isolation_sumPt", "Muon_isolation_sumPt", selection_all)
         print("> h_isolation_sumPt (15/19)")
-        self.tree.Project("h_isolation_emEt", "Muon_isolation_emEt", selection_all)
+        project("h_isolation_emEt", "Muon_isolation_emEt", selection_all)
         print("> h_isolation_emEt filled (16/19)")
-        self.tree.Project("h_isolation_hadEt", "Muon_isolation_hadEt", selection_all)
+        project("h_isolation_hadEt", "Muon_isolation_hadEt", selection_all)
         print("> h_isolation_hadEt filled (17/19)")
-        self.tree.Project("h_isolation", "(Muon_isolation_hadEt + Muon_isolation_emEt + Muon_isolation_sumPt)/Muon_pt", selection_all)
+        project("h_isolation", "(Muon_isolation_hadEt + Muon_isolation_emEt + Muon_isolation_sumPt)/Muon_pt", selection_all)
         print("> h_isolation filled (18/19)")
-        self.tree.Project("h_mass", "MuonPair_mass", selection_pair)
+        project("h_mass", "MuonPair_mass", selection_pair)
         print("> h_mass filled (19/19)")
+        self.tree.SetEntryList(ROOT.nullptr)
+        self.profiler.count(self.numEntries)
        
             
+    def FillHistogramsInOnePass(self, cuts = False, chunkSize = None):
+        '''
+        Fused version of FillHistogramsFromTree: the tree is read once, in chunks,
+        the selection is evaluated once per muon and every histogram is filled in
+        that same pass, with the same contents as the tree.Project calls
+        '''
+        histograms = ['h_type1', 'h_type2', 'h_type3', 'h_type4'] + [histo for histo, branch in self.MUON_HISTOGRAMS] + ['h_isolation', 'h_mass']
+        entries = dict((histo, 0) for histo in histograms)
+        chunks = list(self.chunks(chunkSize))
+        for n, (start, stop, columns) in enumerate(self.readAhead(chunks)):
+            if cuts:
+                # Like TTreeFormula, only the muons present in every branch are used
+                with self.profiler.stage('selection'):
+                    aligned = commonInstances(columns, self.COLUMNS)
+                    selected = cuts.select(aligned)
+
+            def values(*branches):
+                '''Selected values of some branches, as double arrays'''
+                if cuts:
+                    return [aligned[b][selected].astype(numpy.float64) for b in branches]
+                common = commonInstances(columns, branches)
+                return [common[b].astype(numpy.float64) for b in branches]
+
+            fill = {}
+            tracker, standAlone, isGlobal = values('Muon_isTrackerMuon', 'Muon_isStandAloneMuon', 'Muon_isGlobalMuon')
+            fill['h_type1'] = 1*tracker
+            fill['h_type2'] = 2*standAlone
+            fill['h_type3'] = 3*isGlobal
+            fill['h_type4'] = 4.*((tracker != 0) & (isGlobal != 0))
+            for histo, branch in self.MUON_HISTOGRAMS:
+                fill[histo], = values(branch)
+            hadEt, emEt, sumPt, pt = values('Muon_isolation_hadEt', 'Muon_isolation_emEt', 'Muon_isolation_sumPt', 'Muon_pt')
+            fill['h_isolation'] = (hadEt + emEt + sumPt)/pt
+            with self.profiler.stage('pairs'):
+                fill['h_mass'] = self.LeadingPairMass(columns, cuts)
+
+            with self.profiler.stage('fill'):
+                for histo in histograms:
+                    fillHistogram(self.Histogram(histo), fill[histo])
+                    entries[histo] += len(fill[histo])
+            self.profiler.count(stop - start, len(columns['Muon_pt'].content))
+            print("> entries {0}-{1} read ({2}/{3})".format(start, stop, n + 1, len(chunks)))
+
+        for n, histo in enumerate(histograms):
+            print("> {0} filled with {1} entries ({2}/{3})".format(histo, entries[histo], n + 1, len(histograms)))
+
+    def LeadingPairMass(self, columns, cuts = False):
+        '''
+        Columnar version of the MuonPair_mass alias: mass of the two leading muons
+        for the events where both pass the cuts and have opposite charges
+        '''
+        branches = ['Muon_px', 'Muon_py', 'Muon_pz', 'Muon_energy', 'Muon_charge'] + (cuts.BRANCHES if cuts else [])
+        # Events where muons [0] and [1] exist in every branch used
+        events = numpy.flatnonzero(numpy.minimum.reduce([columns[b].counts() for b in branches]) > 1)
+        muon0, muon1 = [dict((b, columns[b].content[columns[b].offsets[events] + k].astype(numpy.float64)) for b in branches)
+                        for k in (0, 1)]
+        keep = muon0['Muon_charge']*muon1['Muon_charge'] < 0
+        if cuts:
+            keep &= cuts.select(muon0) & cuts.select(muon1)
+        # Same operations as the alias, so the masses are identical
+        mass2 = ((muon0['Muon_energy'] + muon1['Muon_energy'])**2 - (muon0['Muon_px'] + muon1['Muon_px'])**2
+                 - (muon0['Muon_py'] + muon1['Muon_py'])**2 - (muon0['Muon_pz'] + muon1['Muon_pz'])**2)
+        with numpy.errstate(invalid='ignore'):
+            return mass2[keep]**0.5
+
+    def SelectionIndex(self, cuts, cutFlow=False, build=True):
+        '''
+        Entries and muons of the dataset passing the cuts, read from the selection
+        index store, or built (from a looser index when possible) and stored
+        cutFlow: the index must also hold the cut flow of every muon
+        build: False to only read a stored index: None if there is none
+        '''
+        return SelectionIndexStore(self.selectionDirectory).get(self, cuts, cutFlow, build)
+
+    def SweepCuts(self, configurations, histograms=True, chunkSize=None):
+        '''
+        Evaluate many Cuts configurations in a single read of the dataset (see CutSweep)
+        configurations: list of dictionaries of Cuts parameters, e.g. from gridConfigurations
+        returns: the CutSweep, whose results() are indexed like the configurations
+        '''
+        return CutSweep(self, configurations, histograms).run(chunkSize)
+
     def FillEfficiency(self, efficiency, sequence):
+        '''
+        Fill the efficiency histogram: bin c+1 holds the muons passing sequence[c]
+        sequence: list of selections from Cuts.sequentialSelection (one tree.Draw per
+        stage), or directly a Cuts object to fill every stage in one scan (FillCutFlow)
+        '''
+        if isinstance(sequence, Cuts):
+            return self.FillCutFlow(efficiency, sequence)
         self.h_aux=ROOT.TH1F('h_aux', 'Auxiliar', 1, 0, 1000)
         for c,cut in enumerate(sequence):
-            self.tree.Draw("Muon_pt>>h_aux", cut)
+            with self.profiler.stage('project'):
+                self.tree.Draw("Muon_pt>>h_aux", cut)
             efficiency.SetBinContent(c+1, self.h_aux.GetEntries())
 
+    def FillCutFlow(self, efficiency, cuts, chunkSize = None):
+        '''
+        One-scan version of FillEfficiency: every cut is evaluated at most once
+        per muon and all the stages are filled from the same read of the tree
+        returns: the CutFlow, whose result() gives the per-stage counts and efficiencies
+        '''
+        cutFlow = CutFlow(cuts)
+        for start, stop, columns in self.readAhead(self.chunks(chunkSize), cuts.BRANCHES):
+            with self.profiler.stage('selection'):
+                cutFlow.fill(columns)
+            self.profiler.count(stop - start, len(columns['Muon_pt'].content))
+        cutFlow.FillHistogram(efficiency)
+        return cutFlow
+
                                    
     def WriteHistograms(self):
         '''Function to write Histograms: Neither mass nor efficiency
         Add here the histograms to print'''
+        self.FlushHistograms()
         self.h_MuonType.Add(self.h_MuonType1)
         self.h_MuonType.Add(self.h_MuonType2)
         self.h_MuonType.Add(self.h_MuonType3)
         self.h_MuonType.Add(self.h_MuonType4)
-        self.h_MuonType.Write()
-        self.h_pt.Write()
-        self.h_px.Write()
-        self.h_py.Write()
-        self.h_pz.Write()
-        self.h_eta.Write()
-        self.h_energy.Write()
-        self.h_dz.Write()
-        self.h_charge.Write()
-        self.h_normChi2.Write()
-        self.h_numberOfValidHits.Write()
-        self.h_numOfMatches.Write()
-        self.h_NValidHitsSATk.Write()
-        self.h_dB.Write()
-        self.h_isolation_sumPt.Write()
-        self.h_isolation_emEt.Write()
-        self.h_isolation_hadEt.Write()
-        self.h_isolation.Write()
-        self.h_mass.Write()
+        for name in self.fusedFill.names:
+            self.Histogram(name).Write()
+
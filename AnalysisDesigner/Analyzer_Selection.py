@@ -1,8 +1,11 @@
 import os
 import logging
+import numpy
 import ROOT
 
 from Analyzer import Analyzer
+from Cuts import Cuts
+from Columns import fillHistogramCounts
 #import Selec
 
 class AnalyzerSel(Analyzer):
@@ -17,36 +20,72 @@ class AnalyzerSel(Analyzer):
 
     def process(self, event,selector):
         '''Executed on every event'''
-        self.tree.GetEntry(event)
-        
-        #selec = Selector()
-        for particle in range(0,self.Muon_pt.size()):
-            # Fill the histogram for each variable
-            self.h_efficiency.Fill(1)
-            # Get the mass. ONLY if the events has more than 1 muon
-            if (self.Muon_pt.size()) > 1:
-                for j in range (particle+1,self.Muon_pt.size()):
-                    if (self.Muon_charge[particle]*self.Muon_charge[j])<0:
-                        # get the Lorentz vector for the both muons through a ROOT function 
-                        tlv1=ROOT.TLorentzVector()
-                        tlv1.SetPxPyPzE(self.Muon_px[particle], self.Muon_py[particle], self.Muon_pz[particle],self.Muon_energy[particle])
-                        
-                        tlv2=ROOT.TLorentzVector()
-                        tlv2.SetPxPyPzE(self.Muon_px[j], self.Muon_py[j], self.Muon_pz[j],self.Muon_energy[j])
-                        
-                        # Get the mass = (TLV Muon1 + TLV Muon2).M()
-                        mass=(tlv1+tlv2).M()
-                        #print mass
-                        
-                        # If the both muons are selected between the cuts fill the histogram 
-                        if selector.selector(self,particle) and selector.selector(self, j):
-                            self.h_mass.Fill(mass)
-                            
-            # Apply the selection over all particles in the event calling the selector function and fill the histograms for each variable
-            if selector.selector(self, particle):
-                    self.FillHistograms(particle)
-
-
-    def endJob(self):
+        with self.profiler.stage('read'):
+            self.tree.GetEntry(event)
+        self.profiler.count(1, self.Muon_pt.size())
+
+        # Evaluate the cuts once per muon: bitmask of the cuts passed by each of them
+        with self.profiler.stage('selection'):
+            bits = selector.bits(self)
+            selected = selector.selected(self)
+            stages = selector.stagesFromBits(bits)
+        # The cut flow reads the same bitmask: every muon is counted once
+        self.FillEfficiencyFromStages(stages)
+        self.FillSelected(selected)
+
+    def processIndex(self, index):
+        '''
+        Sparse mode: only the entries of a selection index are read, with their
+        selected muons taken from the index; the efficiency comes from its cut flow
+        index: SelectionIndex holding the cut flow (see Analyzer.SelectionIndex)
+        '''
+        self.FillEfficiencyFromCounts(index.cutFlow)
+        for k, event in enumerate(index.entries):
+            with self.profiler.stage('read'):
+                self.tree.GetEntry(int(event))
+            self.profiler.count(1, self.Muon_pt.size())
+            selected = numpy.zeros(self.Muon_pt.size(), dtype=bool)
+            selected[index.eventMuons(k)] = True
+            self.FillSelected(selected)
+
+    def SelectHistograms(self, names):
+        '''Analyzer.SelectHistograms, still reading the branches of the cuts'''
+        Analyzer.SelectHistograms(self, names)
+        self.COLUMNS = sorted(set(self.COLUMNS) | set(Cuts.BRANCHES))
+
+    def FillSelected(self, selected):
+        '''Fill the histograms with the selected muons of the current event, and their pairs'''
+        # The mass is filled for the opposite-charge pairs whose both muons are selected
+        self.FillEvent(selected)
+
+    def processColumns(self, start, stop, selector, columns=None):
+        '''
+        Columnar mode: executed on every chunk of events [start, stop)
+        The efficiency counts every muon once per cut it passes.
+        columns: the columns of the chunk when already read (see readAhead)
+        '''
+        if columns is None:
+            columns = self.readColumns(start, stop)
+        self.profiler.count(stop - start, len(columns['Muon_pt'].content))
+        with self.profiler.stage('selection'):
+            stages = selector.stages(columns)
+            selected = stages == 10
+        self.FillEfficiencyFromStages(stages)
+        self.FillFromColumns(columns, selected)
+
+    def FillEfficiencyFromStages(self, stages):
+        '''Fill h_efficiency from the number of cuts passed by each muon'''
+        self.FillEfficiencyFromCounts(numpy.bincount(stages, minlength=11))
+
+    def FillEfficiencyFromCounts(self, reached):
+        '''Fill h_efficiency from the number of muons reaching each stage (CutFlow.rejected)'''
+        # Muons reaching stage k fill bins 1 (all) to k+1, as selector does
+        passing = reached[::-1].cumsum()[::-1]   # muons passing at least k cuts
+        with self.profiler.stage('fill'):
+            fillHistogramCounts(self.h_efficiency, numpy.arange(1., 12.), passing)
+
+    def WriteHistograms(self):
+        '''Write the histograms of Analyzer and the efficiency in the open root file'''
+        Analyzer.WriteHistograms(self)
         self.h_efficiency.Write()
-        Analyzer.endJob(self)
+
@@ -0,0 +1,276 @@
+'''
+Benchmarks of the analysis hot paths on synthetic muon data.
+
+Every benchmark runs in its own process, so its peak memory is its own, and
+reports events/sec and peak resident memory. Results are written to a JSON
+file and can be compared against a stored baseline:
+
+    python Benchmark.py --events 100000 --output datafiles/benchmark.json
+    python Benchmark.py --events 100000 --save-baseline datafiles/benchmark_baseline.json
+    python Benchmark.py --events 100000 --baseline datafiles/benchmark_baseline.json
+
+The last form exits with status 1 when a benchmark got slower, or bigger,
+than the baseline by more than the tolerance.
+'''
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import tempfile
+import subprocess
+
+from Profiler import peakMemory
+
+
+def disableCaches():
+    '''Every run does the full work: no column cache, selection index or cached result'''
+    from Analyzer import Analyzer
+    Analyzer.cacheDirectory = None
+    Analyzer.selectionDirectory = None
+    Analyzer.resultDirectory = None
+
+
+### BENCHMARKS ###
+# Each benchmark processes a dataset and returns the number of events it went through
+
+def benchConversion(dataset, events, multiplicity):
+    '''createTTree-style conversion: buffered writing of the muons tree'''
+    from Synthetic import writeSynthetic
+    output = os.path.join(os.path.dirname(dataset), "conversion.root")
+    try:
+        return writeSynthetic(output, events, multiplicity, seed=2)
+    finally:
+        if os.path.exists(output):
+            os.remove(output)
+
+
+def benchAnalyzerAll(dataset, events, multiplicity):
+    '''AnalyzerAll.process over every event'''
+    from Analyzer_All import AnalyzerAll
+    analysis = AnalyzerAll(dataset)
+    analysis.beginJob()
+    analysis.ActivateBranches()
+    for event in range(analysis.numEntries):
+        analysis.process(event)
+    analysis.FlushHistograms()
+    return analysis.numEntries
+
+
+def benchAnalyzerSel(dataset, events, multiplicity):
+    '''AnalyzerSel.process with a Selector over every event'''
+    from Analyzer_Selection import AnalyzerSel
+    from Selector import Selector
+    analysis = AnalyzerSel(dataset)
+    selector = Selector()
+    analysis.beginJob()
+    analysis.ActivateBranches(selector)
+    for event in range(analysis.numEntries):
+        analysis.process(event, selector)
+    analysis.FlushHistograms()
+    return analysis.numEntries
+
+
+def benchAnalyzerAllColumns(dataset, events, multiplicity):
+    '''AnalyzerAll.processColumns over every chunk'''
+    from Analyzer_All import AnalyzerAll
+    analysis = AnalyzerAll(dataset)
+    analysis.beginJob()
+    for start, stop, columns in analysis.readAhead():
+        analysis.processColumns(start, stop, columns)
+    analysis.FlushHistograms()
+    return analysis.numEntries
+
+
+def benchAnalyzerSelColumns(dataset, events, multiplicity):
+    '''AnalyzerSel.processColumns with a Selector over every chunk'''
+    from Analyzer_Selection import AnalyzerSel
+    from Selector import Selector
+    analysis = AnalyzerSel(dataset)
+    selector = Selector()
+    analysis.beginJob()
+    for start, stop, columns in analysis.readAhead():
+        analysis.processColumns(start, stop, selector, columns)
+    analysis.FlushHistograms()
+    return analysis.numEntries
+
+
+def benchTreeProject(dataset, events, multiplicity):
+    '''FillHistogramsFromTree with the default cuts: one tree.Project per histogram'''
+    from Analyzer_Selection import AnalyzerSel
+    from Cuts import Cuts
+    analysis = AnalyzerSel(dataset)
+    analysis.beginJob()
+    analysis.FillHistogramsFromTree(Cuts())
+    return analysis.numEntries
+
+
+def benchEfficiency(dataset, events, multiplicity):
+    '''FillEfficiency with the sequential selection: one tree.Draw per stage'''
+    from Analyzer_Selection import AnalyzerSel
+    from Cuts import Cuts
+    analysis = AnalyzerSel(dataset)
+    analysis.beginJob()
+    analysis.FillEfficiency(analysis.h_efficiency, Cuts().sequentialSelection())
+    return analysis.numEntries
+
+
+def benchPairs(dataset, events, multiplicity):
+    '''Dimuon pair loop of the event loop: every pair of every event and its mass'''
+    from Analyzer_All import AnalyzerAll
+    analysis = AnalyzerAll(dataset)
+    analysis.beginJob()
+    analysis.tree.SetBranchStatus("*", 0)
+    for branch in ('Muon_pt', 'Muon_px', 'Muon_py', 'Muon_pz', 'Muon_energy', 'Muon_charge'):
+        analysis.tree.SetBranchStatus(branch, 1)
+    for event in range(analysis.numEntries):
+        analysis.tree.GetEntry(event)
+        if analysis.Muon_pt.size() > 1:
+            pairs = analysis.EventPairs()
+            for mass in pairs['mass'][pairs['chargeProduct'] < 0]:
+                analysis.h_mass.Fill(mass)
+    return analysis.numEntries
+
+
+BENCHMARKS = [
+    ('conversion', benchConversion),
+    ('analyzerAll', benchAnalyzerAll),
+    ('analyzerSel', benchAnalyzerSel),
+    ('analyzerAllColumns', benchAnalyzerAllColumns),
+    ('analyzerSelColumns', benchAnalyzerSelColumns),
+    ('treeProject', benchTreeProject),
+    ('efficiency', benchEfficiency),
+    ('pairs', benchPairs),
+]
+
+
+def syntheticDataset(directory, events, multiplicity, seed=1):
+    '''Path of a synthetic dataset of this size, written the first time it is asked for'''
+    from Synthetic import writeSynthetic
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    path = os.path.join(directory, "synthetic_{0}_{1}_{2}.root".format(events, multiplicity, seed))
+    if not os.path.exists(path):
+        writeSynthetic(path + ".tmp", events, multiplicity, seed)
+        os.rename(path + ".tmp", path)
+    return path
+
+
+def runOne(name, dataset, events, multiplicity):
+    '''Run a benchmark in this process: {events, seconds, eventsPerSecond, peakMemory}'''
+    disableCaches()
+    function = dict(BENCHMARKS)[name]
+    start = time.time()
+    processed = function(dataset, events, multiplicity)
+    seconds = time.time() - start
+    return {
+        'events': processed,
+        'seconds': seconds,
+        'eventsPerSecond': processed/seconds if seconds > 0 else 0.,
+        'peakMemory': peakMemory(),
+    }
+
+
+def runIsolated(name, dataset, events, multiplicity):
+    '''Run a benchmark in a fresh process, so that the peak memory is its own'''
+    handle, output = tempfile.mkstemp(suffix='.json')
+    os.close(handle)
+    try:
+        with open(os.devnull, 'w') as devnull:
+            subprocess.check_call([sys.executable, os.path.abspath(__file__), '--single', name,
+                                   '--dataset', dataset, '--events', str(events),
+                                   '--multiplicity', str(multiplicity), '--output', output],
+                                  stdout=devnull)
+        with open(output) as result:
+            return json.load(result)
+    finally:
+        os.remove(output)
+
+
+def runSuite(names, events, multiplicity, repeat=1, directory="datafiles/benchmark"):
+    '''
+    Run benchmarks on a synthetic dataset, each repeat times, keeping the fastest run
+    returns: dictionary of the results, as written by writeResults
+    '''
+    dataset = syntheticDataset(directory, events, multiplicity)
+    results = {}
+    for name in names:
+        runs = [runIsolated(name, dataset, events, multiplicity) for k in range(repeat)]
+        results[name] = max(runs, key=lambda run: run['eventsPerSecond'])
+        results[name]['peakMemory'] = max(run['peakMemory'] for run in runs)
+        print("{0:20s} {1:12.0f} events/s {2:8.1f} MB".format(name, results[name]['eventsPerSecond'],
+                                                               results[name]['peakMemory']/1024.**2))
+    return {
+        'events': events,
+        'multiplicity': multiplicity,
+        'repeat': repeat,
+        'machine': {'python': platform.python_version(), 'platform': platform.platform(), 'node': platform.node()},
+        'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'benchmarks': results,
+    }
+
+
+def writeResults(results, path):
+    with open(path + ".tmp", 'w') as output:
+        json.dump(results, output, indent=1, sort_keys=True)
+    os.rename(path + ".tmp", path)
+
+
+def compare(results, baseline, tolerance=0.1):
+    '''
+    Compare results against a baseline
+    tolerance: relative change allowed before a benchmark counts as a regression
+    returns: list of {benchmark, metric, baseline, value, change} for every regression
+    '''
+    regressions = []
+    for name, result in sorted(results['benchmarks'].items()):
+        reference = baseline['benchmarks'].get(name)
+        if reference is None:
+            continue
+        # Fewer events per second, or more memory, is worse
+        for metric, sign in (('eventsPerSecond', -1), ('peakMemory', 1)):
+            if not reference[metric]:
+                continue
+            change = float(result[metric] - reference[metric])/reference[metric]
+            if sign*change > tolerance:
+                regressions.append({'benchmark': name, 'metric': metric, 'baseline': reference[metric],
+                                    'value': result[metric], 'change': change})
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--events', type=int, default=100000, help="events of the synthetic dataset")
+    parser.add_argument('--multiplicity', type=float, default=1., help="mean number of non-prompt muons per event")
+    parser.add_argument('--benchmarks', nargs='+', default=[name for name, function in BENCHMARKS],
+                        choices=[name for name, function in BENCHMARKS])
+    parser.add_argument('--repeat', type=int, default=1, help="runs of each benchmark, the fastest is kept")
+    parser.add_argument('--output', default="datafiles/benchmark.json")
+    parser.add_argument('--baseline', help="baseline results to compare with")
+    parser.add_argument('--save-baseline', help="also store the results as a baseline")
+    parser.add_argument('--tolerance', type=float, default=0.1, help="relative change counted as a regression")
+    parser.add_argument('--single', help=argparse.SUPPRESS)
+    parser.add_argument('--dataset', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.single:
+        # Child process of runIsolated
+        writeResults(runOne(args.single, args.dataset, args.events, args.multiplicity), args.output)
+        return 0
+
+    results = runSuite(args.benchmarks, args.events, args.multiplicity, args.repeat)
+    writeResults(results, args.output)
+    if args.save_baseline:
+        writeResults(results, args.save_baseline)
+    if args.baseline:
+        with open(args.baseline) as baseline:
+            regressions = compare(results, json.load(baseline), args.tolerance)
+        for regression in regressions:
+            print("REGRESSION {benchmark} {metric}: {baseline:.4g} -> {value:.4g} ({change:+.1%})".format(**regression))
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,91 @@
+import re
+import inspect
+import textwrap
+import tokenize
+
+from Cuts import Cuts
+
+WORD = re.compile(r'[A-Za-z_]\w*')
+
+
+def sourceWords(function):
+    '''Identifiers used by a function and words inside its strings (comments excluded)'''
+    lines = iter(textwrap.dedent(inspect.getsource(function)).splitlines(True))
+    words = set()
+    for token in tokenize.generate_tokens(lambda: next(lines, '')):
+        if token[0] == tokenize.NAME:
+            words.add(token[1])
+        elif token[0] == tokenize.STRING:
+            words.update(WORD.findall(token[1]))
+    return words
+
+
+def reachableMethods(cls, entry):
+    '''
+    Methods of a class reachable from one of them through self.method(...) calls
+    returns: list of functions
+    '''
+    todo, seen, methods = [entry], set(), []
+    while todo:
+        name = todo.pop()
+        if name in seen:
+            continue
+        seen.add(name)
+        method = getattr(cls, name, None)
+        if method is None or not callable(method):
+            continue
+        try:
+            source = textwrap.dedent(inspect.getsource(method))
+        except (IOError, TypeError):
+            continue
+        methods.append(method)
+        todo.extend(re.findall(r'self\.(\w+)\s*\(', source))
+    return methods
+
+
+def treeAliases(tree):
+    '''Aliases of a tree: {alias: formula}'''
+    aliases = tree.GetListOfAliases() if hasattr(tree, 'GetListOfAliases') else None
+    return dict((alias.GetName(), alias.GetTitle()) for alias in aliases) if aliases else {}
+
+
+def formulaBranches(words, branches, aliases):
+    '''Branches among a set of words, following the aliases to their formulas'''
+    used = set(words) & branches
+    todo = list(set(words) & set(aliases))
+    seen = set()
+    while todo:
+        alias = todo.pop()
+        if alias in seen:
+            continue
+        seen.add(alias)
+        words = WORD.findall(aliases[alias])
+        used |= set(words) & branches
+        todo.extend(set(words) & set(aliases))
+    return used
+
+
+def usedBranches(analysis, args=(), entry='process'):
+    '''
+    Branches read by the event loop of an analysis: the branch attributes used by
+    the methods reachable from process, the branches of its histogram table
+    (HISTOGRAMS, filled by FillEvent), and the branches of the cuts passed to it
+    (a Cuts, or an object holding one as .cuts like Selector), including the ones
+    referenced by the cut strings and by tree aliases
+    analysis: Analyzer instance
+    args: extra arguments of process
+    returns: set of branch names
+    '''
+    branches = set(analysis.BranchNames())
+    aliases = treeAliases(analysis.tree)
+    words = set()
+    for method in reachableMethods(type(analysis), entry):
+        words |= sourceWords(method)
+    for spec in getattr(analysis, 'HISTOGRAMS', ()):
+        words |= spec.words()
+    for arg in args:
+        cuts = arg if isinstance(arg, Cuts) else getattr(arg, 'cuts', None)
+        if isinstance(cuts, Cuts):
+            words |= set(cuts.BRANCHES)
+            words |= set(WORD.findall(cuts.fullSelection()))
+    return formulaBranches(words, branches, aliases)
@@ -0,0 +1,206 @@
+import os
+import json
+import errno
+import hashlib
+import numpy
+
+from Columns import readColumns, entryRanges, branchType, DTYPES
+from ColumnStore import ColumnStore, FORMAT
+from Dataset import datasetIdentity
+
+
+def processAlive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError as error:
+        return error.errno == errno.EPERM
+    return True
+
+
+class ColumnCache(object):
+    '''
+    Persistent cache of decompressed branches. The first time a branch of a
+    dataset is read, the whole branch is decompressed into the layout of a
+    ColumnStore (<branch>.data and <branch>.offsets) under a directory keyed by
+    the identity of the dataset files. Every later read, from any process,
+    memory-maps these files instead of going through ROOT.
+
+    A changed input file gets a new key, and its old columns age out: the least
+    recently used branches are removed once the cache exceeds maxBytes.
+    '''
+    def __init__(self, directory="datafiles/columncache", maxBytes=2*1024**3, chunkSize=100000):
+        '''
+        directory: root directory of the cache
+        maxBytes: size of the cache above which the least recently used branches are removed
+        chunkSize: entries read from the tree at once when a branch is cached
+        '''
+        self.directory = directory
+        self.maxBytes = maxBytes
+        self.chunkSize = chunkSize
+        # Open ColumnStore of every cache entry used by this process
+        self.stores = {}
+
+    def entry(self, dataset, treeName="muons"):
+        '''Directory of the cached columns of a dataset'''
+        identity = json.dumps([treeName, datasetIdentity(dataset)])
+        return os.path.join(self.directory, hashlib.sha1(identity.encode('utf-8')).hexdigest()[:16])
+
+    def describe(self, directory, branch):
+        '''Metadata of a cached branch, None if it is not cached'''
+        try:
+            with open(os.path.join(directory, branch + '.json')) as meta:
+                return json.load(meta)
+        except (IOError, OSError):
+            return None
+
+    def readColumns(self, tree, dataset, branches, start=0, stop=None):
+        '''
+        Same as Columns.readColumns, caching the branches which are not cached yet.
+        A branch being cached by another process is read from the tree meanwhile.
+        '''
+        directory = self.entry(dataset)
+        if directory not in self.stores:
+            self.stores[directory] = ColumnStore(directory, {'format': FORMAT, 'entries': int(tree.GetEntries()), 'branches': {}})
+        store = self.stores[directory]
+
+        uncached = []
+        filled = False
+        for branch in branches:
+            if branch in store.meta['branches']:
+                if self.touch(directory, branch):
+                    continue
+                # Evicted meanwhile by another process or reading thread: cached again
+                store.meta['branches'].pop(branch, None)
+                store.cache.pop(branch, None)
+            meta = self.describe(directory, branch)
+            if meta is None:
+                meta = self.fill(tree, directory, branch)
+                filled = filled or meta is not None
+            if meta is None or not self.touch(directory, branch):
+                uncached.append(branch)
+                continue
+            store.meta['branches'][branch] = meta
+
+        columns = store.readColumns([branch for branch in branches if branch not in uncached], start, stop)
+        if uncached:
+            columns.update(readColumns(tree, uncached, start, stop))
+        if filled:
+            self.evict(self.maxBytes, directory, branches)
+        return columns
+
+    def touch(self, directory, branch):
+        '''Record the last use of a cached branch, for the eviction; False if it is no longer cached'''
+        try:
+            os.utime(os.path.join(directory, branch + '.json'), None)
+        except OSError:
+            return False
+        return True
+
+    def fill(self, tree, directory, branch):
+        '''
+        Decompress a whole branch into the cache
+        returns: the metadata of the cached branch, None if another process is caching it
+        '''
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                pass
+        lock = os.path.join(directory, branch + '.lock')
+        if not self.acquire(lock):
+            return None
+        try:
+            # Another process may have cached it before we took the lock
+            meta = self.describe(directory, branch)
+            if meta is not None:
+                return meta
+            dtype = numpy.dtype(DTYPES[branchType(tree, branch)])
+            temporary = os.path.join(directory, "{0}.{1}".format(branch, os.getpid()))
+            length = 0
+            with open(temporary + '.data', 'wb') as data:
+                with open(temporary + '.offsets', 'wb') as offsets:
+                    numpy.zeros(1, dtype=numpy.int64).tofile(offsets)
+                    for start, stop in entryRanges(int(tree.GetEntries()), self.chunkSize):
+                        column = readColumns(tree, [branch], start, stop)[branch]
+                        numpy.asarray(column.content, dtype=dtype).tofile(data)
+                        (column.offsets[1:] + length).tofile(offsets)
+                        length += len(column.content)
+            # The metadata is written last: a branch is cached once its .json exists
+            for suffix in ('.data', '.offsets'):
+                os.rename(temporary + suffix, os.path.join(directory, branch + suffix))
+            meta = {'dtype': dtype.name, 'length': length, 'compressed': False}
+            with open(temporary + '.json', 'w') as output:
+                json.dump(meta, output)
+            os.rename(temporary + '.json', os.path.join(directory, branch + '.json'))
+            return meta
+        finally:
+            os.remove(lock)
+
+    def acquire(self, lock):
+        '''Create a lock file holding our pid; a lock left by a dead process is taken over'''
+        try:
+            descriptor = os.open(lock, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except OSError:
+            try:
+                with open(lock) as owner:
+                    pid = int(owner.read() or 0)
+            except (IOError, OSError, ValueError):
+                return False
+            if pid and processAlive(pid):
+                return False
+            os.remove(lock)
+            return self.acquire(lock)
+        os.write(descriptor, str(os.getpid()).encode('ascii'))
+        os.close(descriptor)
+        return True
+
+    def cachedBranches(self):
+        '''Cached branches, least recently used first: list of (last use, bytes, entry directory, branch)'''
+        cached = []
+        if not os.path.isdir(self.directory):
+            return cached
+        for key in os.listdir(self.directory):
+            directory = os.path.join(self.directory, key)
+            for name in os.listdir(directory):
+                if not name.endswith('.json'):
+                    continue
+                branch = name[:-len('.json')]
+                try:
+                    used = os.path.getmtime(os.path.join(directory, name))
+                    size = sum(os.path.getsize(os.path.join(directory, branch + suffix)) for suffix in ('.data', '.offsets'))
+                except OSError:
+                    continue
+                cached.append((used, size, directory, branch))
+        return sorted(cached)
+
+    def evict(self, maxBytes, protectedDirectory=None, protectedBranches=()):
+        '''
+        Remove the least recently used branches until the cache fits in maxBytes
+        protectedDirectory, protectedBranches: branches in use, never removed
+        '''
+        cached = self.cachedBranches()
+        total = sum(size for used, size, directory, branch in cached)
+        for used, size, directory, branch in cached:
+            if total <= maxBytes:
+                break
+            if directory == protectedDirectory and branch in protectedBranches:
+                continue
+            # The .json goes first: the branch is no longer cached before its files disappear
+            for suffix in ('.json', '.data', '.offsets'):
+                try:
+                    os.remove(os.path.join(directory, branch + suffix))
+                except OSError:
+                    pass
+            total -= size
+            if directory in self.stores:
+                self.stores[directory].meta['branches'].pop(branch, None)
+                self.stores[directory].cache.pop(branch, None)
+            try:
+                os.rmdir(directory)
+            except OSError:
+                # Not empty yet, or being filled by another process
+                pass
+
+    def clear(self):
+        '''Remove every cached branch'''
+        self.evict(-1)
@@ -0,0 +1,243 @@
+import os
+import json
+import zlib
+import numpy
+
+from Columns import JaggedArray
+
+# Version of the directory layout written by ColumnStoreWriter
+FORMAT = 1
+
+# numpy dtype of each C++ element type of the muons tree
+DTYPES = {
+    'float': 'float32',
+    'int': 'int32',
+}
+
+
+def isColumnStore(path):
+    return os.path.isfile(os.path.join(path, 'meta.json'))
+
+
+def readMeta(path):
+    with open(os.path.join(path, 'meta.json')) as meta:
+        return json.load(meta)
+
+
+def writeMeta(path, meta):
+    '''Write meta.json through a temporary file: the store is always described by a complete meta'''
+    name = os.path.join(path, 'meta.json')
+    with open(name + '.tmp', 'w') as output:
+        json.dump(meta, output, indent=1)
+    os.rename(name + '.tmp', name)
+
+
+class ColumnStoreWriter(object):
+    '''
+    Columnar copy of the muons tree: a directory with, for every branch, the
+    contents of all its vectors in one contiguous typed file (<branch>.data) and
+    the event offsets in another (<branch>.offsets, int64, entries + 1 values),
+    described by meta.json.
+
+    Batches are appended to the files, and commit() records how much of them is
+    valid. Anything written after the last commit is cut away on resume.
+    '''
+    def __init__(self, path, branches, resume=False):
+        '''
+        path: directory of the store
+        branches: list of (branch name, C++ element type)
+        resume: append to the store left by a previous conversion
+        '''
+        self.path = path
+        self.branches = [(name, DTYPES[ctype]) for name, ctype in branches]
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+        if resume and isColumnStore(path):
+            meta = readMeta(path)
+            self.entries = meta['entries']
+            self.lengths = dict((name, column['length']) for name, column in meta['branches'].items())
+            for name, dtype in self.branches:
+                if meta['branches'][name]['compressed']:
+                    self.decompress(name, dtype)
+        else:
+            self.entries = 0
+            self.lengths = dict((name, 0) for name, dtype in self.branches)
+            for name, dtype in self.branches:
+                for suffix in ('.data', '.offsets'):
+                    with open(self.file(name, suffix), 'wb') as output:
+                        if suffix == '.offsets':
+                            numpy.zeros(1, dtype=numpy.int64).tofile(output)
+                    # Compressed copies left by an earlier conversion into this directory
+                    if os.path.exists(self.file(name, suffix + '.zlib')):
+                        os.remove(self.file(name, suffix + '.zlib'))
+            self.commit()
+
+    def file(self, name, suffix):
+        return os.path.join(self.path, name + suffix)
+
+    def append(self, name, content, offsets):
+        '''
+        Append a batch of events to one branch
+        content: flat array of the values of the batch
+        offsets: event offsets of the batch, starting at 0
+        '''
+        dtype = dict(self.branches)[name]
+        with open(self.file(name, '.data'), 'ab') as output:
+            numpy.asarray(content, dtype=dtype).tofile(output)
+        with open(self.file(name, '.offsets'), 'ab') as output:
+            (numpy.asarray(offsets[1:], dtype=numpy.int64) + self.lengths[name]).tofile(output)
+        self.lengths[name] += len(content)
+
+    def endBatch(self, events):
+        '''Count the events of a batch appended to every branch'''
+        self.entries += events
+
+    def commit(self, compressed=False):
+        '''Record the current content of the files as valid'''
+        writeMeta(self.path, {
+            'format': FORMAT,
+            'entries': self.entries,
+            'branches': dict((name, {'dtype': dtype, 'length': self.lengths[name], 'compressed': compressed})
+                             for name, dtype in self.branches),
+        })
+
+    def truncate(self, entries):
+        '''Keep the first entries events only, e.g. those of the tree written next to the store'''
+        for name, dtype in self.branches:
+            offsets = numpy.fromfile(self.file(name, '.offsets'), dtype=numpy.int64, count=entries + 1)
+            self.lengths[name] = int(offsets[entries])
+            with open(self.file(name, '.offsets'), 'r+b') as column:
+                column.truncate((entries + 1)*numpy.dtype(numpy.int64).itemsize)
+            with open(self.file(name, '.data'), 'r+b') as column:
+                column.truncate(self.lengths[name]*numpy.dtype(dtype).itemsize)
+        self.entries = entries
+        self.commit()
+
+    def decompress(self, name, dtype):
+        for suffix in ('.data', '.offsets'):
+            with open(self.file(name, suffix + '.zlib'), 'rb') as column:
+                data = zlib.decompress(column.read())
+            with open(self.file(name, suffix), 'wb') as column:
+                column.write(data)
+            os.remove(self.file(name, suffix + '.zlib'))
+
+    def close(self, compress=False):
+        '''
+        Commit the store, compressing every file with zlib if asked: smaller on disk,
+        but read into memory instead of memory-mapped
+        '''
+        if compress:
+            for name, dtype in self.branches:
+                for suffix in ('.data', '.offsets'):
+                    with open(self.file(name, suffix), 'rb') as column:
+                        data = zlib.compress(column.read())
+                    with open(self.file(name, suffix + '.zlib'), 'wb') as column:
+                        column.write(data)
+                    os.remove(self.file(name, suffix))
+        self.commit(compress)
+
+
+class VectorView(object):
+    '''
+    Values of one branch in the current entry of a ColumnStore, bound once like
+    the branch buffers of a TTree: size(), indexing and iteration as on a
+    std::vector, and numpy.asarray gives the values without copy.
+    '''
+    def __init__(self, column):
+        self.column = column
+        self.values = column.content[:0]
+
+    def set(self, entry):
+        self.values = self.column[entry]
+
+    def size(self):
+        return len(self.values)
+
+    def __len__(self):
+        return len(self.values)
+
+    def __getitem__(self, index):
+        return self.values[index].item()
+
+    def __iter__(self):
+        return (value.item() for value in self.values)
+
+    def __array__(self, dtype=None, copy=None):
+        return self.values if dtype is None else self.values.astype(dtype)
+
+
+class ColumnStore(object):
+    '''
+    Reader of a store written by ColumnStoreWriter. Columns are memory-mapped
+    (read into memory when compressed) and only the branches used are touched.
+
+    Exposes the part of the TTree interface used by the event loop and by the
+    columnar mode: GetEntries, GetEntry, GetReadEntry, and one VectorView per
+    branch. TTreeFormula based methods (Project, Draw) need the ROOT tree.
+    '''
+    def __init__(self, path, meta=None):
+        '''
+        path: directory of the store
+        meta: description of the store, instead of its meta.json (used by the column cache)
+        '''
+        self.path = path
+        self.meta = meta if meta is not None else readMeta(path)
+        if self.meta['format'] != FORMAT:
+            raise ValueError("Unknown column store format {0} in {1}".format(self.meta['format'], path))
+        self.cache = {}
+        self.views = {}
+        self.entry = -1
+
+    def branches(self):
+        return sorted(self.meta['branches'].keys())
+
+    def load(self, name, suffix, dtype, length, compressed=False):
+        '''Values of one file of a branch, from its .zlib copy when the meta says it is compressed'''
+        path = os.path.join(self.path, name + suffix)
+        if compressed:
+            with open(path + '.zlib', 'rb') as column:
+                return numpy.frombuffer(zlib.decompress(column.read()), dtype=dtype)[:length]
+        if not length:
+            return numpy.zeros(0, dtype=dtype)
+        return numpy.memmap(path, dtype=dtype, mode='r', shape=(length,))
+
+    def column(self, name):
+        '''Whole branch as a JaggedArray'''
+        if name not in self.cache:
+            column = self.meta['branches'][name]
+            compressed = column.get('compressed', False)
+            self.cache[name] = JaggedArray(self.load(name, '.data', column['dtype'], column['length'], compressed),
+                                           self.load(name, '.offsets', 'int64', self.meta['entries'] + 1, compressed))
+        return self.cache[name]
+
+    def readColumns(self, branches, start=0, stop=None):
+        '''Same as Columns.readColumns: the contents are views of the mapped files'''
+        if stop is None or stop > self.meta['entries']:
+            stop = self.meta['entries']
+        columns = {}
+        for name in branches:
+            column = self.column(name)
+            offsets = column.offsets[start:stop+1]
+            columns[name] = JaggedArray(column.content[offsets[0]:offsets[-1]], offsets - offsets[0])
+        return columns
+
+    def view(self, name):
+        '''VectorView of a branch, following GetEntry'''
+        if name not in self.views:
+            self.views[name] = VectorView(self.column(name))
+            if self.entry >= 0:
+                self.views[name].set(self.entry)
+        return self.views[name]
+
+    def GetEntries(self):
+        return self.meta['entries']
+
+    def GetEntry(self, entry):
+        self.entry = entry
+        for view in self.views.values():
+            view.set(entry)
+        return 1
+
+    def GetReadEntry(self):
+        return self.entry
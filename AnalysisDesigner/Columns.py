@@ -0,0 +1,359 @@
+import numpy
+import ROOT
+
+# C++ helper that reads one vector branch over a range of entries into a flat
+# content vector plus per-event offsets, so a whole chunk costs a single
+# Python -> C++ call per branch instead of one GetEntry per event.
+_READER_CODE = '''
+#include <vector>
+#include "TTree.h"
+#include "TTreeReader.h"
+#include "TTreeReaderValue.h"
+
+template <typename T>
+Long64_t CmsOpenData_readJagged(TTree* tree, const char* name, Long64_t start, Long64_t stop,
+                                std::vector<T>& content, std::vector<Long64_t>& offsets)
+{
+    TTreeReader reader(tree);
+    TTreeReaderValue<std::vector<T> > values(reader, name);
+    reader.SetEntriesRange(start, stop);
+    content.clear();
+    offsets.assign(1, 0);
+    while (reader.Next()) {
+        content.insert(content.end(), values->begin(), values->end());
+        offsets.push_back(content.size());
+    }
+    return offsets.size() - 1;
+}
+'''
+_readerDeclared = False
+_readers = {}
+
+
+def jaggedReader(ctype):
+    '''CmsOpenData_readJagged for one element type'''
+    if ctype not in _readers:
+        reader = ROOT.CmsOpenData_readJagged[ctype]
+        try:
+            # Let other Python threads run while a chunk is read and unzipped (see ReadAhead)
+            reader.__release_gil__ = True
+        except (AttributeError, TypeError):
+            pass
+        _readers[ctype] = reader
+    return _readers[ctype]
+
+# numpy dtype of each C++ element type used by the muons tree
+DTYPES = {
+    'float': numpy.float32,
+    'double': numpy.float64,
+    'int': numpy.int32,
+}
+
+
+class JaggedArray(object):
+    '''Variable-length per-event array: a flat content array plus event offsets
+
+    The muons of event i are content[offsets[i]:offsets[i+1]].
+    '''
+    def __init__(self, content, offsets):
+        self.content = numpy.asarray(content)
+        self.offsets = numpy.asarray(offsets, dtype=numpy.int64)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, event):
+        return self.content[self.offsets[event]:self.offsets[event+1]]
+
+    def counts(self):
+        '''Number of elements in each event'''
+        return numpy.diff(self.offsets)
+
+    def parents(self):
+        '''Event index of each content element'''
+        return numpy.repeat(numpy.arange(len(self)), self.counts())
+
+    def localIndex(self):
+        '''Position of each content element inside its own event'''
+        return numpy.arange(len(self.content)) - numpy.repeat(self.offsets[:-1], self.counts())
+
+    @classmethod
+    def fromLists(cls, lists, dtype=None):
+        '''Build a JaggedArray from a sequence of per-event sequences'''
+        counts = numpy.array([len(l) for l in lists], dtype=numpy.int64)
+        offsets = numpy.zeros(len(counts) + 1, dtype=numpy.int64)
+        numpy.cumsum(counts, out=offsets[1:])
+        return cls(numpy.array([x for l in lists for x in l], dtype=dtype), offsets)
+
+
+class Subset(object):
+    '''
+    Read-only view of aligned muon columns restricted to a subset of muons
+    (all of them if index is None). Each branch is gathered, as double, the
+    first time it is asked for, so cuts only pay for the branches they read.
+    '''
+    def __init__(self, columns, index=None):
+        self.columns = columns
+        self.index = index
+        self.cache = {}
+
+    def __getitem__(self, branch):
+        if branch not in self.cache:
+            values = self.columns[branch]
+            if self.index is not None:
+                values = values[self.index]
+            self.cache[branch] = numpy.asarray(values, dtype=numpy.float64)
+        return self.cache[branch]
+
+
+def branchType(tree, name):
+    '''C++ element type of a vector branch, e.g. "float" for vector<float>'''
+    className = tree.GetBranch(name).GetClassName()
+    return className[className.index('<')+1:className.rindex('>')].strip()
+
+
+def readColumns(tree, branches, start=0, stop=None):
+    '''
+    Read vector branches for the entries [start, stop) as JaggedArrays
+    tree: TTree/TChain holding the branches, or a ColumnStore
+    branches: list of branch names to read
+    returns: dictionary {branch name: JaggedArray}
+    '''
+    global _readerDeclared
+    if hasattr(tree, 'readColumns'):
+        # Columnar backend (ColumnStore): the columns are already stored as jagged arrays
+        return tree.readColumns(branches, start, stop)
+    if stop is None or stop > tree.GetEntries():
+        stop = tree.GetEntries()
+    if not _readerDeclared:
+        ROOT.gInterpreter.Declare(_READER_CODE)
+        _readerDeclared = True
+
+    columns = {}
+    for name in branches:
+        ctype = branchType(tree, name)
+        content = ROOT.std.vector(ctype)()
+        offsets = ROOT.std.vector('Long64_t')()
+        jaggedReader(ctype)(tree, name, start, stop, content, offsets)
+        columns[name] = JaggedArray(numpy.array(content, dtype=DTYPES[ctype]),
+                                    numpy.array(offsets, dtype=numpy.int64))
+    return columns
+
+
+def commonInstances(columns, branches):
+    '''
+    Restrict several columns, in every event, to the first n elements, n being
+    their smallest multiplicity in that event (as TTreeFormula loops over them)
+    returns: dictionary {branch name: flat array}, all arrays aligned
+    '''
+    counts = [columns[b].counts() for b in branches]
+    common = numpy.minimum.reduce(counts)
+    aligned = {}
+    for branch, count in zip(branches, counts):
+        column = columns[branch]
+        if (count == common).all():
+            aligned[branch] = column.content
+        else:
+            aligned[branch] = column.content[column.localIndex() < numpy.repeat(common, count)]
+    return aligned
+
+
+class Instances(object):
+    '''
+    Muon branches spread over the instances of a reference branch, as
+    TTreeFormula pairs them: instance i of a branch goes with instance i of the
+    reference in the same event. A branch with fewer values in an event
+    (Muon_NValidHitsSATk is only written for the standalone muons) is missing
+    for the last instances of the reference and reads NaN there; values beyond
+    the reference are not used. Each branch is spread the first time it is
+    asked for.
+    '''
+    def __init__(self, columns, reference='Muon_pt'):
+        '''columns: dictionary {branch name: JaggedArray}, e.g. from readColumns'''
+        self.columns = columns
+        self.reference = columns[reference]
+        self.values = {}
+        # branch: True for the instances where it has a value, None if it has all of them
+        self.present = {}
+        self.parents = None
+        self.local = None
+
+    def __len__(self):
+        return len(self.reference.content)
+
+    def spread(self, branch):
+        if branch in self.values:
+            return
+        column = self.columns[branch]
+        counts = column.counts()
+        if (counts == self.reference.counts()).all():
+            self.values[branch] = column.content
+            self.present[branch] = None
+            return
+        if self.parents is None:
+            self.parents = self.reference.parents()
+            self.local = self.reference.localIndex()
+        present = self.local < counts[self.parents]
+        values = numpy.full(len(self), numpy.nan)
+        values[present] = column.content[column.offsets[self.parents[present]] + self.local[present]]
+        self.values[branch] = values
+        self.present[branch] = present
+
+    def __getitem__(self, branch):
+        self.spread(branch)
+        return self.values[branch]
+
+    def available(self, branches):
+        '''True for the instances where every branch has a value, None if they all have one'''
+        mask = None
+        for branch in branches:
+            self.spread(branch)
+            if self.present[branch] is not None:
+                mask = self.present[branch] if mask is None else mask & self.present[branch]
+        return mask
+
+
+def availableInstances(columns, branches):
+    '''Instances.available for Instances, None (every instance) for aligned flat arrays'''
+    return columns.available(branches) if isinstance(columns, Instances) else None
+
+
+def entryRanges(numEntries, chunkSize, start=0):
+    '''Split the entries [start, numEntries) into consecutive (start, stop) chunks'''
+    for first in range(start, numEntries, chunkSize):
+        yield first, min(first + chunkSize, numEntries)
+
+
+### MUON PAIRS ###
+
+def pairIndices(offsets):
+    '''
+    All pairs i<j of elements inside the same event, as global content indices
+    offsets: event offsets of a jagged array
+    returns: (first, second) index arrays, ordered as a nested loop over events would give them
+    '''
+    offsets = numpy.asarray(offsets, dtype=numpy.int64)
+    counts = numpy.diff(offsets)
+    first, second = [numpy.zeros(0, dtype=numpy.int64)], [numpy.zeros(0, dtype=numpy.int64)]
+    # Events with the same multiplicity share the same pattern of local pairs
+    for n in numpy.unique(counts[counts > 1]):
+        i, j = numpy.triu_indices(n, 1)
+        start = offsets[:-1][counts == n][:, numpy.newaxis]
+        first.append((start + i).ravel())
+        second.append((start + j).ravel())
+    first, second = numpy.concatenate(first), numpy.concatenate(second)
+    order = numpy.lexsort((second, first))
+    return first[order], second[order]
+
+
+def invariantMass(px, py, pz, energy):
+    '''Mass of four-momenta arrays, with the sign convention of TLorentzVector.M()'''
+    mass2 = energy*energy - (px*px + py*py + pz*pz)
+    return numpy.sign(mass2)*numpy.sqrt(numpy.abs(mass2))
+
+
+def dimuonPairs(offsets, px, py, pz, energy, charge):
+    '''
+    Build every muon pair i<j of each event
+    offsets: event offsets shared by the muon arrays
+    px, py, pz, energy, charge: flat per-muon arrays
+    returns: dictionary of pair columns
+        first, second: muon indices in the flat arrays
+        mass: invariant mass of the pair
+        chargeProduct: product of both charges (< 0 for opposite charges)
+    '''
+    first, second = pairIndices(offsets)
+    px, py, pz, energy = [numpy.asarray(a, dtype=numpy.float64) for a in (px, py, pz, energy)]
+    charge = numpy.asarray(charge)
+    return {
+        'first': first,
+        'second': second,
+        'mass': invariantMass(px[first] + px[second], py[first] + py[second],
+                              pz[first] + pz[second], energy[first] + energy[second]),
+        'chargeProduct': charge[first]*charge[second],
+    }
+
+
+def columnPairs(columns):
+    '''dimuonPairs for the muons of a chunk read by readColumns'''
+    return dimuonPairs(columns['Muon_pt'].offsets,
+                       *[columns[b].content for b in ('Muon_px', 'Muon_py', 'Muon_pz', 'Muon_energy', 'Muon_charge')])
+
+
+### VECTORIZED BINNING ###
+
+def binIndices(values, nbins, xmin, xmax):
+    '''
+    Bin number of each value, computed like TAxis::FindBin for fixed bins:
+    0 is the underflow and nbins+1 the overflow (NaN goes to the overflow)
+    '''
+    values = numpy.asarray(values, dtype=numpy.float64)
+    bins = numpy.full(len(values), nbins + 1, dtype=numpy.int64)
+    bins[values < xmin] = 0
+    inRange = (values >= xmin) & (values < xmax)
+    bins[inRange] = 1 + (nbins*(values[inRange] - xmin)/(xmax - xmin)).astype(numpy.int64)
+    return bins
+
+
+def binValues(values, nbins, xmin, xmax):
+    '''
+    Histogram an array of values with unit weights
+    returns: (counts per bin including under/overflow, [sumw, sumw2, sumwx, sumwx2])
+    The statistics only include in-range values, as TH1::Fill does.
+    '''
+    values = numpy.asarray(values, dtype=numpy.float64)
+    bins = binIndices(values, nbins, xmin, xmax)
+    counts = numpy.bincount(bins, minlength=nbins + 2)
+    inRange = values[(bins > 0) & (bins <= nbins)]
+    stats = numpy.array([len(inRange), len(inRange), inRange.sum(), (inRange*inRange).sum()])
+    return counts, stats
+
+
+def addToHistogram(histo, counts, stats, entries):
+    '''
+    Add binned values to a TH1 in one go
+    counts: number of values in each bin, including under/overflow
+    stats: [sumw, sumw2, sumwx, sumwx2] of the in-range values
+    entries: number of values
+    '''
+    previous = numpy.zeros(4)
+    histo.GetStats(previous)
+    before = histo.GetEntries()
+    sumw2 = histo.GetSumw2() if histo.GetSumw2N() else None
+    for b in numpy.flatnonzero(counts):
+        b = int(b)
+        histo.SetBinContent(b, histo.GetBinContent(b) + float(counts[b]))
+        if sumw2 is not None:
+            sumw2.AddAt(sumw2.At(b) + float(counts[b]), b)
+    # SetBinContent resets the statistics and counts entries: restore them
+    histo.PutStats(previous + stats)
+    histo.SetEntries(before + entries)
+
+
+def fillHistogram(histo, values):
+    '''
+    Fill a TH1 with an array of values, with the same bin contents, entries
+    and statistics as calling histo.Fill on every value one by one
+    '''
+    values = numpy.asarray(values, dtype=numpy.float64)
+    if not len(values):
+        return
+    axis = histo.GetXaxis()
+    counts, stats = binValues(values, axis.GetNbins(), axis.GetXmin(), axis.GetXmax())
+    addToHistogram(histo, counts, stats, len(values))
+
+
+def fillHistogramCounts(histo, values, counts):
+    '''
+    Fill a TH1 with each value repeated counts times, with the same bin contents,
+    entries and statistics as counts[i] calls to histo.Fill(values[i])
+    '''
+    values = numpy.asarray(values, dtype=numpy.float64)
+    counts = numpy.asarray(counts, dtype=numpy.float64)
+    axis = histo.GetXaxis()
+    nbins = axis.GetNbins()
+    bins = binIndices(values, nbins, axis.GetXmin(), axis.GetXmax())
+    inRange = (bins > 0) & (bins <= nbins)
+    n, x = counts[inRange], values[inRange]
+    stats = numpy.array([n.sum(), n.sum(), (n*x).sum(), (n*x*x).sum()])
+    addToHistogram(histo, numpy.bincount(bins, counts, minlength=nbins + 2), stats, counts.sum())
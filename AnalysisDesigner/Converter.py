@@ -0,0 +1,64 @@
+import os
+import multiprocessing
+
+from createTTree import createTTree
+from Dataset import writeManifest
+from Runner import spawnPool
+
+
+def convertFile(task):
+    '''
+    Worker: convert one PAT tuple into its own shard
+    task: (data file, shard path, maxEv, checkpoint, resume)
+    returns: the manifest entry of the shard
+    '''
+    dataFile, path, maxEv, checkpoint, resume = task
+    entries = createTTree([dataFile], path).process(maxEv, checkpoint, resume)
+    return {'path': path, 'source': dataFile, 'entries': entries, 'bytes': os.path.getsize(path)}
+
+
+class ParallelConverter(object):
+    '''
+    Convert PAT tuples to muons trees in worker processes, one shard per input
+    file, and describe the shards in a manifest that Analyzer opens as a single
+    dataset (a TChain).
+    '''
+    def __init__(self, data_files, workers=None, name="mytree"):
+        '''
+        data_files: PAT tuples to convert
+        workers: number of processes (default: number of cores)
+        name: shards are written to datafiles/<name>.shards and the manifest to datafiles/<name>.json
+        '''
+        self.data_files = list(data_files)
+        self.workers = workers or multiprocessing.cpu_count()
+        self.name = name
+
+    def shard(self, index):
+        return "datafiles/{0}.shards/{0}_{1}.root".format(self.name, index)
+
+    def pool(self):
+        return spawnPool(self.workers)
+
+    def run(self, maxEv=-1, checkpoint=0, resume=False):
+        '''
+        Convert every data file and write the manifest
+        maxEv: maximum number of events converted from each data file (-1: all of them)
+        checkpoint, resume: as in createTTree.process, for every shard
+        returns: path of the manifest
+        '''
+        directory = "datafiles/{0}.shards".format(self.name)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        tasks = [(dataFile, self.shard(i), maxEv, checkpoint, resume) for i, dataFile in enumerate(self.data_files)]
+
+        pool = self.pool()
+        try:
+            # Files are handed out one at a time, so a slow file does not hold back others
+            shards = pool.map(convertFile, tasks, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+
+        path = "datafiles/{0}.json".format(self.name)
+        writeManifest(path, shards)
+        return path
@@ -0,0 +1,53 @@
+import numpy
+
+from Columns import Subset, availableInstances
+
+
+class CompiledCuts(object):
+    '''
+    Vectorized predicate compiled from a Cuts definition.
+
+    The cuts are evaluated one after the other, each one only on the muons that
+    survived the previous ones. Cheap cuts with a high rejection go first: the
+    order is ranked by cost/rejection, with the rejection of every cut learnt
+    from the chunks already evaluated. The mask does not depend on the order.
+    '''
+    def __init__(self, cuts):
+        self.cuts = cuts
+        self.columnCuts = cuts.columnCuts()
+        # Cost of a cut: number of branches it has to gather
+        self.cost = numpy.array([len(cuts.CUT_BRANCHES[name]) for name, cut in self.columnCuts], dtype=numpy.float64)
+        # Muons tested and passing each cut so far
+        self.tested = numpy.zeros(len(self.columnCuts), dtype=numpy.int64)
+        self.passed = numpy.zeros(len(self.columnCuts), dtype=numpy.int64)
+
+    def rejection(self):
+        '''Estimated fraction of muons rejected by each cut (one half before any data)'''
+        return 1. - (self.passed + 1.)/(self.tested + 2.)
+
+    def order(self):
+        '''Indices of the cuts in evaluation order'''
+        return numpy.argsort(self.cost/numpy.maximum(self.rejection(), 1e-6), kind='stable')
+
+    def __call__(self, columns):
+        '''
+        columns: dictionary {branch name: flat array} of aligned muon branches, or Instances
+        returns: boolean array, True for the muons passing every cut
+        '''
+        n = len(columns['Muon_pt'])
+        alive = None
+        for k in self.order():
+            name, cut = self.columnCuts[k]
+            present = availableInstances(columns, self.cuts.CUT_BRANCHES[name])
+            if present is not None:
+                # A muon lacking a branch of the cut fails it, as in TTreeFormula
+                alive = numpy.flatnonzero(present) if alive is None else alive[present[alive]]
+            passed = cut(Subset(columns, alive))
+            self.tested[k] += len(passed)
+            self.passed[k] += numpy.count_nonzero(passed)
+            alive = numpy.flatnonzero(passed) if alive is None else alive[passed]
+            if not len(alive):
+                break
+        mask = numpy.zeros(n, dtype=bool)
+        mask[alive] = True
+        return mask
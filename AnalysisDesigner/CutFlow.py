@@ -0,0 +1,110 @@
+import json
+import numpy
+
+from Columns import Instances, Subset, availableInstances
+
+
+class CutFlow(object):
+    '''
+    Cut flow of a Cuts selection, in the order of sequentialSelection.
+    Every cut is evaluated only on the muons that passed all the previous ones,
+    so each cut runs at most once per muon and a single scan fills every stage.
+    '''
+    def __init__(self, cuts):
+        self.cuts = cuts
+        self.columnCuts = cuts.columnCuts()
+        self.names = ['all'] + [name for name, cut in self.columnCuts]
+        # Number of muons first rejected by each cut (last one: selected muons)
+        self.rejected = numpy.zeros(len(self.names), dtype=numpy.int64)
+
+    def stages(self, columns):
+        '''
+        Number of consecutive cuts passed by every muon: the stage of the first
+        cut rejecting it, or the number of cuts if the muon is selected
+        columns: dictionary {branch name: flat array} of aligned muon branches, or Instances
+        '''
+        stage = numpy.zeros(len(columns['Muon_pt']), dtype=numpy.int64)
+        alive = numpy.arange(len(stage))
+        for name, cut in self.columnCuts:
+            if not len(alive):
+                break
+            present = availableInstances(columns, self.cuts.CUT_BRANCHES[name])
+            if present is not None:
+                # A muon lacking a branch of the cut fails it: TTreeFormula never reaches it
+                alive = alive[present[alive]]
+            alive = alive[cut(Subset(columns, alive))]
+            stage[alive] += 1
+        return stage
+
+    def bits(self, columns):
+        '''
+        Bitmask of the cuts passed by every muon: bit k is set if the muon passes
+        cut k. Every cut is evaluated once on every muon.
+        columns: dictionary {branch name: flat array} of aligned muon branches, or Instances
+        '''
+        view = Subset(columns)
+        bits = numpy.zeros(len(columns['Muon_pt']), dtype=numpy.uint16)
+        for k, (name, cut) in enumerate(self.columnCuts):
+            passed = cut(view)
+            present = availableInstances(columns, self.cuts.CUT_BRANCHES[name])
+            if present is not None:
+                passed &= present
+            bits |= passed.astype(numpy.uint16) << k
+        return bits
+
+    def stagesFromBits(self, bits):
+        '''Number of consecutive cuts passed by every muon, from its bitmask'''
+        stage = numpy.zeros(len(bits), dtype=numpy.int64)
+        alive = numpy.ones(len(bits), dtype=bool)
+        for k in range(len(self.columnCuts)):
+            alive &= (bits >> k) & 1 == 1
+            stage += alive
+        return stage
+
+    def allPassed(self):
+        '''Bitmask of a muon passing every cut'''
+        return (1 << len(self.columnCuts)) - 1
+
+    def fill(self, columns):
+        '''
+        Add the muons of a chunk to the cut flow
+        columns: dictionary {branch name: JaggedArray} from readColumns
+        returns: the stage of every muon of Muon_pt
+        '''
+        # Like the tree.Draw of each stage, a cut only passes the muons present in its branches
+        stage = self.stages(Instances(columns))
+        self.rejected += numpy.bincount(stage, minlength=len(self.names))
+        return stage
+
+    def counts(self):
+        '''Number of muons passing each stage: all muons, then each cut in turn'''
+        return self.rejected[::-1].cumsum()[::-1]
+
+    def result(self):
+        '''
+        Structured cut flow: one dictionary per stage with the number of muons
+        passing it, the cumulative efficiency (with respect to all muons) and the
+        relative efficiency (with respect to the previous stage)
+        '''
+        counts = [int(count) for count in self.counts()]
+        result = []
+        for stage, name in enumerate(self.names):
+            previous = counts[stage-1] if stage else counts[0]
+            result.append({
+                'stage': stage,
+                'name': name,
+                'muons': counts[stage],
+                'cumulative': float(counts[stage])/counts[0] if counts[0] else 0.,
+                'relative': float(counts[stage])/previous if previous else 0.,
+            })
+        return result
+
+    def FillHistogram(self, efficiency):
+        '''Set bin k+1 of the efficiency histogram to the muons passing stage k'''
+        for stage, count in enumerate(self.counts()):
+            efficiency.SetBinContent(stage + 1, float(count))
+
+    def write(self, name):
+        '''Write the structured cut flow to a JSON file'''
+        with open(name, 'w') as output:
+            json.dump(self.result(), output, indent=1)
@@ -0,0 +1,183 @@
+import itertools
+import json
+import numpy
+import ROOT
+
+from Cuts import Cuts
+from HistogramBank import HistogramBank
+from HistogramSpec import FusedFill
+from Columns import Instances, columnPairs, Subset
+
+
+def gridConfigurations(**values):
+    '''
+    Every combination of the given Cuts parameter values
+    gridConfigurations(pt_min=[5, 10], dB_max=[0.02, 0.05]) gives 4 configurations
+    returns: list of dictionaries {parameter: value}
+    '''
+    names = sorted(values)
+    return [dict(zip(names, point)) for point in itertools.product(*[values[name] for name in names])]
+
+
+def axisConfigurations(**values):
+    '''
+    One configuration per value of each parameter, the other parameters keeping
+    their default: the points of a scan along each axis
+    returns: list of dictionaries {parameter: value}
+    '''
+    return [{name: value} for name in sorted(values) for value in values[name]]
+
+
+class CutSweep(object):
+    '''
+    Many Cuts configurations evaluated in a single read of the dataset.
+
+    For every chunk the branches are read once and the muon pairs built once.
+    Each cut is evaluated once per distinct value of its parameter over all the
+    configurations; the selection of a configuration is the AND of the masks of
+    its cuts, so a scan of one parameter costs one comparison per point.
+    Results are indexed like the configurations.
+    '''
+    def __init__(self, analysis, configurations, histograms=True):
+        '''
+        analysis: Analyzer reading the dataset (its HISTOGRAMS are booked for every configuration)
+        configurations: list of dictionaries of Cuts parameters, the others keep their default
+        histograms: fill the selected muon histograms and h_mass of every configuration,
+                    otherwise only count the selected muons and pairs
+        '''
+        self.analysis = analysis
+        self.configurations = [dict(configuration) for configuration in configurations]
+        self.cuts = [Cuts(**configuration) for configuration in self.configurations]
+        self.muons = numpy.zeros(len(self.cuts), dtype=numpy.int64)
+        self.pairs = numpy.zeros(len(self.cuts), dtype=numpy.int64)
+        self.banks = []
+        self.fusedFills = []
+        if histograms:
+            for k in range(len(self.cuts)):
+                fusedFill = FusedFill(analysis.HISTOGRAMS)
+                bank = HistogramBank(fusedFill.book())
+                for histo in bank:
+                    histo.SetDirectory(0)
+                self.fusedFills.append(fusedFill)
+                self.banks.append(bank)
+
+    def __len__(self):
+        return len(self.configurations)
+
+    def index(self, **parameters):
+        '''Position of the configuration with these parameters'''
+        return self.configurations.index(parameters)
+
+    def branches(self):
+        branches = set(Cuts.BRANCHES) | set(['Muon_px', 'Muon_py', 'Muon_pz', 'Muon_energy', 'Muon_charge'])
+        if self.banks:
+            branches |= set(self.fusedFills[0].branches())
+        return sorted(branches)
+
+    def run(self, chunkSize=None):
+        '''Read the dataset once and fill the results of every configuration'''
+        parameters = [name for name, direction in Cuts.SELECTION_PARAMETERS]
+        columnCuts = [cuts.columnCuts(byParameter=True) for cuts in self.cuts]
+        swept = set(parameters).union(*self.configurations)
+        missing = sorted(swept - set(columnCuts[0])) if columnCuts else []
+        assert not missing, "no column cut for the swept parameters {0}".format(missing)
+        values = [dict((name, getattr(cuts, name)) for name in parameters) for cuts in self.cuts]
+        # Cuts with the same value in every configuration are combined once per chunk
+        varying = [name for name in parameters if len(set(point[name] for point in values)) > 1]
+        fixed = [name for name in parameters if name not in varying]
+
+        def passing(muons, view, k, parameter):
+            '''Mask of the cut on parameter of configuration k over the Instances of a chunk; a muon lacking a branch of the cut fails it'''
+            name, cut = columnCuts[k][parameter]
+            passed = cut(view)
+            present = muons.available(Cuts.CUT_BRANCHES[name])
+            return passed if present is None else passed & present
+
+        chunks = list(self.analysis.chunks(chunkSize))
+        for n, (start, stop, columns) in enumerate(self.analysis.readAhead(chunks, self.branches())):
+            profiler = self.analysis.profiler
+            profiler.count(stop - start, len(columns['Muon_pt'].content))
+            with profiler.stage('pairs'):
+                pairs = columnPairs(columns)
+                opposite = pairs['chargeProduct'] < 0
+            # One value per muon of Muon_pt, like the pairs and the fill
+            with profiler.stage('selection'):
+                muons = Instances(columns)
+                view = Subset(muons)
+                common = numpy.ones(len(muons), dtype=bool)
+                for parameter in fixed:
+                    common &= passing(muons, view, 0, parameter)
+            # Mask of each varying cut, for each value of its parameter
+            masks = {}
+            for k, point in enumerate(values):
+                with profiler.stage('selection'):
+                    selected = common
+                    for parameter in varying:
+                        if (parameter, point[parameter]) not in masks:
+                            masks[(parameter, point[parameter])] = passing(muons, view, k, parameter)
+                        selected = selected & masks[(parameter, point[parameter])]
+                    self.muons[k] += numpy.count_nonzero(selected)
+                    self.pairs[k] += numpy.count_nonzero(opposite & selected[pairs['first']] & selected[pairs['second']])
+                if self.banks:
+                    self.analysis.FillFromColumns(columns, selected, pairs, self.fusedFills[k])
+            print("> entries {0}-{1} swept over {2} configurations ({3}/{4})".format(start, stop, len(self), n + 1, len(chunks)))
+        with self.analysis.profiler.stage('fill'):
+            for fusedFill, bank in zip(self.fusedFills, self.banks):
+                fusedFill.flush(bank.__getitem__)
+        return self
+
+    def results(self):
+        '''
+        One dictionary per configuration: its parameters, the number of selected
+        muons and of selected opposite-charge pairs, and its histograms
+        '''
+        return [{
+            'parameters': configuration,
+            'muons': int(self.muons[k]),
+            'pairs': int(self.pairs[k]),
+            'histograms': self.banks[k] if self.banks else None,
+        } for k, configuration in enumerate(self.configurations)]
+
+    def cumulative(self, parameter):
+        '''
+        Cumulative histograms along one scanned axis: selected muons and selected
+        opposite-charge pairs as a function of the value of the parameter, for
+        the configurations changing only this parameter
+        returns: (muons, pairs) TH1F with one bin per value, labelled with it
+        '''
+        points = sorted((configuration[parameter], k) for k, configuration in enumerate(self.configurations)
+                        if list(configuration) == [parameter])
+        histograms = []
+        for what, counts in (('muons', self.muons), ('pairs', self.pairs)):
+            histo = ROOT.TH1F('h_sweep_{0}_{1}'.format(parameter, what),
+                              'Selected {0};{1};Selected {0}'.format(what, parameter), len(points), 0, len(points))
+            histo.SetDirectory(0)
+            for b, (value, k) in enumerate(points):
+                histo.GetXaxis().SetBinLabel(b + 1, str(value))
+                histo.SetBinContent(b + 1, float(counts[k]))
+            histo.SetEntries(float(sum(counts[k] for value, k in points)))
+            histograms.append(histo)
+        return histograms
+
+    def write(self, name):
+        '''
+        Write the results in datafiles/name: the histograms of configuration k in
+        the directory sweep_k, the cumulative histograms of every scanned axis at
+        the top, and the table of results in datafiles/name.json
+        '''
+        rootfile = ROOT.TFile("datafiles/" + name, "RECREATE")
+        for k, configuration in enumerate(self.configurations):
+            if self.banks:
+                rootfile.mkdir("sweep_{0}".format(k), json.dumps(configuration, sort_keys=True)).cd()
+                self.banks[k].write()
+                rootfile.cd()
+        axes = set(list(configuration)[0] for configuration in self.configurations if len(configuration) == 1)
+        for parameter in sorted(axes):
+            for histo in self.cumulative(parameter):
+                histo.Write()
+        rootfile.Close()
+        table = [dict((key, value) for key, value in result.items() if key != 'histograms') for result in self.results()]
+        with open("datafiles/" + name + ".json", 'w') as output:
+            json.dump(table, output, indent=1)
+        if self.analysis.profiler.enabled:
+            self.analysis.profiler.write("datafiles/" + name + ".profile.json")
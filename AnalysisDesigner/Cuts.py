@@ -1,4 +1,53 @@
+import numpy
+
+from CutCompiler import CompiledCuts
+
 class Cuts(object):
+
+    # Branches needed to evaluate the cuts on columns
+    BRANCHES = ['Muon_isGlobalMuon', 'Muon_isTrackerMuon', 'Muon_pt', 'Muon_eta', 'Muon_normChi2',
+                'Muon_NValidHitsSATk', 'Muon_numberOfValidHits', 'Muon_numOfMatches', 'Muon_distance',
+                'Muon_dB', 'Muon_isolation_hadEt', 'Muon_isolation_emEt', 'Muon_isolation_sumPt']
+    # Branches read by each cut
+    CUT_BRANCHES = {
+        'isGlobal': ['Muon_isGlobalMuon', 'Muon_isTrackerMuon'],
+        'pt': ['Muon_pt'],
+        'eta': ['Muon_eta'],
+        'normChi2': ['Muon_normChi2'],
+        'numValidHitsSTATk': ['Muon_NValidHitsSATk'],
+        'numValidHits': ['Muon_numberOfValidHits'],
+        'numOfMatches': ['Muon_numOfMatches'],
+        'dz': ['Muon_distance'],
+        'dB': ['Muon_dB'],
+        'relIsolation': ['Muon_isolation_hadEt', 'Muon_isolation_emEt', 'Muon_isolation_sumPt', 'Muon_pt'],
+    }
+    
+    # Parameters of the muon selection: +1 when a larger value is a tighter cut, -1 when a smaller one is
+    SELECTION_PARAMETERS = [
+        ('isGlobal', 1),
+        ('pt_min', 1),
+        ('eta_max', -1),
+        ('normChi2', -1),
+        ('numValidHitsSTATk', 1),
+        ('numValidHits', 1),
+        ('numOfMatches', 1),
+        ('dz_max', -1),
+        ('dB_max', -1),
+        ('relIsolation', -1),
+    ]
+    # Parameter of the muon selection tested by each cut
+    CUT_PARAMETERS = {
+        'isGlobal': 'isGlobal',
+        'pt': 'pt_min',
+        'eta': 'eta_max',
+        'normChi2': 'normChi2',
+        'numValidHitsSTATk': 'numValidHitsSTATk',
+        'numValidHits': 'numValidHits',
+        'numOfMatches': 'numOfMatches',
+        'dz': 'dz_max',
+        'dB': 'dB_max',
+        'relIsolation': 'relIsolation',
+    }
     
     def __init__(self, isGlobal = 1, pt_min = 5, eta_max = 2.4, normChi2 = 10, numValidHitsSTATk = 10, numValidHits = 10, numOfMatches = 1, dz_max = 0.2, dB_max = 0.02, relIsolation = 0.15, mass_min = 0):
 
@@ -35,6 +84,7 @@ class Cuts(object):
         self.mass_min = mass_min
         
         self.selection = ""
+        self.compiled = None
                 
                 
     def fullSelection(self, muon = False):
@@ -75,10 +125,56 @@ class Cuts(object):
             sequence[i] = sequence[i].replace("[i]", "")
                   
         return sequence
-                
-                
-                
-                
-                
-                
-                
\ No newline at end of file
+
+    def columnCuts(self, byParameter = False):
+        '''
+        Vectorized version of the cut strings, in the order of sequentialSelection
+        byParameter: return a dictionary {parameter: (name, function)} keyed by the
+                     SELECTION_PARAMETERS name of the value each cut tests
+        returns: list of (name, function) where function takes a dictionary
+        {branch name: flat double array} and returns True for the muons passing the cut
+        '''
+        cuts = [
+            ('isGlobal', lambda c: self.isGlobal*((c['Muon_isGlobalMuon'] != 0) | (c['Muon_isTrackerMuon'] != 0)) + (1 - self.isGlobal) != 0),
+            ('pt', lambda c: c['Muon_pt'] > self.pt_min),
+            ('eta', lambda c: numpy.fabs(c['Muon_eta']) < self.eta_max),
+            ('normChi2', lambda c: c['Muon_normChi2'] < self.normChi2),
+            ('numValidHitsSTATk', lambda c: c['Muon_NValidHitsSATk'] > self.numValidHitsSTATk),
+            ('numValidHits', lambda c: c['Muon_numberOfValidHits'] > self.numValidHits),
+            ('numOfMatches', lambda c: c['Muon_numOfMatches'] > self.numOfMatches),
+            ('dz', lambda c: numpy.fabs(c['Muon_distance']) < self.dz_max),
+            ('dB', lambda c: numpy.fabs(c['Muon_dB']) < self.dB_max),
+            ('relIsolation', lambda c: (c['Muon_isolation_hadEt'] + c['Muon_isolation_emEt'] + c['Muon_isolation_sumPt'])/c['Muon_pt'] < self.relIsolation),
+        ]
+        if byParameter:
+            return dict((self.CUT_PARAMETERS[name], (name, cut)) for name, cut in cuts)
+        return cuts
+
+    def compile(self):
+        '''Vectorized predicate evaluating these cuts (see CompiledCuts)'''
+        if self.compiled is None:
+            self.compiled = CompiledCuts(self)
+        return self.compiled
+
+    def select(self, columns):
+        '''
+        Vectorized version of fullSelection
+        columns: dictionary {branch name: flat array} of aligned muon branches, or Instances
+        returns: boolean array, True for the muons passing every cut
+        '''
+        return self.compile()(columns)
+
+    def parameters(self):
+        '''Values of the parameters of the muon selection'''
+        return dict((name, getattr(self, name)) for name, direction in self.SELECTION_PARAMETERS)
+
+    def looserThan(self, other):
+        '''True if every muon passing the other cuts passes these ones'''
+        return all(direction*(getattr(self, name) - getattr(other, name)) <= 0
+                   for name, direction in self.SELECTION_PARAMETERS)
+
+    def __getstate__(self):
+        # The compiled predicate holds closures: compile again after unpickling
+        state = dict(self.__dict__)
+        state['compiled'] = None
+        return state
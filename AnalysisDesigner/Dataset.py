@@ -0,0 +1,78 @@
+import os
+import json
+import ROOT
+
+from ColumnStore import ColumnStore, isColumnStore
+
+
+def writeManifest(path, shards, treeName="muons"):
+    '''
+    Write the manifest of a sharded dataset
+    path: manifest file
+    shards: list of {'path', 'source', 'entries', 'bytes'}, one per shard file
+    '''
+    directory = os.path.dirname(os.path.abspath(path))
+    manifest = {
+        'tree': treeName,
+        'entries': sum(shard['entries'] for shard in shards),
+        'bytes': sum(shard['bytes'] for shard in shards),
+        # Shard paths are relative to the manifest, so the dataset can be moved as a whole
+        'shards': [dict(shard, path=os.path.relpath(os.path.abspath(shard['path']), directory)) for shard in shards],
+    }
+    with open(path + ".tmp", 'w') as output:
+        json.dump(manifest, output, indent=1)
+    os.rename(path + ".tmp", path)
+    return manifest
+
+
+def readManifest(path):
+    '''Read a manifest, with the shard paths resolved with respect to the current directory'''
+    with open(path) as manifest:
+        manifest = json.load(manifest)
+    directory = os.path.dirname(path)
+    for shard in manifest['shards']:
+        shard['path'] = os.path.join(directory, shard['path'])
+    return manifest
+
+
+def isManifest(path):
+    return path.endswith('.json')
+
+
+def datasetIdentity(dataset):
+    '''
+    Identity of the files of a dataset: path, size and modification time of the
+    file (the manifest and each of its shards, or the meta.json of a column store)
+    '''
+    paths = [dataset]
+    if isColumnStore(dataset):
+        paths = [os.path.join(dataset, 'meta.json')]
+    elif isManifest(dataset):
+        paths += [shard['path'] for shard in readManifest(dataset)['shards']]
+    identity = []
+    for path in paths:
+        status = os.stat(path)
+        identity.append([os.path.abspath(path), status.st_size, status.st_mtime])
+    return identity
+
+
+def openDataset(path, treeName="muons", newHandle=False):
+    '''
+    Open a dataset: one ROOT file, every shard listed by a manifest as a single
+    chain, or the directory of a column store
+    newHandle: open the file again even if it is already open, e.g. for another thread
+    returns: (file, tree), file is None for a chain (the chain owns its files) and a store
+    '''
+    if isColumnStore(path):
+        return None, ColumnStore(path)
+    if isManifest(path):
+        manifest = readManifest(path)
+        chain = ROOT.TChain(manifest['tree'])
+        for shard in manifest['shards']:
+            chain.AddFile(shard['path'], shard['entries'])
+        return None, chain
+
+    rootFile = None if newHandle else ROOT.gROOT.GetListOfFiles().FindObject(os.path.basename(path))
+    if not rootFile or not rootFile.IsOpen():
+        rootFile = ROOT.TFile(path, "read")
+    return rootFile, rootFile.Get(treeName)
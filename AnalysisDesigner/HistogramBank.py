@@ -0,0 +1,138 @@
+import os
+from collections import OrderedDict
+import ROOT
+
+
+class HistogramBank(object):
+    '''
+    Named collection of histograms with an associative and commutative merge.
+
+    Partial results of workers, chunks or runs are merged the same way: banks
+    can be spilled to disk and the spilled files reduced tree-style.
+    '''
+    def __init__(self, histograms=()):
+        self.histograms = OrderedDict()
+        for histo in histograms:
+            self.add(histo)
+
+    def add(self, histo):
+        '''Add a histogram to the bank, under its ROOT name'''
+        self.histograms[histo.GetName()] = histo
+
+    def __getitem__(self, name):
+        return self.histograms[name]
+
+    def __contains__(self, name):
+        return name in self.histograms
+
+    def __iter__(self):
+        return iter(self.histograms.values())
+
+    def __len__(self):
+        return len(self.histograms)
+
+    def names(self):
+        return list(self.histograms.keys())
+
+    def subset(self, names):
+        '''Bank with only the given histograms (same objects)'''
+        return HistogramBank(self.histograms[name] for name in names)
+
+    def merge(self, other):
+        '''
+        Add the histograms of another bank to this one: same names are summed
+        bin by bin (contents, entries and statistics), new names are copied
+        returns: this bank
+        '''
+        for histo in other:
+            name = histo.GetName()
+            if name in self.histograms:
+                self.histograms[name].Add(histo)
+            else:
+                copy = histo.Clone(name)
+                copy.SetDirectory(0)
+                self.histograms[name] = copy
+        return self
+
+    def write(self):
+        '''Write every histogram in the current ROOT directory'''
+        for histo in self:
+            histo.Write()
+
+    def spill(self, path):
+        '''
+        Write the bank in a ROOT file. The file is renamed into place once
+        complete, so a crashed writer never leaves a partial result behind.
+        '''
+        temporary = path + ".tmp"
+        output = ROOT.TFile(temporary, "RECREATE")
+        self.write()
+        output.Close()
+        os.rename(temporary, path)
+        return path
+
+    @classmethod
+    def load(cls, path):
+        '''Read every histogram of a ROOT file in a bank (detached from the file)'''
+        bank = cls()
+        rootFile = ROOT.TFile(path, "read")
+        for key in rootFile.GetListOfKeys():
+            histo = key.ReadObj()
+            if histo.InheritsFrom("TH1"):
+                histo.SetDirectory(0)
+                bank.add(histo)
+        rootFile.Close()
+        return bank
+
+    @classmethod
+    def fromOutputList(cls, outputList, names=None):
+        '''Bank of the histograms of a PROOF output list (all of them if names is None)'''
+        bank = cls()
+        for obj in outputList:
+            if obj.InheritsFrom("TH1") and (names is None or obj.GetName() in names):
+                bank.add(obj)
+        return bank
+
+
+def mergeFiles(paths):
+    '''Load and merge several spilled banks'''
+    bank = HistogramBank()
+    for path in paths:
+        bank.merge(HistogramBank.load(path))
+    return bank
+
+
+def reduceGroup(task):
+    '''Merge one group of spilled banks into a new file (one node of the reduction tree)'''
+    paths, output, remove = task
+    mergeFiles(paths).spill(output)
+    if remove:
+        for path in paths:
+            os.remove(path)
+    return output
+
+
+def reduceFiles(paths, output, fanIn=2, pool=None, remove=True):
+    '''
+    Tree-style reduction of spilled banks: groups of fanIn files are merged,
+    level by level, until only the output file is left. The groups of a level
+    are independent and run in the pool when one is given.
+    paths: spilled bank files
+    output: path of the final merged bank
+    remove: delete the inputs once the output is written (intermediate files
+            are always deleted once merged into the next level)
+    returns: the merged bank
+    '''
+    level = list(paths)
+    depth = 0
+    while len(level) > fanIn:
+        # The inputs survive a crash of the reduction, only intermediate files are consumed
+        tasks = [(level[i:i+fanIn], "{0}.level{1}.{2}".format(output, depth, i//fanIn), depth > 0)
+                 for i in range(0, len(level), fanIn)]
+        level = pool.map(reduceGroup, tasks) if pool else [reduceGroup(task) for task in tasks]
+        depth += 1
+    reduceGroup((level, output, depth > 0))
+    if remove:
+        for path in paths:
+            os.remove(path)
+    return HistogramBank.load(output)
@@ -0,0 +1,100 @@
+import os
+import collections
+import ROOT
+
+
+class HistogramFiles(object):
+    '''
+    Histogram files opened once, and the histograms read from them kept in
+    memory: asking again for a histogram costs a dictionary lookup, not a Get.
+
+    The least recently used histograms are dropped beyond maxHistograms. A file
+    rewritten on disk (new modification time or size) is opened again and its
+    histograms read again the next time they are asked for.
+    '''
+    def __init__(self, maxHistograms=256):
+        '''maxHistograms: histograms kept in memory, over every file'''
+        self.maxHistograms = maxHistograms
+        # path: (stamp, TFile)
+        self.files = {}
+        # (path, name): histogram, least recently used first
+        self.histograms = collections.OrderedDict()
+        # (path, name): digest of the contents (see PlotRenderer)
+        self.digests = {}
+
+    def stamp(self, path):
+        status = os.stat(path)
+        return status.st_mtime, status.st_size
+
+    def open(self, path):
+        '''Open TFile of a path, opened again if the file changed on disk'''
+        stamp = self.stamp(path)
+        if path in self.files and self.files[path][0] == stamp:
+            return self.files[path][1]
+        if path in self.files:
+            self.forget(path)
+        rootFile = ROOT.TFile(path, "read")
+        if not rootFile or rootFile.IsZombie():
+            raise IOError("cannot open {0}".format(path))
+        self.files[path] = (stamp, rootFile)
+        return rootFile
+
+    def forget(self, path):
+        '''Close a file and drop its histograms'''
+        for key in [key for key in self.histograms if key[0] == path]:
+            del self.histograms[key]
+            self.digests.pop(key, None)
+        stamp, rootFile = self.files.pop(path)
+        rootFile.Close()
+
+    def changed(self, path):
+        '''True if the file changed on disk since it was opened (or was never opened)'''
+        return path not in self.files or self.files[path][0] != self.stamp(path)
+
+    def get(self, path, name):
+        '''
+        Histogram of a file, read only the first time. It belongs to the
+        cache: draw a Clone to change its style or binning.
+        '''
+        self.open(path)
+        key = (path, name)
+        if key in self.histograms:
+            histo = self.histograms.pop(key)
+        else:
+            histo = self.files[path][1].Get(name)
+            if not histo:
+                raise KeyError("no histogram {0} in {1}".format(name, path))
+            # Kept when the file is closed
+            histo.SetDirectory(0)
+        self.histograms[key] = histo
+        while len(self.histograms) > self.maxHistograms:
+            oldest, dropped = self.histograms.popitem(last=False)
+            self.digests.pop(oldest, None)
+        return histo
+
+    def keys(self, path, className="TH1"):
+        '''
+        Names of the objects of a file inheriting from className, from the keys
+        read when the file is opened: no histogram is read
+        '''
+        names = []
+        for key in self.open(path).GetListOfKeys():
+            # Keys of older cycles follow the newest one
+            if key.GetName() not in names and ROOT.TClass.GetClass(key.GetClassName()).InheritsFrom(className):
+                names.append(key.GetName())
+        return names
+
+    def digest(self, path, name, compute):
+        '''
+        Digest of a histogram, computed once per version of its file
+        compute: function(histogram) giving the digest
+        '''
+        histo = self.get(path, name)
+        if (path, name) not in self.digests:
+            self.digests[(path, name)] = compute(histo)
+        return self.digests[(path, name)]
+
+    def close(self):
+        '''Close every file and drop every histogram'''
+        for path in list(self.files):
+            self.forget(path)
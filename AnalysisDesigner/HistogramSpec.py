@@ -0,0 +1,229 @@
+import re
+import numpy
+import ROOT
+
+from Columns import JaggedArray, Instances, Subset, availableInstances, binIndices, addToHistogram
+
+WORD = re.compile(r'[A-Za-z_]\w*')
+BRANCH = re.compile(r'^Muon_\w+$')
+# Branch giving the muon instances, as the pairs and the selection count them
+REFERENCE = 'Muon_pt'
+
+# Functions available to the expressions, besides the branches
+FUNCTIONS = {
+    '__builtins__': {},
+    'fabs': numpy.fabs,
+    'abs': numpy.abs,
+    'sqrt': numpy.sqrt,
+}
+
+
+class HistogramSpec(object):
+    '''
+    One row of a histogram table: a histogram, the expression filling it and
+    the objects it is filled with.
+    Several rows with the same name fill the same histogram: only the first
+    one needs the title and binning.
+    '''
+    def __init__(self, name, title, bins, expression, stage='selected', objects='muons', condition=None):
+        '''
+        name: ROOT name of the histogram
+        title: ROOT title, with the axis titles
+        bins: (number of bins, xmin, xmax)
+        expression: numpy expression of the branches (muons) or of the pair
+                    columns of dimuonPairs (pairs), e.g. "Muon_pt" or "mass"
+        stage: 'all' to fill every muon, 'selected' to fill only the selected
+               muons (every muon when the analysis has no selection)
+        objects: 'muons', or 'pairs' for the opposite-charge muon pairs (both
+                 muons of a pair must be selected at the 'selected' stage)
+        condition: optional expression: only the objects where it is true are filled
+        '''
+        self.name = name
+        self.title = title
+        self.bins = bins
+        self.expression = expression
+        self.stage = stage
+        self.objects = objects
+        self.condition = condition
+        self.code = compile(expression, name, 'eval')
+        self.conditionCode = compile(condition, name, 'eval') if condition else None
+
+    def words(self):
+        '''Identifiers of the expression and of the condition'''
+        return set(WORD.findall(self.expression + ' ' + (self.condition or '')))
+
+    def branches(self):
+        '''Muon branches of the expression and of the condition'''
+        return tuple(sorted(word for word in self.words() if BRANCH.match(word)))
+
+    def values(self, view, size):
+        '''Values of the expression for the objects of a view where the condition holds'''
+        values = numpy.asarray(eval(self.code, FUNCTIONS, view), dtype=numpy.float64)
+        values = numpy.broadcast_to(values, (size,))
+        if self.conditionCode is not None:
+            values = values[numpy.broadcast_to(eval(self.conditionCode, FUNCTIONS, view), (size,))]
+        return values
+
+
+def branchHistograms(specs):
+    '''(histogram, branch) of the rows filled directly with one branch of every muon'''
+    return [(spec.name, spec.expression) for spec in specs
+            if spec.objects == 'muons' and spec.condition is None and BRANCH.match(spec.expression)]
+
+
+class FusedFill(object):
+    '''
+    Fill routine compiled from a histogram table.
+
+    Each chunk is traversed once: the branches used by the table are gathered
+    once per stage, every row is binned in numpy, and the bins of all the
+    histograms are counted together with a single bincount into accumulators
+    laid out one histogram after the other. The histograms only receive the
+    accumulated contents on flush, so filling costs no Python -> C++ call.
+    Event loops append their events, which are binned in batches of bufferSize muons.
+    As TTree::Project does, a row is filled for the muon instances where every
+    branch it reads has a value (see Columns.Instances).
+    '''
+    def __init__(self, specs, bufferSize=10000):
+        self.specs = list(specs)
+        self.bufferSize = bufferSize
+        self.names = []
+        self.definitions = {}
+        for spec in self.specs:
+            if spec.name not in self.definitions:
+                self.names.append(spec.name)
+                self.definitions[spec.name] = spec
+        self.index = dict((name, h) for h, name in enumerate(self.names))
+        sizes = [self.definitions[name].bins[0] + 2 for name in self.names]
+        self.offsets = numpy.concatenate([[0], numpy.cumsum(sizes)]).astype(numpy.int64)
+        branches = set([REFERENCE])
+        for spec in self.specs:
+            if spec.objects == 'muons':
+                branches |= set(spec.branches())
+        self.muonBranches = sorted(branches)
+        self.reset()
+        self.buffer = None
+
+    def reset(self):
+        '''Empty the accumulators'''
+        self.counts = numpy.zeros(self.offsets[-1], dtype=numpy.float64)
+        self.stats = numpy.zeros((len(self.names), 4), dtype=numpy.float64)
+        self.entries = numpy.zeros(len(self.names), dtype=numpy.int64)
+
+    def book(self):
+        '''TH1F of every histogram of the table'''
+        histograms = []
+        for name in self.names:
+            spec = self.definitions[name]
+            histograms.append(ROOT.TH1F(name, spec.title, *spec.bins))
+        return histograms
+
+    def branches(self):
+        '''Muon branches read by the rows filled with muons'''
+        return self.muonBranches
+
+    def fill(self, muons, selected=None, pairs=None):
+        '''
+        Bin one chunk for every row of the table
+        muons: Instances of the muon branches, or dictionary {branch name: flat
+               array} of aligned muon branches
+        selected: boolean array of the selected muons (None: every muon)
+        pairs: pair columns of the muons (dimuonPairs), None if there are none
+        '''
+        size = len(muons) if isinstance(muons, Instances) else len(muons[REFERENCE])
+        views = {}
+
+        def view(stage, objects, branches):
+            key = (stage, objects, branches)
+            if key not in views:
+                if objects == 'muons':
+                    keep = None if stage == 'all' else selected
+                    available = availableInstances(muons, branches)
+                    if available is not None:
+                        keep = available if keep is None else keep & available
+                    index = None if keep is None else numpy.flatnonzero(keep)
+                    views[key] = Subset(muons, index), size if index is None else len(index)
+                elif pairs is None:
+                    views[key] = None, 0
+                else:
+                    keep = pairs['chargeProduct'] < 0
+                    if stage == 'selected' and selected is not None:
+                        keep &= selected[pairs['first']] & selected[pairs['second']]
+                    index = numpy.flatnonzero(keep)
+                    views[key] = Subset(pairs, index), len(index)
+            return views[key]
+
+        bins, ids, inRange = [], [], []
+        for spec in self.specs:
+            subset, n = view(spec.stage, spec.objects, spec.branches() if spec.objects == 'muons' else ())
+            if not n:
+                continue
+            values = spec.values(subset, n)
+            h = self.index[spec.name]
+            nbins, xmin, xmax = self.definitions[spec.name].bins
+            b = binIndices(values, nbins, xmin, xmax)
+            bins.append(self.offsets[h] + b)
+            inRange.append(values[(b > 0) & (b <= nbins)])
+            ids.append(numpy.repeat(h, len(inRange[-1])))
+            self.entries[h] += len(values)
+        if not bins:
+            return
+        self.counts += numpy.bincount(numpy.concatenate(bins), minlength=len(self.counts))
+        # Statistics of the in-range values, as TH1::Fill keeps them
+        ids = numpy.concatenate(ids)
+        values = numpy.concatenate(inRange)
+        sumw = numpy.bincount(ids, minlength=len(self.names))
+        self.stats[:, 0] += sumw
+        self.stats[:, 1] += sumw
+        self.stats[:, 2] += numpy.bincount(ids, values, minlength=len(self.names))
+        self.stats[:, 3] += numpy.bincount(ids, values*values, minlength=len(self.names))
+
+    def append(self, muons, selected=None, pairs=None):
+        '''
+        Buffer the muons of one event; the buffer is binned once it holds
+        bufferSize muons, and on flush
+        muons: dictionary {branch name: values in the event}; a branch may have
+               fewer values than Muon_pt (see Columns.Instances)
+        selected, pairs: as for fill, for the Muon_pt instances of the event
+        The branch values
+        are copied: in an event loop they are views of the tree's vector
+        buffers, which the next GetEntry overwrites
+        '''
+        if self.buffer is None:
+            self.buffer = {'muons': [], 'selected': [], 'pairs': [], 'size': 0}
+        size = len(muons[REFERENCE])
+        if pairs is not None:
+            pairs = dict(pairs, first=pairs['first'] + self.buffer['size'], second=pairs['second'] + self.buffer['size'])
+            self.buffer['pairs'].append(pairs)
+        self.buffer['muons'].append(dict((branch, numpy.array(muons[branch], copy=True)) for branch in self.muonBranches))
+        self.buffer['selected'].append(numpy.ones(size, dtype=bool) if selected is None else numpy.array(selected, dtype=bool, copy=True))
+        self.buffer['size'] += size
+        if self.buffer['size'] >= self.bufferSize:
+            self.fillBuffer()
+
+    def fillBuffer(self):
+        '''Bin the buffered events'''
+        buffer, self.buffer = self.buffer, None
+        if buffer is None or not buffer['muons']:
+            return
+        columns = {}
+        for branch in self.muonBranches:
+            values = [event[branch] for event in buffer['muons']]
+            offsets = numpy.zeros(len(values) + 1, dtype=numpy.int64)
+            numpy.cumsum([len(event) for event in values], out=offsets[1:])
+            columns[branch] = JaggedArray(numpy.concatenate(values), offsets)
+        pairs = None
+        if buffer['pairs']:
+            pairs = dict((column, numpy.concatenate([event[column] for event in buffer['pairs']])) for column in buffer['pairs'][0])
+        self.fill(Instances(columns), numpy.concatenate(buffer['selected']), pairs)
+
+    def flush(self, histogram):
+        '''
+        Add the accumulated contents to the histograms and empty the accumulators
+        histogram: function giving the TH1 of a ROOT name
+        '''
+        self.fillBuffer()
+        for h, name in enumerate(self.names):
+            if self.entries[h]:
+                addToHistogram(histogram(name), self.counts[self.offsets[h]:self.offsets[h+1]], self.stats[h], self.entries[h])
+        self.reset()
@@ -0,0 +1,253 @@
+import os
+import json
+import hashlib
+import multiprocessing
+import ROOT
+
+from HistogramFiles import HistogramFiles
+from Runner import spawnPool
+
+# Line colors of the histograms of a plot, in order (None: the color of the histogram)
+COLORS = (None, 2, 4, 6, 8, 9)
+
+# A change of the drawing code renders every plot again
+SOURCE = os.path.splitext(os.path.abspath(__file__))[0] + '.py'
+
+
+class PlotSpec(object):
+    '''
+    One plot: a single histogram, several histograms overlaid in the same
+    frame, or a histogram with a fit, and its style
+    '''
+    def __init__(self, name, histograms, kind='single', title=None, colors=COLORS, logy=False,
+                 xrange=None, rebin=None, fit=None, stats=True, legend=None):
+        '''
+        name: output file, without extension
+        histograms: list of (ROOT file, histogram name), drawn in this order
+        kind: 'single', 'overlay' (every histogram in the frame of the first) or
+              'fit' (the first histogram, fitted with fit)
+        title: title replacing the one of the first histogram
+        colors: line colors of the histograms
+        logy: logarithmic y axis
+        xrange: (xmin, xmax) shown
+        rebin: number of bins merged together, in every histogram
+        fit: ROOT function fitted for the 'fit' plots, e.g. "gaus"
+        stats: draw the statistics box
+        legend: (header, [label of each histogram]) of a legend at the bottom left
+        '''
+        if kind not in ('single', 'overlay', 'fit'):
+            raise ValueError("unknown kind of plot {0}".format(kind))
+        self.name = name
+        self.histograms = [tuple(histogram) for histogram in histograms]
+        self.kind = kind
+        self.title = title
+        self.colors = tuple(colors)
+        self.logy = logy
+        self.xrange = xrange
+        self.rebin = rebin
+        self.fit = fit if kind == 'fit' else None
+        self.stats = stats
+        self.legend = legend
+
+    def style(self):
+        '''Everything but the histogram contents that changes the plot'''
+        return dict((key, value) for key, value in vars(self).items() if key != 'histograms')
+
+
+def contentsDigest(histo):
+    '''Hash of the title, binning, contents and errors of a histogram'''
+    axis = histo.GetXaxis()
+    bins = range(histo.GetNbinsX() + 2)
+    contents = {
+        'title': histo.GetTitle(),
+        'axes': [axis.GetTitle(), histo.GetYaxis().GetTitle()],
+        'bins': [axis.GetNbins(), axis.GetXmin(), axis.GetXmax()],
+        'entries': histo.GetEntries(),
+        'contents': [histo.GetBinContent(b) for b in bins],
+        'errors': [histo.GetBinError(b) for b in bins],
+    }
+    return hashlib.sha1(json.dumps(contents, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+# Open files, histograms read and canvas of a rendering process of the pool, kept from one plot to the next
+_files = HistogramFiles()
+_canvas = []
+
+
+def readHistogram(files, path, name):
+    '''Copy of a histogram, owned by the caller'''
+    histo = files.get(path, name).Clone()
+    histo.SetDirectory(0)
+    return histo
+
+
+def initWorker(width, height):
+    '''Rendering process: batch mode, and the canvas reused by all its plots'''
+    ROOT.gROOT.SetBatch(True)
+    del _canvas[:]
+    _canvas.append(ROOT.TCanvas("plotRenderer", "", width, height))
+
+
+def drawPlot(spec, files, canvas):
+    '''
+    Draw one plot on a canvas
+    files: HistogramFiles the histograms are read from
+    returns: the objects drawn, to be kept as long as the canvas shows them
+    '''
+    canvas.Clear()
+    canvas.cd()
+    canvas.SetLogy(spec.logy)
+    ROOT.gStyle.SetOptStat(1111 if spec.stats else 0)
+    ROOT.gStyle.SetOptFit(1 if spec.fit else 0)
+
+    histograms = [readHistogram(files, filePath, name) for filePath, name in spec.histograms]
+    if spec.kind != 'overlay':
+        histograms = histograms[:1]
+    for k, histo in enumerate(histograms):
+        if spec.rebin:
+            histo.Rebin(spec.rebin)
+        color = spec.colors[k % len(spec.colors)]
+        if color is not None:
+            histo.SetLineColor(color)
+    first = histograms[0]
+    if spec.title is not None:
+        first.SetTitle(spec.title)
+    if spec.xrange is not None:
+        first.GetXaxis().SetRangeUser(*spec.xrange)
+    if spec.fit:
+        first.Fit(spec.fit, "Q")
+
+    first.Draw()
+    for histo in histograms[1:]:
+        histo.Draw("same")
+    drawn = list(histograms)
+    if spec.legend is not None:
+        header, labels = spec.legend
+        legend = ROOT.TLegend(0.1, 0.2, 0.30, 0.3)
+        legend.SetHeader(header)
+        for histo, label in zip(histograms, labels):
+            legend.AddEntry(histo, label, "l")
+        legend.Draw()
+        drawn.append(legend)
+    canvas.Update()
+    return drawn
+
+
+def renderPlot(task):
+    '''
+    Draw one plot on the canvas of a rendering process and save it
+    task: (PlotSpec, output path)
+    returns: the output path
+    '''
+    spec, path = task
+    drawPlot(spec, _files, _canvas[0])
+    _canvas[0].SaveAs(path)
+    return path
+
+
+class PlotRenderer(object):
+    '''
+    Render plots, in batch or in the session.
+
+    With several workers the plots are shared out to a pool of processes in
+    batch mode, each drawing all of its plots on one canvas and keeping its
+    input files open: nothing is shown in the session. With one worker every
+    plot is drawn in this process on a canvas of its own, which stays on
+    screen (or in the notebook) until the plot is drawn again.
+
+    Every plot is identified by a hash of the contents of its histograms and
+    of its style; the image of a plot whose hash did not change since it was
+    last saved is not written again, and the batch mode does not draw it.
+    '''
+    def __init__(self, directory, workers=None, width=800, height=600, extension="png", files=None):
+        '''
+        directory: where the plots are saved, with the index of their hashes (.plots.json)
+        workers: number of rendering processes (default: number of cores, 1 draws in this process)
+        width, height: canvas size, in pixels
+        extension: image format, from the extension given to SaveAs
+        files: HistogramFiles reading the histograms in this process (default: one shared by the renderers)
+        '''
+        self.directory = os.path.expandvars(directory)
+        self.workers = workers or multiprocessing.cpu_count()
+        self.width = width
+        self.height = height
+        self.extension = extension
+        self.files = files or _files
+        self.indexPath = os.path.join(self.directory, ".plots.json")
+        # Plot name: (canvas, objects drawn on it) of the plots drawn in this process
+        self.canvases = {}
+        with open(SOURCE, 'rb') as source:
+            self.sourceVersion = hashlib.sha1(source.read()).hexdigest()
+
+    def path(self, spec):
+        return os.path.join(self.directory, "{0}.{1}".format(spec.name, self.extension))
+
+    def key(self, spec):
+        '''Hash of the inputs of a plot: histogram contents, style, canvas and drawing code'''
+        contents = [self.files.digest(path, name, contentsDigest) for path, name in spec.histograms]
+        identity = json.dumps({'style': spec.style(), 'histograms': contents, 'code': self.sourceVersion,
+                               'canvas': [self.width, self.height]}, sort_keys=True)
+        return hashlib.sha1(identity.encode('utf-8')).hexdigest()
+
+    def readIndex(self):
+        try:
+            with open(self.indexPath) as index:
+                return json.load(index)
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def writeIndex(self, index):
+        with open(self.indexPath + ".tmp", 'w') as output:
+            json.dump(index, output, indent=1, sort_keys=True)
+        os.rename(self.indexPath + ".tmp", self.indexPath)
+
+    def pool(self):
+        return spawnPool(self.workers, initWorker, (self.width, self.height))
+
+    def draw(self, spec):
+        '''Draw a plot in this process, on its own canvas, and show it'''
+        if spec.name in self.canvases:
+            canvas = self.canvases[spec.name][0]
+        else:
+            canvas = ROOT.TCanvas("plot_" + spec.name, spec.name, self.width, self.height)
+        self.canvases[spec.name] = canvas, drawPlot(spec, self.files, canvas)
+        canvas.Draw()
+        return canvas
+
+    def render(self, specs, force=False):
+        '''
+        Draw the plots and save the images of those whose inputs changed since
+        they were last saved (with several workers, only those are drawn)
+        specs: list of PlotSpec
+        force: save every plot
+        returns: names of the plots saved
+        '''
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        index = self.readIndex()
+        keys = dict((spec.name, self.key(spec)) for spec in specs)
+        todo = [spec for spec in specs
+                if force or index.get(spec.name) != keys[spec.name] or not os.path.exists(self.path(spec))]
+        tasks = [(spec, self.path(spec)) for spec in todo]
+
+        if self.workers > 1:
+            if tasks:
+                pool = self.pool()
+                try:
+                    # Plots are handed out one at a time, so a slow fit does not hold back the others
+                    pool.map(renderPlot, tasks, chunksize=1)
+                finally:
+                    pool.close()
+                    pool.join()
+        else:
+            # The session keeps its display mode, and every plot asked for is shown
+            for spec in specs:
+                canvas = self.draw(spec)
+                if spec in todo:
+                    canvas.SaveAs(self.path(spec))
+
+        # Only the plots actually saved are recorded
+        for spec in todo:
+            index[spec.name] = keys[spec.name]
+        self.writeIndex(index)
+        return [spec.name for spec in todo]
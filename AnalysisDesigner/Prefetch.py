@@ -0,0 +1,217 @@
+import os
+import shutil
+import hashlib
+import threading
+import subprocess
+from multiprocessing.pool import ThreadPool
+import ROOT
+
+
+def findExecutable(name):
+    '''Path of an executable of the PATH, None if there is none'''
+    for directory in os.environ.get('PATH', '').split(os.pathsep):
+        path = os.path.join(directory, name)
+        if os.path.isfile(path) and os.access(path, os.X_OK):
+            return path
+    return None
+
+
+class LocalTransport(object):
+    '''
+    file:// URLs, copied from the local file system: a stand-in for a file
+    server, e.g. to test the prefetching of a conversion without network
+    '''
+    def handles(self, url):
+        return url.startswith('file://')
+
+    def fetch(self, url, destination):
+        shutil.copyfile(url[len('file://'):], destination)
+
+
+class XRootDTransport(object):
+    '''root:// URLs (e.g. eospublic), copied with xrdcp, or with TFile.Cp when xrdcp is not installed'''
+    def __init__(self, command='xrdcp', options=('--nopbar', '--force')):
+        self.command = findExecutable(command)
+        self.options = list(options)
+        if self.command is None:
+            # TFile.Cp is called from the fetching threads
+            ROOT.ROOT.EnableThreadSafety()
+
+    def handles(self, url):
+        return url.startswith('root://')
+
+    def fetch(self, url, destination):
+        if self.command is not None:
+            subprocess.check_call([self.command] + self.options + [url, destination])
+        elif not ROOT.TFile.Cp(url, destination, False):
+            raise IOError("could not copy {0}".format(url))
+
+
+# Transports tried in turn for a URL; anything else is a local path, read in place
+TRANSPORTS = [XRootDTransport, LocalTransport]
+
+
+class PrefetchCache(object):
+    '''
+    Local copies of remote input files, fetched ahead of their use: while one
+    file is converted, the next depth files of the list are copied in parallel
+    by a pool of threads, so the network latency is paid once per file and
+    overlaps with the event loop.
+
+        prefetch.start(urls)
+        for url in urls:
+            events = Events(prefetch.path(url))   # waits only if the copy is not done
+            ...
+            prefetch.release(url)
+
+    Copies are kept under directory, named after a hash of their URL, and
+    reused by later runs. Once the cache exceeds maxBytes the least recently
+    used copies are removed, never one in use or being fetched.
+    '''
+    def __init__(self, directory="datafiles/prefetch", maxBytes=20*1024**3, depth=2, workers=2, transport=None):
+        '''
+        directory: where the copies are kept
+        maxBytes: size of the cache above which the least recently used copies are removed
+        depth: number of files fetched ahead of the one in use
+        workers: number of files fetched at the same time
+        transport: object with handles(url) and fetch(url, destination) used for
+                   every URL (default: the first of TRANSPORTS handling it)
+        '''
+        self.directory = directory
+        self.maxBytes = maxBytes
+        self.depth = depth
+        self.workers = workers
+        self.transport = transport
+        self.transports = None
+        self.urls = []
+        self.pending = {}
+        self.inUse = set()
+        self.lock = threading.Lock()
+        self.pool = None
+
+    def remote(self, url):
+        '''True if the URL is fetched into the cache, False if it is read in place'''
+        return self.transportFor(url) is not None
+
+    def transportFor(self, url):
+        if self.transport is not None:
+            return self.transport if self.transport.handles(url) else None
+        if self.transports is None:
+            self.transports = [transport() for transport in TRANSPORTS]
+        for transport in self.transports:
+            if transport.handles(url):
+                return transport
+        return None
+
+    def local(self, url):
+        '''Path of the copy of a URL'''
+        key = hashlib.sha1(url.encode('utf-8')).hexdigest()[:16]
+        return os.path.join(self.directory, key + '_' + os.path.basename(url))
+
+    def start(self, urls):
+        '''Give the files to be used, in their order of use, and fetch the first ones'''
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        self.urls = list(urls)
+        if self.pool is None:
+            self.pool = ThreadPool(self.workers)
+        if self.urls:
+            self.schedule(0)
+
+    def schedule(self, index):
+        '''Fetch the files index to index + depth which are not local yet'''
+        for url in self.urls[index:index + self.depth + 1]:
+            if url in self.pending or not self.remote(url) or os.path.exists(self.local(url)):
+                continue
+            with self.lock:
+                self.pending[url] = self.pool.apply_async(self.fetch, (url,))
+
+    def fetch(self, url):
+        '''Worker: copy a URL into the cache; the copy appears complete or not at all'''
+        destination = self.local(url)
+        partial = "{0}.part{1}.{2}".format(destination, os.getpid(), threading.current_thread().ident)
+        try:
+            self.transportFor(url).fetch(url, partial)
+            os.rename(partial, destination)
+        finally:
+            if os.path.exists(partial):
+                os.remove(partial)
+        self.evict()
+        return destination
+
+    def path(self, url):
+        '''
+        Local path of a file, waiting for its copy if needed; the next files are
+        fetched meanwhile. The copy is in use, and kept, until release(url).
+        '''
+        if not self.remote(url):
+            return url
+        index = self.urls.index(url) if url in self.urls else None
+        with self.lock:
+            self.inUse.add(url)
+        if index is not None:
+            self.schedule(index)
+        if url in self.pending:
+            try:
+                self.pending[url].get()
+            finally:
+                with self.lock:
+                    del self.pending[url]
+        elif not os.path.exists(self.local(url)):
+            # Not announced by start: fetched now
+            self.fetch(url)
+        # Last use of the copy, for the eviction
+        os.utime(self.local(url), None)
+        return self.local(url)
+
+    def release(self, url):
+        '''The file is no longer used: its copy may be evicted'''
+        with self.lock:
+            self.inUse.discard(url)
+        self.evict()
+
+    def cachedFiles(self):
+        '''Complete copies, least recently used first: list of (last use, bytes, path)'''
+        cached = []
+        if not os.path.isdir(self.directory):
+            return cached
+        for name in os.listdir(self.directory):
+            if '.part' in name:
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                cached.append((os.path.getmtime(path), os.path.getsize(path), path))
+            except OSError:
+                continue
+        return sorted(cached)
+
+    def evict(self, maxBytes=None):
+        '''Remove the least recently used copies until the cache fits in maxBytes'''
+        maxBytes = self.maxBytes if maxBytes is None else maxBytes
+        with self.lock:
+            # The copies in use and those fetched ahead are the ones about to be read
+            protected = set(self.local(url) for url in self.inUse | set(self.pending))
+            cached = self.cachedFiles()
+            total = sum(size for used, size, path in cached)
+            for used, size, path in cached:
+                if total <= maxBytes:
+                    break
+                if path in protected:
+                    continue
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                total -= size
+
+    def close(self):
+        '''Stop the fetching threads, abandoning the fetches not started yet'''
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+        self.pending = {}
+
+    def clear(self):
+        '''Remove every copy'''
+        self.evict(-1)
@@ -0,0 +1,197 @@
+import os
+import sys
+import json
+import time
+import resource
+import ROOT
+
+
+def peakMemory():
+    '''Peak resident memory of this process, in bytes'''
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if sys.platform == 'darwin' else peak*1024
+
+
+class _Stage(object):
+    '''Timer of one pass through a stage (see Profiler.stage)'''
+    __slots__ = ('profiler', 'name', 'start', 'children')
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+        self.children = 0.
+
+    def __enter__(self):
+        self.profiler.stack.append(self)
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *exception):
+        elapsed = time.time() - self.start
+        stack = self.profiler.stack
+        stack.pop()
+        # A stage only counts its own time: the stages run inside it count theirs
+        self.profiler.add(self.name, elapsed - self.children)
+        if stack:
+            stack[-1].children += elapsed
+        return False
+
+
+class Profiler(object):
+    '''
+    Time spent in each stage of a loop (read, selection, pairs, fill, write...),
+    events and muons processed, bytes read from the ROOT files and peak memory.
+
+        with profiler.stage('read'):
+            tree.GetEntry(event)
+        profiler.count(1, tree.Muon_pt.size())
+
+    A stage run inside another one is only counted in the inner one, so the
+    stages add up to the time spent in them. report() gives the run report,
+    write() stores it as JSON.
+    '''
+    enabled = True
+
+    def __init__(self, name=None):
+        self.name = name
+        self.stack = []
+        self.seconds = {}
+        self.calls = {}
+        self.order = []
+        self.counters = {}
+        self.events = 0
+        self.muons = 0
+        self.start = time.time()
+        self.bytesReadStart = ROOT.TFile.GetFileBytesRead()
+
+    def stage(self, name):
+        '''Context manager timing a pass through the stage name'''
+        return _Stage(self, name)
+
+    def add(self, name, seconds, calls=1):
+        '''Add time spent in a stage, e.g. measured elsewhere'''
+        if name not in self.seconds:
+            self.order.append(name)
+            self.seconds[name] = 0.
+            self.calls[name] = 0
+        self.seconds[name] += seconds
+        self.calls[name] += calls
+
+    def count(self, events, muons=0):
+        '''Events and muons processed'''
+        self.events += events
+        self.muons += muons
+
+    def counter(self, name, value):
+        '''Add to a free counter of the report, e.g. bytes decompressed'''
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def report(self):
+        '''
+        returns: dictionary with the wall time, the time of every stage (seconds,
+                 calls, fraction of the wall time), events and muons processed and
+                 their rates, bytes read, peak memory and the free counters
+        '''
+        wall = time.time() - self.start
+        staged = sum(self.seconds.values())
+        stages = [{'stage': name, 'seconds': self.seconds[name], 'calls': self.calls[name],
+                   'fraction': self.seconds[name]/wall if wall > 0 else 0.} for name in self.order]
+        return {
+            'name': self.name,
+            'wall': wall,
+            'stages': stages,
+            'unstaged': max(wall - staged, 0.),
+            'events': self.events,
+            'muons': self.muons,
+            'eventsPerSecond': self.events/wall if wall > 0 else 0.,
+            'muonsPerSecond': self.muons/wall if wall > 0 else 0.,
+            'bytesRead': ROOT.TFile.GetFileBytesRead() - self.bytesReadStart,
+            'peakMemory': peakMemory(),
+            'counters': dict(self.counters),
+        }
+
+    def summary(self):
+        '''Report as printable lines'''
+        report = self.report()
+        lines = ["*** {0}: {1:.2f} s, {2} events ({3:.0f}/s), {4} muons ({5:.0f}/s), {6:.1f} MB read, peak {7:.1f} MB".format(
+            report['name'], report['wall'], report['events'], report['eventsPerSecond'], report['muons'],
+            report['muonsPerSecond'], report['bytesRead']/1024.**2, report['peakMemory']/1024.**2)]
+        for stage in report['stages']:
+            lines.append("    {stage:12s} {seconds:10.3f} s {fraction:6.1%} ({calls} calls)".format(**stage))
+        return lines
+
+    def write(self, path):
+        '''Write the report as JSON'''
+        with open(path + ".tmp", 'w') as output:
+            json.dump(self.report(), output, indent=1, sort_keys=True)
+        os.rename(path + ".tmp", path)
+
+
+class _NullStage(object):
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception):
+        return False
+
+
+class NullProfiler(object):
+    '''Profiler doing nothing: what the loops use when profiling is off'''
+    enabled = False
+    _stage = _NullStage()
+
+    def stage(self, name):
+        return self._stage
+
+    def add(self, name, seconds, calls=1):
+        pass
+
+    def count(self, events, muons=0):
+        pass
+
+    def counter(self, name, value):
+        pass
+
+
+def newProfiler(enabled, name=None):
+    '''A Profiler, or the NullProfiler when profiling is off'''
+    return Profiler(name) if enabled else NullProfiler()
+
+
+def mergeReports(reports, name=None):
+    '''
+    Report of a job split in several processes (e.g. PROOF workers): times,
+    counts and bytes add up, the wall time and peak memory are the largest ones
+    '''
+    reports = list(reports)
+    seconds, calls, order, counters = {}, {}, [], {}
+    for report in reports:
+        for stage in report['stages']:
+            if stage['stage'] not in seconds:
+                order.append(stage['stage'])
+            seconds[stage['stage']] = seconds.get(stage['stage'], 0.) + stage['seconds']
+            calls[stage['stage']] = calls.get(stage['stage'], 0) + stage['calls']
+        for counter, value in report['counters'].items():
+            counters[counter] = counters.get(counter, 0) + value
+    wall = max([report['wall'] for report in reports] or [0.])
+    events = sum(report['events'] for report in reports)
+    muons = sum(report['muons'] for report in reports)
+    total = sum(seconds.values())
+    return {
+        'name': name,
+        'wall': wall,
+        'stages': [{'stage': stage, 'seconds': seconds[stage], 'calls': calls[stage],
+                    'fraction': seconds[stage]/total if total > 0 else 0.} for stage in order],
+        'unstaged': sum(report['unstaged'] for report in reports),
+        'events': events,
+        'muons': muons,
+        'eventsPerSecond': events/wall if wall > 0 else 0.,
+        'muonsPerSecond': muons/wall if wall > 0 else 0.,
+        'bytesRead': sum(report['bytesRead'] for report in reports),
+        'peakMemory': max([report['peakMemory'] for report in reports] or [0]),
+        'counters': counters,
+        'parts': len(reports),
+    }
@@ -0,0 +1,61 @@
+import collections
+import itertools
+from multiprocessing.pool import ThreadPool
+
+from Profiler import NullProfiler
+
+
+class ReadAhead(object):
+    '''
+    Read-ahead pipeline: background threads read (and decompress) the next
+    chunks of entries while the current one is processed.
+
+        for start, stop, columns in ReadAhead(read, ranges, depth=2):
+            ...
+
+    At most depth chunks are read ahead of the one being processed: a slow
+    consumer holds the readers back, and the memory used stays bounded. Chunks
+    are handed out in the order of the ranges whatever the order in which the
+    threads finish them, so the results do not depend on the timing.
+    '''
+    def __init__(self, read, ranges, depth=2, threads=1, profiler=None):
+        '''
+        read: function(start, stop) returning the columns of the entries [start, stop),
+              called from the reading threads
+        ranges: (start, stop) of the chunks, in their order of use
+        depth: number of chunks read ahead (0: each chunk is read when it is needed)
+        threads: number of chunks read at the same time
+        profiler: Profiler whose 'read' stage gets the time spent waiting for a chunk
+        '''
+        self.read = read
+        self.ranges = ranges
+        self.depth = depth
+        self.threads = threads
+        self.profiler = profiler or NullProfiler()
+
+    def __iter__(self):
+        '''(start, stop, columns) of every chunk, in order'''
+        if self.depth <= 0 or self.threads <= 0:
+            for start, stop in self.ranges:
+                with self.profiler.stage('read'):
+                    columns = self.read(start, stop)
+                yield start, stop, columns
+            return
+
+        pool = ThreadPool(self.threads)
+        try:
+            ranges = iter(self.ranges)
+            queue = collections.deque()
+            for start, stop in itertools.islice(ranges, self.depth):
+                queue.append((start, stop, pool.apply_async(self.read, (start, stop))))
+            while queue:
+                start, stop, result = queue.popleft()
+                with self.profiler.stage('read'):
+                    columns = result.get()
+                # The freed slot goes to the next chunk, read while this one is processed
+                for nextStart, nextStop in itertools.islice(ranges, 1):
+                    queue.append((nextStart, nextStop, pool.apply_async(self.read, (nextStart, nextStop))))
+                yield start, stop, columns
+        finally:
+            pool.terminate()
+            pool.join()
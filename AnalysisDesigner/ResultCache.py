@@ -0,0 +1,154 @@
+import os
+import sys
+import glob
+import json
+import hashlib
+import ROOT
+
+from Dataset import datasetIdentity
+
+SOURCE_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
+# Modules whose code produces the histograms: any change invalidates the results. The
+# scripts and tools (main.py, mainHistos.py, the exe scripts, Runner, Profiler, ...) are
+# not part of it, so changing one of their flags keeps the stored results.
+SOURCES = ['Analyzer', 'Analyzer_All', 'Analyzer_Selection', 'Selector', 'Cuts', 'CutCompiler', 'CutFlow',
+           'Columns', 'HistogramSpec', 'HistogramBank', 'SelectionIndex', 'ColumnStore', 'ColumnCache', 'Dataset']
+
+
+def sourceFiles(analysis=None):
+    '''Sources of SOURCES, and of the modules defining the class of an analysis and its bases'''
+    paths = set(os.path.join(SOURCE_DIRECTORY, name + '.py') for name in SOURCES)
+    for cls in (type(analysis).__mro__ if analysis is not None else ()):
+        path = getattr(sys.modules.get(cls.__module__), '__file__', None)
+        if path:
+            paths.add(os.path.splitext(os.path.abspath(path))[0] + '.py')
+    return sorted(path for path in paths if os.path.exists(path))
+
+
+def sourceVersion(analysis=None):
+    '''Hash of the analysis code (see sourceFiles)'''
+    digest = hashlib.sha1()
+    for path in sourceFiles(analysis):
+        with open(path, 'rb') as source:
+            digest.update(source.read())
+    return digest.hexdigest()
+
+
+def histogramDefinition(histo):
+    '''Class, name, title and binning of a histogram'''
+    axis = histo.GetXaxis()
+    bins = axis.GetXbins()
+    return {
+        'class': histo.ClassName(),
+        'name': histo.GetName(),
+        'title': histo.GetTitle(),
+        'bins': [axis.GetNbins(), axis.GetXmin(), axis.GetXmax()],
+        'edges': [bins.At(i) for i in range(bins.GetSize())],
+    }
+
+
+def resultContext(analysis, cuts=None):
+    '''Inputs of the histograms of an analysis other than their definition'''
+    return {
+        'analyzer': type(analysis).__name__,
+        'code': sourceVersion(analysis),
+        'dataset': datasetIdentity(analysis.dataset),
+        'cuts': cuts.parameters() if cuts else None,
+    }
+
+
+class ResultCache(object):
+    '''
+    Content-addressed cache of histograms: each histogram is stored under a hash
+    of its definition and of everything it is computed from (analyzer, code,
+    input files, cut parameters), so an unchanged request is answered from the
+    cache and adding a histogram only computes that one.
+    The least recently used histograms are removed above maxBytes.
+    '''
+    def __init__(self, directory="datafiles/results", maxBytes=512*1024**2):
+        self.directory = directory
+        self.maxBytes = maxBytes
+
+    def key(self, histo, context):
+        identity = json.dumps({'histogram': histogramDefinition(histo), 'context': context}, sort_keys=True)
+        return hashlib.sha1(identity.encode('utf-8')).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    def get(self, histo, context):
+        '''Cached result for a histogram definition (detached from its file), None on a miss'''
+        path = self.path(self.key(histo, context))
+        if not os.path.exists(path + '.json'):
+            return None
+        rootFile = ROOT.TFile(path + '.root', "read")
+        cached = rootFile.Get(histo.GetName())
+        if not cached:
+            rootFile.Close()
+            return None
+        cached.SetDirectory(0)
+        rootFile.Close()
+        # Last use, for the eviction
+        os.utime(path + '.json', None)
+        return cached
+
+    def put(self, histo, context):
+        '''Store the result of a histogram'''
+        path = self.path(self.key(histo, context))
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        output = ROOT.TFile(path + '.tmp.root', "RECREATE")
+        histo.Write()
+        output.Close()
+        os.rename(path + '.tmp.root', path + '.root')
+        # The description is written last: a result exists once its .json does
+        with open(path + '.tmp.json', 'w') as description:
+            json.dump({'histogram': histo.GetName(), 'context': context}, description, indent=1, sort_keys=True)
+        os.rename(path + '.tmp.json', path + '.json')
+
+    def results(self):
+        '''Stored results, least recently used first: list of (last use, bytes, path without extension)'''
+        stored = []
+        for description in glob.glob(os.path.join(self.directory, '*', '*.json')):
+            path = description[:-len('.json')]
+            if path.endswith('.tmp'):
+                continue
+            try:
+                stored.append((os.path.getmtime(description), os.path.getsize(path + '.root'), path))
+            except OSError:
+                continue
+        return sorted(stored)
+
+    def remove(self, path):
+        for extension in ('.json', '.root'):
+            try:
+                os.remove(path + extension)
+            except OSError:
+                pass
+
+    def evict(self):
+        '''Remove the least recently used results until the cache fits in maxBytes'''
+        stored = self.results()
+        total = sum(size for used, size, path in stored)
+        for used, size, path in stored:
+            if total <= self.maxBytes:
+                break
+            self.remove(path)
+            total -= size
+
+    def invalidate(self, dataset=None, analyzer=None):
+        '''
+        Remove the stored results, all of them or only those of a dataset and/or an analyzer
+        dataset: dataset path, as given to the analyzer
+        analyzer: analyzer class name, e.g. "AnalyzerSel"
+        '''
+        path = os.path.abspath(dataset) if dataset else None
+        for used, size, stored in self.results():
+            with open(stored + '.json') as description:
+                context = json.load(description)['context']
+            if path and not any(identity[0] == path or identity[0].startswith(path + os.sep) for identity in context['dataset']):
+                continue
+            if analyzer and context['analyzer'] != analyzer:
+                continue
+            self.remove(stored)
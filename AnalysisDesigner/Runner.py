@@ -0,0 +1,133 @@
+import os
+import json
+import shutil
+import hashlib
+import importlib
+import multiprocessing
+import ROOT
+
+from Columns import entryRanges
+from Dataset import datasetIdentity
+from HistogramBank import reduceFiles
+
+
+def argumentIdentity(arg):
+    '''Identity of a process argument: the cut parameters of a Selector or of Cuts, the repr of anything else'''
+    cuts = getattr(arg, 'cuts', arg)
+    if hasattr(cuts, 'parameters'):
+        return [type(arg).__name__, cuts.parameters()]
+    return repr(arg)
+
+
+def runRange(task):
+    '''
+    Worker: run the analyzer over one range of entries and spill its histograms
+    task: (module, class name, dataset, start, stop, process args, columnar, chunk size, spill path)
+    '''
+    module, className, dataset, start, stop, args, columnar, chunkSize, path = task
+    analysis = getattr(importlib.import_module(module), className)(dataset)
+    analysis.beginJob()
+    if columnar:
+        for first, last, columns in analysis.readAhead(entryRanges(stop, chunkSize or analysis.chunkSize, start)):
+            analysis.processColumns(first, last, *args, columns=columns)
+    else:
+        analysis.ActivateBranches(*args)
+        for event in range(start, stop):
+            analysis.process(event, *args)
+    return analysis.Bank().spill(path)
+
+
+def spawnPool(workers, initializer=None, args=()):
+    '''
+    Pool of worker processes started in fresh interpreters: forked workers would
+    share the parent's open TFile and ROOT state. Falls back to the default
+    start method where multiprocessing has no contexts (Python 2)
+    initializer, args: called as initializer(*args) in every worker
+    '''
+    context = multiprocessing.get_context('spawn') if hasattr(multiprocessing, 'get_context') else multiprocessing
+    return context.Pool(workers, initializer, args)
+
+
+class ParallelRunner(object):
+    '''
+    Run the beginJob/process/endJob lifecycle of any Analyzer subclass in worker
+    processes, each over its own ranges of entries and with its own file handle,
+    and merge the histograms into the file endJob would have written.
+
+    Every range spills its histograms to datafiles/<name>.<key>.parts, the key
+    being a hash of the analyzer, its arguments, the mode and the dataset files:
+    when a run crashes, running it again with the same inputs only processes the
+    ranges without a spill. The parts are removed once the output is written.
+    '''
+    def __init__(self, analyzerClass, workers=None, args=(), columnar=False, chunkSize=None, rangeSize=None, dataset=None):
+        '''
+        analyzerClass: Analyzer subclass to run, e.g. AnalyzerSel
+        workers: number of processes (default: number of cores)
+        args: extra arguments of process/processColumns, e.g. (Selector(),)
+        columnar: use processColumns instead of process
+        rangeSize: entries per spilled range (default: one range per worker)
+        dataset: input of the analyzers (default: Analyzer.dataset)
+        '''
+        self.analyzerClass = analyzerClass
+        self.workers = workers or multiprocessing.cpu_count()
+        self.args = tuple(args)
+        self.columnar = columnar
+        self.chunkSize = chunkSize
+        self.rangeSize = rangeSize
+        self.dataset = dataset
+
+    def ranges(self, numEntries):
+        '''Split the entries in consecutive ranges, one per worker by default'''
+        size = self.rangeSize or max(1, -(-numEntries // self.workers))
+        return list(entryRanges(numEntries, size))
+
+    def key(self):
+        '''Hash of what the spilled ranges depend on: analyzer, process arguments, mode and dataset files'''
+        identity = json.dumps({
+            'analyzer': [self.analyzerClass.__module__, self.analyzerClass.__name__],
+            'args': [argumentIdentity(arg) for arg in self.args],
+            'columnar': self.columnar,
+            'dataset': datasetIdentity(self.dataset or self.analyzerClass.dataset),
+        }, sort_keys=True)
+        return hashlib.sha1(identity.encode('utf-8')).hexdigest()[:16]
+
+    def pool(self):
+        return spawnPool(self.workers)
+
+    def run(self, name, numEntries=None):
+        '''
+        Run the analysis and write the merged histograms in datafiles/name
+        numEntries: number of entries to process (default: the whole tree)
+        '''
+        if numEntries is None:
+            analysis = self.analyzerClass(self.dataset)
+            numEntries = analysis.numEntries
+            if analysis.file and not hasattr(multiprocessing, 'get_context'):
+                # Forked workers must open their own file handle
+                analysis.file.Close()
+
+        partsDir = "datafiles/{0}.{1}.parts".format(name, self.key())
+        if not os.path.isdir(partsDir):
+            os.makedirs(partsDir)
+        tasks = [(self.analyzerClass.__module__, self.analyzerClass.__name__, self.dataset, start, stop,
+                  self.args, self.columnar, self.chunkSize, "{0}/{1}-{2}.root".format(partsDir, start, stop))
+                 for start, stop in self.ranges(numEntries)]
+        # Ranges already spilled by a previous, interrupted run are not processed again
+        todo = [task for task in tasks if not os.path.exists(task[-1])]
+
+        pool = self.pool()
+        try:
+            pool.map(runRange, todo)
+            # The parts are kept until the output is written: a crash from here on loses no range
+            bank = reduceFiles([task[-1] for task in tasks], partsDir + "/merged.root", pool=pool, remove=False)
+        finally:
+            pool.close()
+            pool.join()
+
+        # Write the merged histograms exactly as endJob does for a serial run
+        analysis = self.analyzerClass(self.dataset)
+        analysis.beginJob()
+        analysis.LoadBank(bank)
+        analysis.endJob(name)
+        shutil.rmtree(partsDir)
+        return "datafiles/" + name
@@ -0,0 +1,171 @@
+import os
+import json
+import hashlib
+import numpy
+import ROOT
+
+from Cuts import Cuts
+from CutFlow import CutFlow
+from Columns import Instances
+from Dataset import datasetIdentity
+
+
+class SelectionIndex(object):
+    '''
+    Entries of a dataset with at least one muon passing a Cuts selection, and the
+    position of the selected muons inside each of these entries. The muons of
+    entries[k] are muons[offsets[k]:offsets[k+1]].
+    '''
+    def __init__(self, entries, offsets, muons, parameters, cutFlow=None):
+        '''
+        parameters: Cuts.parameters() of the selection
+        cutFlow: number of muons first rejected by each cut, as CutFlow.rejected
+                 (None when the index was derived from a looser one)
+        '''
+        self.entries = numpy.asarray(entries, dtype=numpy.int64)
+        self.offsets = numpy.asarray(offsets, dtype=numpy.int64)
+        self.muons = numpy.asarray(muons, dtype=numpy.int64)
+        self.parameters = parameters
+        self.cutFlow = None if cutFlow is None else numpy.asarray(cutFlow, dtype=numpy.int64)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def eventMuons(self, k):
+        '''Selected muons of the k-th entry of the index'''
+        return self.muons[self.offsets[k]:self.offsets[k+1]]
+
+    def entryList(self, tree, name="selection"):
+        '''TEntryList of the entries, to restrict TTree::Draw/Project to them'''
+        entryList = ROOT.TEntryList(name, name)
+        for entry in self.entries:
+            entryList.Enter(int(entry), tree)
+        return entryList
+
+    @classmethod
+    def build(cls, analysis, cuts, looser=None):
+        '''
+        Scan a dataset for the muons passing the cuts
+        analysis: Analyzer reading the dataset (in chunks, through readColumns)
+        looser: index of looser cuts on the same dataset: only its entries and muons are tested
+        '''
+        cutFlow = CutFlow(cuts) if looser is None else None
+        entries, counts, muons = [], [], []
+        for start, stop in analysis.chunks():
+            if looser is not None:
+                first, last = numpy.searchsorted(looser.entries, [start, stop])
+                if first == last:
+                    continue
+            columns = analysis.readColumns(start, stop, cuts.BRANCHES)
+            # Muons of Muon_pt: those lacking a branch fail the cuts reading it, as in TTreeFormula
+            instances = Instances(columns)
+            begin = columns['Muon_pt'].offsets
+            event = columns['Muon_pt'].parents()
+            local = columns['Muon_pt'].localIndex()
+
+            if cutFlow is not None:
+                passed = cutFlow.fill(columns) == len(cutFlow.columnCuts)
+            else:
+                # Every muon passing tighter cuts passes the looser ones
+                candidates = numpy.repeat(looser.entries[first:last] - start, numpy.diff(looser.offsets[first:last+1]))
+                candidates = begin[candidates] + looser.muons[looser.offsets[first]:looser.offsets[last]]
+                passed = numpy.zeros(len(instances), dtype=bool)
+                # The candidates passed the looser cuts: they have every branch
+                passed[candidates] = cuts.select(dict((branch, instances[branch][candidates]) for branch in cuts.BRANCHES))
+
+            perEvent = numpy.bincount(event[passed], minlength=len(columns['Muon_pt']))
+            entries.append(start + numpy.flatnonzero(perEvent))
+            counts.append(perEvent[perEvent > 0])
+            muons.append(local[passed])
+
+        counts = numpy.concatenate(counts) if counts else numpy.zeros(0, dtype=numpy.int64)
+        offsets = numpy.zeros(len(counts) + 1, dtype=numpy.int64)
+        numpy.cumsum(counts, out=offsets[1:])
+        return cls(numpy.concatenate(entries) if entries else [], offsets,
+                   numpy.concatenate(muons) if muons else [], cuts.parameters(),
+                   None if cutFlow is None else cutFlow.rejected)
+
+    def save(self, path, description):
+        '''Write the index in path.npz and its description in path.json'''
+        numpy.savez(path + ".tmp.npz", entries=self.entries, offsets=self.offsets, muons=self.muons,
+                    cutFlow=self.cutFlow if self.cutFlow is not None else numpy.zeros(0, dtype=numpy.int64))
+        os.rename(path + ".tmp.npz", path + ".npz")
+        description = dict(description, parameters=self.parameters, entries=len(self.entries),
+                           muons=len(self.muons), cutFlow=self.cutFlow is not None)
+        with open(path + ".tmp.json", 'w') as output:
+            json.dump(description, output, indent=1, sort_keys=True)
+        os.rename(path + ".tmp.json", path + ".json")
+
+    @classmethod
+    def load(cls, path):
+        with open(path + ".json") as description:
+            description = json.load(description)
+        arrays = numpy.load(path + ".npz")
+        return cls(arrays['entries'], arrays['offsets'], arrays['muons'], description['parameters'],
+                   arrays['cutFlow'] if description['cutFlow'] else None)
+
+
+class SelectionIndexStore(object):
+    '''
+    Selection indices persisted on disk, keyed by a hash of the cut parameters
+    and of the identity of the dataset files: a later run with the same cuts on
+    the same dataset reads the index instead of scanning the dataset again, and
+    tighter cuts start from the smallest stored index of looser ones.
+    '''
+    def __init__(self, directory="datafiles/selections"):
+        self.directory = directory
+
+    def key(self, cuts, dataset):
+        identity = json.dumps({'cuts': cuts.parameters(), 'dataset': datasetIdentity(dataset)}, sort_keys=True)
+        return hashlib.sha1(identity.encode('utf-8')).hexdigest()[:16]
+
+    def descriptions(self):
+        '''Description of every stored index: list of (path without extension, description)'''
+        if not os.path.isdir(self.directory):
+            return []
+        stored = []
+        for name in sorted(os.listdir(self.directory)):
+            if name.endswith('.json') and not name.endswith('.tmp.json'):
+                path = os.path.join(self.directory, name[:-len('.json')])
+                with open(path + ".json") as description:
+                    stored.append((path, json.load(description)))
+        return stored
+
+    def looser(self, cuts, dataset):
+        '''Smallest stored index of looser cuts on the same dataset, None if there is none'''
+        identity = json.loads(json.dumps(datasetIdentity(dataset)))
+        best = None
+        for path, description in self.descriptions():
+            if description['dataset'] != identity:
+                continue
+            if Cuts(**description['parameters']).looserThan(cuts) and (best is None or description['entries'] < best[1]):
+                best = (path, description['entries'])
+        return SelectionIndex.load(best[0]) if best else None
+
+    def get(self, analysis, cuts, cutFlow=False, build=True):
+        '''
+        Index of the cuts on the dataset of an analysis, built and stored if needed
+        cutFlow: the index must hold the cut flow of every muon (it cannot be
+                 derived from a looser index then)
+        build: False to only read a stored index: None if there is none
+        '''
+        path = os.path.join(self.directory, self.key(cuts, analysis.dataset))
+        if os.path.exists(path + ".json"):
+            index = SelectionIndex.load(path)
+            if index.cutFlow is not None or not cutFlow:
+                return index
+        if not build:
+            return None
+
+        looser = None if cutFlow else self.looser(cuts, analysis.dataset)
+        index = SelectionIndex.build(analysis, cuts, looser)
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        index.save(path, {'dataset': datasetIdentity(analysis.dataset)})
+        return index
+
+    def invalidate(self):
+        '''Remove every stored index'''
+        for path, description in self.descriptions():
+            for extension in ('.json', '.npz'):
+                os.remove(path + extension)
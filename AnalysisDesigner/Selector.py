@@ -1,54 +1,73 @@
 import os
 import logging
+import numpy
 import ROOT
 
 from Cuts import Cuts
+from CutFlow import CutFlow
+from Columns import Instances, JaggedArray
+
+class EventColumns(object):
+        '''Muon branches of the current event of an analysis, read as one-event JaggedArrays on demand'''
+        def __init__(self, analysis):
+                self.analysis = analysis
+
+        def __getitem__(self, branch):
+                values = numpy.asarray(getattr(self.analysis, branch), dtype=numpy.float64)
+                return JaggedArray(values, [0, len(values)])
 
 class Selector(object):
         ''' Class that make the selection from a defined Cuts'''
+        def __init__(self, cuts=None):
+                # Single definition of the cuts, shared with the tree-driven analysis
+                self.cuts = cuts if cuts is not None else Cuts()
+                self.cutFlow = None
+                self.cachedEntry = None
+                self.cachedBits = None
+
+        def bits(self, analysis):
+                '''
+                Bitmask of the cuts passed by every muon of the current event (bit k:
+                cut k of Cuts.sequentialSelection), computed once per event and cached
+                '''
+                entry = (id(analysis), analysis.tree.GetReadEntry())
+                if entry != self.cachedEntry:
+                        if self.cutFlow is None:
+                                self.cutFlow = CutFlow(self.cuts)
+                        # Muons lacking a branch (Muon_NValidHitsSATk) fail the cuts reading it
+                        self.cachedBits = self.cutFlow.bits(Instances(EventColumns(analysis)))
+                        self.cachedEntry = entry
+                return self.cachedBits
+
+        def stagesFromBits(self, bits):
+                '''Number of consecutive cuts passed by every muon, from its bitmask'''
+                return self.cutFlow.stagesFromBits(bits)
+
+        def selected(self, analysis):
+                '''True for every muon of the current event passing all the cuts'''
+                return self.bits(analysis) == self.cutFlow.allPassed()
+
         def selector(self, analysis, particle):
-                cuts = Cuts()
-
-                '''Main class for making the selection'''
-                if not analysis.Muon_isGlobalMuon[particle] or not analysis.Muon_isTrackerMuon[particle]:
-                        return False
-                analysis.h_efficiency.Fill(2)
-                
-                if analysis.Muon_pt [particle] < cuts.pt_min:
-                        return False
-                analysis.h_efficiency.Fill(3)
-
-                if analysis.Muon_eta[particle] > cuts.eta_max:
-                        return False
-                analysis.h_efficiency.Fill(4)
-
-                if analysis.Muon_normChi2[particle] > cuts.normChi2:
-                        return False
-                analysis.h_efficiency.Fill(5)
-                
-                if analysis.Muon_NValidHitsSATk[particle] < cuts.numValidHitsSTATk:
-                        return False
-                analysis.h_efficiency.Fill(6)
-                
-                if analysis.Muon_numberOfValidHits[particle] < cuts.numValidHits:
-                        return False
-                analysis.h_efficiency.Fill(7)
-                                          
-                if analysis.Muon_numOfMatches[particle] < cuts.numOfMatches:
-                        return False
-                analysis.h_efficiency.Fill(8)
-
-                if analysis.Muon_distance[particle] > cuts.dz_max:
-                        return False
-                analysis.h_efficiency.Fill(9)
-                
-                if analysis.Muon_dB[particle] > cuts.dB_max:
-                        return False
-                analysis.h_efficiency.Fill(10)
-
-                if ((analysis.Muon_isolation_sumPt[particle]+analysis.Muon_isolation_emEt[particle]+analysis.Muon_isolation_hadEt[particle])/analysis.Muon_pt[particle]) > cuts.relIsolation:
-                        return False
-                analysis.h_efficiency.Fill(11)
-               
-                return True
+                '''Main class for making the selection: reads the cached bitmask of the event'''
+                return self.bits(analysis)[particle] == self.cutFlow.allPassed()
+
+        def stages(self, columns):
+                '''
+                Columnar version of selector: number of consecutive cuts passed by
+                every muon of a chunk (10 means the muon is selected), one value per
+                muon of Muon_pt. A muon lacking a branch fails the cuts reading it.
+                columns: dictionary {branch name: JaggedArray} from readColumns
+                '''
+                return CutFlow(self.cuts).stages(Instances(columns))
+
+        def mask(self, columns):
+                '''Columnar version of selector: True for every selected muon of a chunk, one value per muon of Muon_pt'''
+                return self.cuts.select(Instances(columns))
 
+        def __getstate__(self):
+                # The cut functions are closures: build them again after unpickling
+                state = dict(self.__dict__)
+                state['cutFlow'] = None
+                state['cachedEntry'] = None
+                state['cachedBits'] = None
+                return state
@@ -0,0 +1,215 @@
+import math
+import numpy
+import ROOT
+
+from TreeWriter import BatchWriter, MUON_BRANCHES
+from ColumnStore import ColumnStoreWriter
+from Columns import JaggedArray
+
+MUON_MASS = 0.1056583745
+Z_MASS = 91.1876
+Z_WIDTH = 2.4952
+
+# Muons outside the acceptance of the muon system are not reconstructed
+ETA_MAX = 2.5
+PT_MIN = 0.5
+
+
+def breitWigner(n, mass, width, random, window=30.):
+    '''Breit-Wigner masses (Cauchy sampling), inside mass +- window'''
+    masses = numpy.zeros(n)
+    todo = numpy.arange(n)
+    while len(todo):
+        masses[todo] = mass + 0.5*width*numpy.tan(math.pi*(random.uniform(size=len(todo)) - 0.5))
+        todo = todo[numpy.abs(masses[todo] - mass) > window]
+    return masses
+
+
+def powerLaw(n, minimum, index, random):
+    '''Values above minimum distributed as x^-index: a falling spectrum'''
+    return minimum*random.uniform(size=n)**(-1./(index - 1.))
+
+
+def decayToMuons(masses, random, ptScale=8., rapidityWidth=1.8):
+    '''
+    Two-body decay of dimuon resonances produced with a falling transverse
+    momentum and a central rapidity, the muons isotropic in the rest frame
+    masses: mass of each decaying particle
+    returns: (px, py, pz, energy) of the first and of the second muons
+    '''
+    n = len(masses)
+    # Mother four-momentum
+    pt = random.exponential(ptScale, n)
+    phi = random.uniform(-math.pi, math.pi, n)
+    rapidity = random.normal(0., rapidityWidth, n)
+    mt = numpy.sqrt(masses*masses + pt*pt)
+    mother = numpy.array([pt*numpy.cos(phi), pt*numpy.sin(phi), mt*numpy.sinh(rapidity)])
+    energy = mt*numpy.cosh(rapidity)
+
+    # Muons back to back in the rest frame
+    p = numpy.sqrt(numpy.maximum(masses*masses/4. - MUON_MASS**2, 0.))
+    cosTheta = random.uniform(-1., 1., n)
+    sinTheta = numpy.sqrt(1. - cosTheta*cosTheta)
+    phi = random.uniform(-math.pi, math.pi, n)
+    rest = p*numpy.array([sinTheta*numpy.cos(phi), sinTheta*numpy.sin(phi), cosTheta])
+    restEnergy = masses/2.
+
+    # Boost to the laboratory frame
+    beta = mother/energy
+    beta2 = numpy.maximum((beta*beta).sum(axis=0), 1e-12)
+    gamma = energy/masses
+    muons = []
+    for sign in (1., -1.):
+        betaP = (beta*sign*rest).sum(axis=0)
+        momentum = sign*rest + ((gamma - 1.)*betaP/beta2 + gamma*restEnergy)*beta
+        muons.append((momentum[0], momentum[1], momentum[2], gamma*(restEnergy + betaP)))
+    return muons
+
+
+def muonQuality(n, prompt, pt, random):
+    '''
+    Identification, track and isolation variables of reconstructed muons
+    prompt: True for muons of a Z or Drell-Yan decay (isolated, from the primary
+            vertex, well reconstructed), False for muons from hadron decays and fakes
+    returns: dictionary {branch name: array}; Muon_NValidHitsSATk is only
+             meaningful for the standalone muons
+    '''
+    def pick(promptValues, otherValues):
+        return numpy.where(prompt, promptValues, otherValues)
+
+    isGlobal = random.uniform(size=n) < pick(0.96, 0.55)
+    isTracker = random.uniform(size=n) < pick(0.98, 0.85)
+    isStandAlone = isGlobal | (random.uniform(size=n) < 0.1)
+    # Hadronic activity around the muon grows with its momentum for non-prompt muons
+    activity = pick(1., 0.3*pt + 2.)
+    quality = {
+        'Muon_isGlobalMuon': isGlobal,
+        'Muon_isTrackerMuon': isTracker,
+        'Muon_isStandAloneMuon': isStandAlone,
+        'Muon_dB': numpy.abs(random.normal(0., pick(0.004, 0.04), n)) + pick(0., random.exponential(0.03, n)),
+        'Muon_edB': 0.001 + random.exponential(0.002, n),
+        'Muon_isolation_sumPt': random.exponential(1., n)*activity*(random.uniform(size=n) < pick(0.4, 0.95)),
+        'Muon_isolation_emEt': random.exponential(0.8, n)*activity,
+        'Muon_isolation_hadEt': random.exponential(0.8, n)*activity,
+        'Muon_numberOfValidHits': random.binomial(pick(25, 20), pick(0.85, 0.7)),
+        'Muon_normChi2': random.gamma(pick(6., 3.), pick(1./6, 1.), n),
+        'Muon_distance': random.normal(0., pick(0.02, 0.15), n),
+        'Muon_numOfMatches': numpy.where(isGlobal, 1 + random.binomial(3, pick(0.8, 0.4)), random.binomial(1, 0.3, n)),
+        'Muon_NValidHitsSATk': random.binomial(40, pick(0.6, 0.4)),
+    }
+    # Tracker-only muons have no track fit in the muon system
+    quality['Muon_normChi2'] = numpy.where(isGlobal, quality['Muon_normChi2'], random.gamma(2., 0.5, n))
+    return quality
+
+
+def syntheticMuons(events, multiplicity=1., random=None, zFraction=0.05, dyFraction=0.02):
+    '''
+    Simulated events with the branches of the muons tree: a fraction of Z->mumu
+    events and of Drell-Yan continuum events (two prompt muons of opposite
+    charges), and in every event a Poisson number of non-prompt muons with a
+    falling transverse momentum. Muons are kept inside the acceptance, ordered
+    by decreasing transverse momentum in each event.
+    events: number of events
+    multiplicity: mean number of non-prompt muons per event
+    random: numpy RandomState
+    zFraction, dyFraction: fractions of Z and Drell-Yan events
+    returns: (columns, offsets): dictionary {branch name: flat array} and the event offsets;
+             Muon_NValidHitsSATk is a JaggedArray with the standalone muons
+             only, as createTTree writes it
+    '''
+    random = random or numpy.random.RandomState()
+    kind = random.uniform(size=events)
+    zEvents = numpy.flatnonzero(kind < zFraction)
+    dyEvents = numpy.flatnonzero((kind >= zFraction) & (kind < zFraction + dyFraction))
+    pairEvents = numpy.concatenate([zEvents, dyEvents])
+    masses = numpy.concatenate([breitWigner(len(zEvents), Z_MASS, Z_WIDTH, random),
+                                numpy.minimum(powerLaw(len(dyEvents), 12., 3., random), 1000.)])
+    (px1, py1, pz1, e1), (px2, py2, pz2, e2) = decayToMuons(masses, random)
+    charge1 = 2*random.randint(0, 2, len(pairEvents)) - 1
+
+    counts = random.poisson(multiplicity, events)
+    backgroundEvents = numpy.repeat(numpy.arange(events), counts)
+    nBackground = len(backgroundEvents)
+    pt = numpy.minimum(powerLaw(nBackground, 2., 4., random), 500.)
+    eta = random.uniform(-ETA_MAX, ETA_MAX, nBackground)
+    phi = random.uniform(-math.pi, math.pi, nBackground)
+    pxB, pyB, pzB = pt*numpy.cos(phi), pt*numpy.sin(phi), pt*numpy.sinh(eta)
+    eB = numpy.sqrt(pxB*pxB + pyB*pyB + pzB*pzB + MUON_MASS**2)
+
+    event = numpy.concatenate([pairEvents, pairEvents, backgroundEvents])
+    px = numpy.concatenate([px1, px2, pxB])
+    py = numpy.concatenate([py1, py2, pyB])
+    pz = numpy.concatenate([pz1, pz2, pzB])
+    energy = numpy.concatenate([e1, e2, eB])
+    charge = numpy.concatenate([charge1, -charge1, 2*random.randint(0, 2, nBackground) - 1])
+    prompt = numpy.concatenate([numpy.ones(2*len(pairEvents), dtype=bool), numpy.zeros(nBackground, dtype=bool)])
+
+    # Momentum resolution of 1.5%
+    smear = 1. + random.normal(0., 0.015, len(px))
+    px, py, pz = px*smear, py*smear, pz*smear
+    energy = numpy.sqrt(px*px + py*py + pz*pz + MUON_MASS**2)
+    pt = numpy.hypot(px, py)
+    eta = numpy.arcsinh(pz/numpy.maximum(pt, 1e-9))
+
+    # Acceptance, then muons of each event by decreasing pt
+    accepted = (numpy.abs(eta) < ETA_MAX) & (pt > PT_MIN)
+    order = numpy.flatnonzero(accepted)
+    order = order[numpy.lexsort((-pt[order], event[order]))]
+    event, px, py, pz, energy, charge, prompt, pt, eta = [a[order] for a in (event, px, py, pz, energy, charge, prompt, pt, eta)]
+    offsets = numpy.zeros(events + 1, dtype=numpy.int64)
+    numpy.cumsum(numpy.bincount(event, minlength=events), out=offsets[1:])
+
+    columns = {
+        'Muon_pt': pt,
+        'Muon_eta': eta,
+        'Muon_px': px,
+        'Muon_py': py,
+        'Muon_pz': pz,
+        'Muon_energy': energy,
+        'Muon_charge': charge,
+    }
+    columns.update(muonQuality(len(pt), prompt, pt, random))
+    standAlone = columns['Muon_isStandAloneMuon']
+    standAloneOffsets = numpy.zeros(events + 1, dtype=numpy.int64)
+    numpy.cumsum(numpy.bincount(event[standAlone], minlength=events), out=standAloneOffsets[1:])
+    columns['Muon_NValidHitsSATk'] = JaggedArray(columns['Muon_NValidHitsSATk'][standAlone], standAloneOffsets)
+    return columns, offsets
+
+
+def writeSynthetic(path, events, multiplicity=1., seed=1, chunkSize=100000, store=None, writeTree=True,
+                   zFraction=0.05, dyFraction=0.02):
+    '''
+    Write a synthetic dataset with the schema of createTTree. Events are
+    generated and written one chunk at a time, so the memory used does not
+    depend on the number of events. A dataset is reproducible from its seed
+    and chunkSize.
+    path: ROOT file of the muons tree
+    store: directory of a column store written alongside (optional)
+    returns: number of events written
+    '''
+    rootFile, tree, vectors = None, None, {}
+    if writeTree:
+        rootFile = ROOT.TFile(path, "RECREATE")
+        tree = ROOT.TTree("muons", "muons tree")
+        for branch, ctype in MUON_BRANCHES:
+            vectors[branch] = ROOT.std.vector(ctype)()
+            tree.Branch(branch, vectors[branch])
+    storeWriter = ColumnStoreWriter(store, MUON_BRANCHES) if store else None
+    writer = BatchWriter(tree, [(branch, ctype, vectors.get(branch)) for branch, ctype in MUON_BRANCHES], chunkSize, storeWriter)
+    written = 0
+    chunk = 0
+    while written < events:
+        # Independent stream per chunk: any chunk can be generated again on its own
+        random = numpy.random.RandomState([seed, chunk])
+        columns, offsets = syntheticMuons(min(chunkSize, events - written), multiplicity, random, zFraction, dyFraction)
+        written += writer.writeColumns(columns, offsets)
+        if storeWriter is not None:
+            storeWriter.commit()
+        chunk += 1
+        print("> {0}/{1} synthetic events written".format(written, events))
+    if storeWriter is not None:
+        storeWriter.close()
+    if tree is not None:
+        tree.Write()
+        rootFile.Close()
+    return written
@@ -0,0 +1,199 @@
+import array
+import numpy
+import ROOT
+
+from Profiler import NullProfiler
+from Columns import JaggedArray
+
+# C++ helper that fills a whole batch of events from flat contents plus
+# per-event offsets, so a batch costs one Python -> C++ call per branch and one
+# for the tree fills, instead of one push_back per muon and branch.
+_WRITER_CODE = '''
+#include <vector>
+#include "TTree.h"
+
+template <typename T>
+struct CmsOpenData_BatchColumn {
+    std::vector<T>* target;
+    const T* content;
+    const Long64_t* offsets;
+};
+
+template <typename T>
+void CmsOpenData_setEvent(std::vector<CmsOpenData_BatchColumn<T> >& columns, Long64_t event)
+{
+    for (size_t i = 0; i < columns.size(); ++i) {
+        CmsOpenData_BatchColumn<T>& column = columns[i];
+        column.target->assign(column.content + column.offsets[event], column.content + column.offsets[event+1]);
+    }
+}
+
+template <typename T>
+void CmsOpenData_release(std::vector<CmsOpenData_BatchColumn<T> >& columns)
+{
+    for (size_t i = 0; i < columns.size(); ++i)
+        columns[i].target->clear();
+    columns.clear();
+}
+
+class CmsOpenData_BatchFiller {
+public:
+    void addFloat(std::vector<float>& target, const float* content, const Long64_t* offsets)
+    {
+        CmsOpenData_BatchColumn<float> column = {&target, content, offsets};
+        fFloats.push_back(column);
+    }
+    void addInt(std::vector<int>& target, const int* content, const Long64_t* offsets)
+    {
+        CmsOpenData_BatchColumn<int> column = {&target, content, offsets};
+        fInts.push_back(column);
+    }
+    Long64_t fill(TTree* tree, Long64_t events)
+    {
+        for (Long64_t event = 0; event < events; ++event) {
+            CmsOpenData_setEvent(fFloats, event);
+            CmsOpenData_setEvent(fInts, event);
+            tree->Fill();
+        }
+        CmsOpenData_release(fFloats);
+        CmsOpenData_release(fInts);
+        return events;
+    }
+private:
+    std::vector<CmsOpenData_BatchColumn<float> > fFloats;
+    std::vector<CmsOpenData_BatchColumn<int> > fInts;
+};
+'''
+_writerDeclared = False
+
+# array.array typecode and numpy dtype of each C++ element type written
+TYPECODES = {
+    'float': ('f', numpy.float32),
+    'int': ('i', numpy.int32),
+}
+
+# (branch name, C++ element type) of every vector branch of the muons tree
+MUON_BRANCHES = [
+    ("Muon_pt", "float"),
+    ("Muon_eta", "float"),
+    ("Muon_px", "float"),
+    ("Muon_py", "float"),
+    ("Muon_pz", "float"),
+    ("Muon_energy", "float"),
+    ("Muon_isGlobalMuon", "int"),
+    ("Muon_isTrackerMuon", "int"),
+    ("Muon_isStandAloneMuon", "int"),
+    ("Muon_dB", "float"),
+    ("Muon_edB", "float"),
+    ("Muon_isolation_sumPt", "float"),
+    ("Muon_isolation_emEt", "float"),
+    ("Muon_isolation_hadEt", "float"),
+    ("Muon_numberOfValidHits", "int"),
+    ("Muon_normChi2", "float"),
+    ("Muon_charge", "int"),
+    ("Muon_distance", "float"),
+    ("Muon_numOfMatches", "int"),
+    ("Muon_NValidHitsSATk", "int"),
+]
+
+
+class BatchWriter(object):
+    '''
+    Buffered writer of vector branches: the values of a batch of events are
+    appended to one contiguous typed array per branch, with its own event
+    offsets, and written to the tree in bulk. The tree gets exactly the entries
+    that setting the vectors and calling Fill for every event would give.
+
+    The buffer of a branch is an attribute named after it, e.g.
+    writer.Muon_pt.append(pt); endEvent() closes the event.
+    '''
+    def __init__(self, tree, branches, batchSize=1000, store=None, profiler=None):
+        '''
+        tree: TTree whose branches are bound to the vectors (None: no tree is written)
+        branches: list of (branch name, C++ element type, bound vector)
+        batchSize: number of events buffered before they are written
+        store: ColumnStoreWriter receiving the same batches (optional)
+        profiler: Profiler timing the writing of the batches (optional)
+        '''
+        global _writerDeclared
+        if not _writerDeclared:
+            ROOT.gInterpreter.Declare(_WRITER_CODE)
+            _writerDeclared = True
+
+        self.tree = tree
+        self.branches = list(branches)
+        self.batchSize = batchSize
+        self.store = store
+        self.profiler = profiler or NullProfiler()
+        self.filler = ROOT.CmsOpenData_BatchFiller()
+        self.reset()
+
+    def reset(self):
+        '''Start an empty batch'''
+        self.events = 0
+        self.offsets = {}
+        for name, ctype, vector in self.branches:
+            setattr(self, name, array.array(TYPECODES[ctype][0]))
+            self.offsets[name] = [0]
+
+    def endEvent(self):
+        '''Close the current event, and write the batch once it is full'''
+        for name, ctype, vector in self.branches:
+            self.offsets[name].append(len(getattr(self, name)))
+        self.events += 1
+        if self.events >= self.batchSize:
+            self.flush()
+
+    def flush(self):
+        '''
+        Write the buffered events to the tree
+        returns: number of events written
+        '''
+        if not self.events:
+            return 0
+        written = self.write([(numpy.frombuffer(getattr(self, name), dtype=TYPECODES[ctype][1]),
+                               numpy.array(self.offsets[name], dtype=numpy.int64))
+                              for name, ctype, vector in self.branches], self.events)
+        self.reset()
+        return written
+
+    def writeColumns(self, columns, offsets):
+        '''
+        Write a batch of events already laid out as flat arrays, after the
+        buffered events
+        columns: dictionary {branch name: flat content array}, or JaggedArray for
+                 a branch with its own number of values per event
+        offsets: event offsets shared by the other branches
+        returns: number of events written
+        '''
+        self.flush()
+        offsets = numpy.asarray(offsets, dtype=numpy.int64)
+        arrays = []
+        for name, ctype, vector in self.branches:
+            column = columns[name]
+            if isinstance(column, JaggedArray):
+                arrays.append((numpy.ascontiguousarray(column.content, dtype=TYPECODES[ctype][1]), column.offsets))
+            else:
+                arrays.append((numpy.ascontiguousarray(column, dtype=TYPECODES[ctype][1]), offsets))
+        return self.write(arrays, len(offsets) - 1)
+
+    def write(self, arrays, events):
+        '''Write (content, offsets) arrays, one per branch, holding some events'''
+        with self.profiler.stage('write'):
+            # The arrays must stay alive until the filler has copied them
+            for (name, ctype, vector), (content, offsets) in zip(self.branches, arrays):
+                if self.store is not None:
+                    self.store.append(name, content, offsets)
+                if self.tree is None:
+                    continue
+                if ctype == 'float':
+                    self.filler.addFloat(vector, content, offsets)
+                else:
+                    self.filler.addInt(vector, content, offsets)
+            if self.tree is not None:
+                self.filler.fill(self.tree, events)
+            if self.store is not None:
+                self.store.endBatch(events)
+        if self.profiler.enabled:
+            self.profiler.counter('bytesWritten', sum(content.nbytes + offsets.nbytes for content, offsets in arrays))
+        return events
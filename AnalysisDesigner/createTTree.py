@@ -6,24 +6,51 @@
 #
 # Returns: 
 
+import json
+import os
 import ROOT as ROOT
 from DataFormats.FWLite import Events, Handle
+from TreeWriter import BatchWriter, MUON_BRANCHES
+from ColumnStore import ColumnStoreWriter
+from Profiler import newProfiler
 
 class createTTree(object):
 
-        def __init__(self, data_files):
+        # (branch name, vector attribute, C++ element type) of every branch of the muons tree
+        BRANCHES = [(branch, {"Muon_NValidHitsSATk": "Muon_NValidHitsSATK"}.get(branch, branch), ctype) for branch, ctype in MUON_BRANCHES]
+
+        def __init__(self, data_files, output = "datafiles/mytree.root", batchSize = 1000, store = None, writeTree = True, compress = False, profile = False, prefetch = None):
 
                 # To manage Pattuple information in Python (????)
                 self.muonHandle = Handle('std::vector<pat::Muon>')
                 self.vertexHandle = Handle('std::vector<reco::Vertex>')	
                 #self.electronHandle = Handle('std::vector<pat::Electron>')
   
-                # Open data files and get the events  
-                self.events = Events(data_files)
-  
-                # Create a .root file using "RECREATE" option of TFile Class where the tree will be save.
-                self.f = ROOT.TFile("datafiles/mytree.root","RECREATE")
-                self.tree=ROOT.TTree("muons","muons tree")
+                # Data files are opened one at a time in process, so a conversion can be resumed file by file
+                self.data_files = list(data_files)
+                # PrefetchCache copying the next remote data files while one is converted (None: read them remotely)
+                self.prefetch = prefetch
+
+                # The .root file where the tree will be saved, and its checkpoint sidecar
+                self.output = output
+                self.checkpointFile = output + ".checkpoint.json"
+                self.f = None
+                self.tree = None
+                # Events buffered by the writer before they are filled in the tree
+                self.batchSize = batchSize
+                self.writer = None
+
+                # Optional columnar copy of the tree (directory of a ColumnStore), written alongside
+                # the tree or instead of it, zlib-compressed at the end if compress is set
+                self.store = store
+                self.writeTree = writeTree
+                self.compress = compress
+                self.storeWriter = None
+                if not (writeTree or store):
+                        raise ValueError("createTTree needs a tree or a column store to write")
+
+                # Time of each stage of the conversion, reported in output + ".profile.json" (see Profiler)
+                self.profiler = newProfiler(profile, "createTTree")
 
                 # Declare the name of your tree variables
                 self.Muon_pt = ROOT.std.vector('float')()
@@ -79,130 +106,229 @@ class createTTree(object):
 
 
 
-        def process(self, maxEv = -1):
+        def openOutput(self, resume = False):
+                """
+                Open the output file and create the tree branches associated to the particle variables,
+                and open the column store if there is one
+                resume: reopen the tree (and store) of a previous conversion and append to it
+                returns: the checkpoint of the previous conversion (None if it starts from scratch)
+                """
+
+                checkpoint = self.readCheckpoint() if resume else None
+
+                if self.writeTree and checkpoint is None:
+                        # Create a .root file using "RECREATE" option of TFile Class where the tree will be save.
+                        self.f = ROOT.TFile(self.output, "RECREATE")
+                        self.tree = ROOT.TTree("muons", "muons tree")
+                        for branch, attribute, ctype in self.BRANCHES:
+                                self.tree.Branch(branch, getattr(self, attribute))
+                elif self.writeTree:
+                        # The tree holds the entries saved by its last AutoSave
+                        self.f = ROOT.TFile(self.output, "UPDATE")
+                        self.tree = self.f.Get("muons")
+                        for branch, attribute, ctype in self.BRANCHES:
+                                self.tree.SetBranchAddress(branch, getattr(self, attribute))
+
+                if self.store:
+                        self.storeWriter = ColumnStoreWriter(self.store, [(branch, ctype) for branch, attribute, ctype in self.BRANCHES], checkpoint is not None)
+                        if checkpoint is not None:
+                                # The store is committed before the tree is saved: cut it back to the tree
+                                self.storeWriter.truncate(self.entries())
+
+                self.writer = BatchWriter(self.tree, [(branch, ctype, getattr(self, attribute)) for branch, attribute, ctype in self.BRANCHES], self.batchSize, self.storeWriter, self.profiler)
+                return checkpoint
+
+        def entries(self):
+                """
+                returns: the number of events written, in the tree (or in the store when there is no tree)
+                """
+
+                if self.tree is not None:
+                        return int(self.tree.GetEntries())
+                return self.storeWriter.entries
+
+        def readCheckpoint(self):
+                """
+                returns: the checkpoint sidecar of a previous conversion of the same files, None if there is none
+                """
+
+                if not os.path.exists(self.checkpointFile):
+                        return None
+                if self.writeTree and not os.path.exists(self.output):
+                        return None
+                if self.store and not os.path.isdir(self.store):
+                        return None
+                with open(self.checkpointFile) as sidecar:
+                        checkpoint = json.load(sidecar)
+                if checkpoint["files"] != self.data_files:
+                        raise ValueError("%s was written for other data files" % self.checkpointFile)
+                return checkpoint
+
+        def writeCheckpoint(self, completed, fileIndex, done = False):
+                """
+                Flush the tree to the output file, then record how far the conversion went.
+                The store is committed first, then the tree is saved, then the sidecar: after a
+                crash, the store may hold more entries than the tree and the tree more than the
+                sidecar knows of, never less.
+                completed: number of events converted from each of the finished data files
+                fileIndex: index of the data file being converted
+                done: the whole conversion is finished
+                """
+
+                self.writer.flush()
+                with self.profiler.stage('write'):
+                        if self.storeWriter is not None:
+                                self.storeWriter.commit()
+                        if self.tree is not None:
+                                self.tree.AutoSave("SaveSelf")
+                entries = self.entries()
+                checkpoint = {
+                        "files": self.data_files,
+                        "completed": completed,
+                        "file": fileIndex,
+                        "event": entries - sum(completed),
+                        "entries": entries,
+                        "done": done,
+                }
+                # Renamed into place so the sidecar is never half written
+                with open(self.checkpointFile + ".tmp", "w") as sidecar:
+                        json.dump(checkpoint, sidecar, indent=1)
+                os.rename(self.checkpointFile + ".tmp", self.checkpointFile)
+
+        def fillEvent(self, event):
+                """
+                Buffer the muons of one event in the writer, which fills the tree batch by batch
+                event: one event of a Pattuple file
+                """
+
+                w = self.writer
+
+                with self.profiler.stage('read'):
+                        muons = self.getMuons(event)
+                        vertex = self.getVertex(event)
+                self.Vertex_Z = vertex.z()
+                self.profiler.count(1, len(muons))
+
+                #Do this for each particle in the event
+                for i, muon in enumerate(muons): 
+
+                        w.Muon_pt.append(muon.pt())
+                        w.Muon_eta.append(muon.eta())
+                        w.Muon_px.append(muon.px())
+                        w.Muon_py.append(muon.py())
+                        w.Muon_pz.append(muon.pz())
+                        w.Muon_energy.append(muon.energy())
+                        w.Muon_isGlobalMuon.append(muon.isGlobalMuon())
+                        w.Muon_isTrackerMuon.append(muon.isTrackerMuon())
+                        w.Muon_isStandAloneMuon.append(muon.isStandAloneMuon())
+                        w.Muon_dB.append(muon.dB(muon.PV3D))
+                        w.Muon_edB.append(muon.edB(muon.PV3D))
+                        isolation = muon.isolationR03()
+                        w.Muon_isolation_sumPt.append(isolation.sumPt)
+                        w.Muon_isolation_emEt.append(isolation.emEt)
+                        w.Muon_isolation_hadEt.append(isolation.hadEt)
+                        w.Muon_charge.append(muon.charge())
+                        
+                        # DISTANCE
+                        w.Muon_distance.append(abs(muon.vertex().z()-self.Vertex_Z))		
+                       
+                        w.Muon_numOfMatches.append(muon.numberOfMatches())
+        
+        
+                        if not muon.globalTrack().isNull():
+
+                                w.Muon_numberOfValidHits.append(muon.numberOfValidHits())
+                                w.Muon_normChi2.append(muon.normChi2())
+
+                                # Next lines does not work -> The function numberOfValidTrackerHits does not exist for this DATA
+                                # if not muon.innerTrack().isNull():
+                                #       print muon.innerTrack()	
+                                #       #self.Muon_NValidHitsInTk.push_back(muon.innerTrack().hitPattern())
+                                #       self.Muon_NValidHitsInTk.push_back(muon.innerTrack().hitPattern().numberOfValidTrackerHits())
+                                #       self.Muon_NValidPixelHitsnTk.push_back(muon.innerTrack().hitPattern().numberOfValidPixelHits()) 
+
+                        else:
+                                w.Muon_numberOfValidHits.append(-999)
+                                w.Muon_normChi2.append(-999)
+
+                        if not muon.standAloneMuon().isNull():
+                                w.Muon_NValidHitsSATk.append(muon.standAloneMuon().hitPattern().numberOfValidMuonHits())
+
+                #Close the event: the tree is filled when the batch is full
+                w.endEvent()
+                self.Vertex_Z = 0.
+
+        def process(self, maxEv = -1, checkpoint = 0, resume = False):
                 """
                 Create the tree branches and associated them to the particles variables created in the init function. 
                 Process the events and fill the tree 
                 maxEv: maximum number of processed events
                       maxEv=-1 runs over all the events
-                
-                """
-
-                # Create the tree branches and associate them to the particle variables
- 
-                self.tree.Branch("Muon_pt", self.Muon_pt)
-                self.tree.Branch("Muon_eta", self.Muon_eta)
-                self.tree.Branch("Muon_px", self.Muon_px)
-                self.tree.Branch("Muon_py", self.Muon_py)
-                self.tree.Branch("Muon_pz", self.Muon_pz)
-                self.tree.Branch("Muon_energy", self.Muon_energy)
-                self.tree.Branch("Muon_isGlobalMuon", self.Muon_isGlobalMuon)
-                self.tree.Branch("Muon_isTrackerMuon", self.Muon_isTrackerMuon)
-                self.tree.Branch("Muon_isStandAloneMuon", self.Muon_isStandAloneMuon)	
-                self.tree.Branch("Muon_dB", self.Muon_dB)
-                self.tree.Branch("Muon_edB", self.Muon_edB)
-                self.tree.Branch("Muon_isolation_sumPt", self.Muon_isolation_sumPt)
-                self.tree.Branch("Muon_isolation_emEt", self.Muon_isolation_emEt)
-                self.tree.Branch("Muon_isolation_hadEt", self.Muon_isolation_hadEt)
-                self.tree.Branch("Muon_numberOfValidHits", self.Muon_numberOfValidHits)
-                self.tree.Branch("Muon_normChi2", self.Muon_normChi2)
-                self.tree.Branch("Muon_charge", self.Muon_charge)
-                self.tree.Branch("Muon_distance",self.Muon_distance)
-
-                self.tree.Branch("Muon_numOfMatches", self.Muon_numOfMatches)
-                #self.tree.Branch("Muon_deltaPt", self.Muon_delaPt)
-                self.tree.Branch("Muon_NValidHitsSATk", self.Muon_NValidHitsSATK)
-                #self.tree.Branch("Muon_NValidHitsInTk", self.Muon_NValidHitsInTk)
-                #self.tree.Branch("Muon_NValidPixelHitsnTk", self.Muon_NValidPixelHitsnTk)
-
-                # Loop the events and populate the variables
-                for N, event in enumerate(self.events):
-
-                        if maxEv >= 0 and (N + 1) >= maxEv:
-                            break
-
-                        # Do this for each event:
-                        muons = self.getMuons(event)
-                        vertex = self.getVertex(event)
-                        self.Vertex_Z = vertex.z()
-
-                        #Do this for each particle in the event
-                        for i, muon in enumerate(muons): 
-
-                                self.Muon_pt.push_back(muon.pt())
-                                self.Muon_eta.push_back(muon.eta())
-                                self.Muon_px.push_back(muon.px())
-                                self.Muon_py.push_back(muon.py())
-                                self.Muon_pz.push_back(muon.pz())
-                                self.Muon_energy.push_back(muon.energy())
-                                self.Muon_isGlobalMuon.push_back(muon.isGlobalMuon())
-                                self.Muon_isTrackerMuon.push_back(muon.isTrackerMuon())
-                                self.Muon_isStandAloneMuon.push_back(muon.isStandAloneMuon())
-                                self.Muon_dB.push_back(muon.dB(muon.PV3D))
-                                self.Muon_edB.push_back(muon.edB(muon.PV3D))
-                                self.Muon_isolation_sumPt.push_back(muon.isolationR03().sumPt)
-                                self.Muon_isolation_emEt.push_back(muon.isolationR03().emEt)
-                                self.Muon_isolation_hadEt.push_back(muon.isolationR03().hadEt)
-                                self.Muon_charge.push_back(muon.charge())
-                                
-                                # DISTANCE
-                                self.Muon_distance.push_back(abs(muon.vertex().z()-self.Vertex_Z))		
-                               
-                                self.Muon_numOfMatches.push_back(muon.numberOfMatches())
-                
-                
-                                if not muon.globalTrack().isNull():
-
-                                        self.Muon_numberOfValidHits.push_back(muon.numberOfValidHits())
-                                        self.Muon_normChi2.push_back(muon.normChi2())
-
-                                        # Next lines does not work -> The function numberOfValidTrackerHits does not exist for this DATA
-                                        # if not muon.innerTrack().isNull():
-                                        #       print muon.innerTrack()	
-                                        #       #self.Muon_NValidHitsInTk.push_back(muon.innerTrack().hitPattern())
-                                        #       self.Muon_NValidHitsInTk.push_back(muon.innerTrack().hitPattern().numberOfValidTrackerHits())
-                                        #       self.Muon_NValidPixelHitsnTk.push_back(muon.innerTrack().hitPattern().numberOfValidPixelHits()) 
-
-                                else:
-                                        self.Muon_numberOfValidHits.push_back(-999)
-                                        self.Muon_normChi2.push_back(-999)
-
-                                if not muon.standAloneMuon().isNull():
-                                        self.Muon_NValidHitsSATK.push_back(muon.standAloneMuon().hitPattern().numberOfValidMuonHits())
-
-                        #Fill the tree
-                        self.tree.Fill()
-
-                        #Clear the variables
-                        self.Muon_pt.clear()
-                        self.Muon_eta.clear()
-                        self.Muon_px.clear()
-                        self.Muon_py.clear()
-                        self.Muon_pz.clear()
-                        self.Muon_energy.clear()
-                        self.Muon_isStandAloneMuon.clear()
-                        self.Muon_isGlobalMuon.clear()
-                        self.Muon_isTrackerMuon.clear()
-                        self.Muon_dB.clear()
-                        self.Muon_edB.clear()
-                        self.Muon_isolation_sumPt.clear()
-                        self.Muon_isolation_emEt.clear()
-                        self.Muon_isolation_hadEt.clear()
-                        self.Muon_charge.clear()
-
-                        self.Muon_numOfMatches.clear()
-
-                        self.Muon_numberOfValidHits.clear()
-                        self.Muon_normChi2.clear()
-
-                        self.Muon_distance.clear()
-                        self.Vertex_Z = 0.
-
-                        self.Muon_NValidHitsSATK.clear()
-                        #self.Muon_NValidHitsInTk.clear()
-                        #self.Muon_NValidPixelHitsnTk.clear()
+                checkpoint: number of events between two checkpoints (flushed tree + sidecar), 0 only checkpoints
+                      at the end of every data file
+                resume: continue the conversion recorded in the checkpoint sidecar, skipping the data files
+                      and events already converted (starts from scratch if there is no checkpoint)
+                returns: the number of entries of the tree
+                """
+
+                previous = self.openOutput(resume)
+                # Number of events converted from each finished data file
+                completed = previous["completed"] if previous else []
+
+                # Every converted event is one entry of the tree
+                N = self.entries()
+                finished = False
+
+                if self.prefetch is not None:
+                        self.prefetch.start(self.data_files[len(completed):])
+
+                # Loop the data files which are not converted yet, and their events
+                for fileIndex in range(len(completed), len(self.data_files)):
+
+                        with self.profiler.stage('open'):
+                                dataFile = self.data_files[fileIndex]
+                                if self.prefetch is not None:
+                                        # Waits only if the copy fetched in the background is not complete yet
+                                        dataFile = self.prefetch.path(dataFile)
+                                events = Events(dataFile)
+                        # Events of this file converted before the last checkpoint
+                        first = N - sum(completed)
+
+                        for entry in range(first, events.size()):
+
+                                if maxEv >= 0 and (N + 1) >= maxEv:
+                                        finished = True
+                                        break
+
+                                with self.profiler.stage('read'):
+                                        events.to(entry)
+                                with self.profiler.stage('convert'):
+                                        self.fillEvent(events)
+                                N += 1
+
+                                if checkpoint > 0 and N % checkpoint == 0:
+                                        self.writeCheckpoint(completed, fileIndex)
+
+                        if self.prefetch is not None:
+                                self.prefetch.release(self.data_files[fileIndex])
+                        if finished:
+                                break
+                        completed.append(N - sum(completed))
+                        self.writeCheckpoint(completed, fileIndex + 1)
+
+                if self.prefetch is not None:
+                        self.prefetch.close()
 
                 # Write the tree in the .root file and close it
                 print "Write"
-                self.f.Write()
-                self.f.Close()
+                self.writeCheckpoint(completed, len(completed), done = True)
+                if self.tree is not None:
+                        self.tree.Write("", ROOT.TObject.kOverwrite)
+                        self.f.Close()
+                if self.storeWriter is not None:
+                        self.storeWriter.close(self.compress)
+                if self.profiler.enabled:
+                        for line in self.profiler.summary():
+                                print line
+                        self.profiler.write(self.output + ".profile.json")
+                return N
@@ -8,6 +8,8 @@
 
 import ROOT
 from createTTree import createTTree
+from Converter import ParallelConverter
+from Prefetch import PrefetchCache
 import time
 
 start_time = time.time()
@@ -22,8 +24,21 @@ data_files = [
 ]
 
 maxEv = 500000 #number of processed events. maxEvents = -1 runs over all of them
+checkpoint = 10000 #events between two checkpoints of the output tree
+batchSize = 1000 #events buffered by the writer before they are filled in the tree
+store = None #directory of a columnar copy of the tree, e.g. "datafiles/mytree.columns" (can be given as dataset to the analyzers)
+resume = False #continue an interrupted conversion from its last checkpoint
+prefetch = 2 #remote data files copied ahead into datafiles/prefetch while one is converted. 0 reads them remotely, one after the other
+prefetchSize = 20*1024**3 #bytes of copies kept in datafiles/prefetch, the least recently used ones are removed above it
+profile = False #time the stages of the conversion and write a report in datafiles/mytree.root.profile.json
+workers = 1 #number of files converted at the same time. With more than one, every file is converted to its own shard and maxEv applies to each file
 
-t=createTTree(data_files)
-tree=t.process(maxEv)
+if workers > 1:
+        manifest = ParallelConverter(data_files, workers).run(maxEv, checkpoint, resume)
+        print("--- dataset: %s ---" % manifest)
+else:
+        cache = PrefetchCache(maxBytes = prefetchSize, depth = prefetch) if prefetch > 0 else None
+        t=createTTree(data_files, batchSize = batchSize, store = store, profile = profile, prefetch = cache)
+        tree=t.process(maxEv, checkpoint, resume)
 
 print("--- %s seconds ---" % (time.time() - start_time))
@@ -0,0 +1,26 @@
+# Name: exeSynthetic.py
+#
+# CMS Open Data
+#
+# Description: writes a simulated dataset with the muons tree of createTTree (Z->mumu,
+#              Drell-Yan continuum and non-prompt muons), to test and scale the analyzers offline
+#
+# Returns: 
+
+from Synthetic import writeSynthetic
+import time
+
+start_time = time.time()
+
+events = 1000000 #number of generated events. Memory does not depend on it: events are written chunk by chunk
+multiplicity = 1. #mean number of non-prompt muons per event
+zFraction = 0.05 #fraction of Z->mumu events
+dyFraction = 0.02 #fraction of Drell-Yan continuum events
+seed = 1 #same seed and chunkSize: same dataset
+chunkSize = 100000 #events generated and written at once
+output = "datafiles/synthetic.root" #can be given as dataset to the analyzers
+store = None #directory of a columnar copy, e.g. "datafiles/synthetic.columns"
+
+writeSynthetic(output, events, multiplicity, seed, chunkSize, store, zFraction = zFraction, dyFraction = dyFraction)
+
+print("--- %s seconds ---" % (time.time() - start_time))
@@ -1,37 +1,100 @@
 import os
 import logging 
 import ROOT
+from Analyzer import Analyzer
 from Analyzer_All import AnalyzerAll 
 from Analyzer_Selection import AnalyzerSel
+from Selector import Selector
+from Runner import ParallelRunner
+from CutSweep import axisConfigurations
+
+# Process the events in chunks of numpy arrays instead of one by one
+columnar = True
+# Number of processes running each analysis (1: run everything in this process)
+workers = 1
+# Selection analysis: only read the entries of the selection index of the cuts (built and stored by the
+# first run, with one more scan of the dataset), event by event. When set, it is used instead of columnar.
+sparse = False
+# Input: the tree of createTTree, or the manifest of a parallel conversion (e.g. "datafiles/mytree.json")
+dataset = "datafiles/mytree.root"
+# Cut values scanned in one read of the dataset, each parameter in turn (e.g. {'pt_min': [5, 10, 20], 'relIsolation': [0.1, 0.15, 0.2]})
+sweep = {}
+# Time the stages of the loops run in this process and write a report next to each output (e.g. datafiles/histos.root.profile.json)
+profile = False
+Analyzer.profile = profile
 
 #######################################################
 ###                   Analysis                      ###
 #######################################################
 
-analysis = AnalyzerAll()
-#--------------------------------------------------------------------
-# Get the number of entries(events) of the TTree (file.root)
-analysis.beginJob("histos.root")
-print "Start the Analysis"
-# For each event or entry,the following loop populates the tree branches, creates every muon and add it to all_muons list
-for event in range(0, analysis.numEntries):
-	analysis.process(event)
-analysis.endJob()
+if workers > 1:
+	ParallelRunner(AnalyzerAll, workers, columnar=columnar, dataset=dataset).run("histos.root")
+else:
+	analysis = AnalyzerAll(dataset)
+	#--------------------------------------------------------------------
+	# Get the number of entries(events) of the TTree (file.root)
+	analysis.beginJob()
+	def fillAll(names):
+		print "Start the Analysis"
+		# Only the histograms missing from the cache are filled, from the branches they use
+		analysis.SelectHistograms(names)
+		# For each event or entry,the following loop populates the tree branches, creates every muon and add it to all_muons list
+		if columnar:
+			# The next chunks are read by a background thread while one is processed
+			for start, stop, columns in analysis.readAhead():
+				analysis.processColumns(start, stop, columns)
+		else:
+			# Only read the branches used by process
+			analysis.ActivateBranches()
+			for event in range(0, analysis.numEntries):
+				analysis.process(event)
+			print "Decompressed %d bytes" % analysis.BranchReport()['decompressed']
+	# Histograms already computed from the same inputs are read from datafiles/results
+	analysis.ProduceHistograms("histos.root", fillAll)
 
 
 
 #######################################################
 ###                Analysis SELECTION               ###
 #######################################################
-analysisSel = AnalyzerSel()
-
-# Loop over events
-#--------------------------------------------------------------------
-# Get the number of entries(events) of the TTree (file.root) and apply the selection criteria
-#numEntries= analysis.tree.GetEntries()
-analysisSel.beginJob("goodhistos.root")
-print "Start the Analysis"
-# For each event or entry,the following loop populates the tree branches, creates every muon and add it to all_muons list
-for event in range(0, analysisSel.numEntries):
-        analysisSel.process(event)
-analysisSel.endJob()
+selector = Selector()
+
+if workers > 1:
+        ParallelRunner(AnalyzerSel, workers, args=(selector,), columnar=columnar, dataset=dataset).run("goodhistos.root")
+else:
+        analysisSel = AnalyzerSel(dataset)
+
+        # Loop over events
+        #--------------------------------------------------------------------
+        # Get the number of entries(events) of the TTree (file.root) and apply the selection criteria
+        #numEntries= analysis.tree.GetEntries()
+        analysisSel.beginJob()
+        def fillSelected(names):
+                print "Start the Analysis"
+                # Only the histograms missing from the cache are filled, from the branches they use
+                analysisSel.SelectHistograms(names)
+                # For each event or entry,the following loop populates the tree branches, creates every muon and add it to all_muons list
+                if sparse:
+                        analysisSel.processIndex(analysisSel.SelectionIndex(selector.cuts, cutFlow = True))
+                elif columnar:
+                        for start, stop, columns in analysisSel.readAhead():
+                                analysisSel.processColumns(start, stop, selector, columns)
+                else:
+                        # Only read the branches used by process and by the cuts of the selector
+                        analysisSel.ActivateBranches(selector)
+                        for event in range(0, analysisSel.numEntries):
+                                analysisSel.process(event, selector)
+                        print "Decompressed %d bytes" % analysisSel.BranchReport()['decompressed']
+        analysisSel.ProduceHistograms("goodhistos.root", fillSelected, selector.cuts)
+
+
+
+#######################################################
+###                  Cuts SWEEP                     ###
+#######################################################
+if sweep:
+        analysisSweep = AnalyzerSel(dataset)
+        analysisSweep.beginJob()
+        # Selected muon histograms and mass for every point, and the cumulative number of selected muons and pairs along each axis
+        results = analysisSweep.SweepCuts(axisConfigurations(**sweep))
+        results.write("sweep.root")
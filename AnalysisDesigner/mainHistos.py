@@ -1,115 +1,52 @@
-# Import ROOT
-import ROOT
-
-
-
-#t file that contains the histograms for selected muons: goodHistos.root.
-Gfile = ROOT.TFile("datafiles/goodhistos.root", "read")
-
-### Get the root file that contains the histograms for all muons: histos.root.
-Hfile = ROOT.TFile("datafiles/histos.root", "read")
-
-### You must create a variable to store the histograms selected.
-histo1 = Hfile.Get('h_pt')
-histo2 = Gfile.Get('h_pt')
-
-### Then create again a new the canvas where the histograms are going to be drawn
-canvas = ROOT.TCanvas("myCanvas","All muons: Pt",800,600)
-
-from ROOT import gStyle
-### One more time, draw the histogram
-histo1.SetTitle("pt good/all Comparation")
-
-# To not print the top-right box of the first histogram
-gStyle.SetOptStat(0)
-
-# Draw the histograms in the same canvas
-histo1.Draw()
-histo2.Draw("same")
-
-name = "pt"
-canvas.SaveAs("../output_histograms/"+ name +".png")
-
-### At last, draw the canvas
-canvas.Draw()
-
-### Change the line color 
-histo1.SetLineColor(4)
-histo2.SetLineColor(6)
-
-### Change the bounds of the histograms for X Axis 
-histo1.GetXaxis().SetRangeUser(40, 120);
-histo2.GetXaxis().SetRangeUser(0, 200);
-
-### Change the bins for the histograms by diving by a divisor of the initial number of bins. 
-## Note: To restore the binning you must to draw the histo again.
-histo1.Rebin(2)
-
-### Create the legend. TLegend(x1, y1, x2, y2)
-legend =ROOT.TLegend(0.1,0.2,0.30,0.3);
-legend.SetHeader("Muon Transverse Momentum");
-legend.AddEntry(histo1, "All pt","l");
-legend.AddEntry(histo2, "Selected pt","l");
-
-#legend->AddEntry("gr","Graph with error bars","lep");
-legend.Draw();
-
-### Twist linear scale for Y axe to the logaritmic one with the function SetLogy.
-canvas.SetLogy()
-
-name = "pt"
-canvas.SaveAs("../output_histograms/"+ name +".png")
-
-canvas.Draw()
-
-### You must create a variable to store the histograms selected.
-histo3=Hfile.Get('h_mass')
-histo4=Gfile.Get('h_mass')
-
-### Then create again a new the canvas where the histograms are going to be drawn
-canvas = ROOT.TCanvas("myCanvas","All muons: mass",800,600)
-
-from ROOT import gStyle
-### One more time, draw the histogram
-histo3.SetTitle("Mass good/all Comparation")
-
-# To not print the top-right box of the first histogram
-gStyle.SetOptStat(0)
-# Draw the histograms in the same canvas
-histo3.Draw()
-histo4.Draw("same")
-
-### Change the line color 
-histo3.SetLineColor(4)
-histo4.SetLineColor(6)
-
-### Change the bounds of the histograms for X Axis 
-histo3.GetXaxis().SetRangeUser(60, 120);
-histo4.GetXaxis().SetRangeUser(60, 120);
-
-### Change the bins for the histograms by diving by a divisor of the initial number of bins. 
-## Note: To restore the binning you must to draw the histo again.
-#histo1.Rebin(2)
-
-### Create the legend. TLegend(x1, y1, x2, y2)
-legend =ROOT.TLegend(0.1,0.2,0.30,0.3);
-legend.SetHeader("Muon Invariant Mass");
-legend.AddEntry(histo1, "All mass","l");
-legend.AddEntry(histo2, "Selected mass","l");
-
-#legend->AddEntry("gr","Graph with error bars","lep");
-legend.Draw();
-
-### Twist linear scale for Y axe to the logaritmic one with the function SetLogy.
-canvas.SetLogy()
-
-
-name = "mass"
-canvas.SaveAs("../output_histograms/"+ name +".png")
-
-### At last, draw the canvas
-canvas.Draw()
-
-
-### Draw the histogram again and check your changes 
-canvas.Draw()
+# Import the batch renderer of the plots
+from PlotRenderer import PlotRenderer, PlotSpec
+# Import the manager opening each histogram file once
+from HistogramFiles import HistogramFiles
+
+### The file that contains the histograms for selected muons: goodHistos.root.
+Gfile = "datafiles/goodhistos.root"
+
+### The root file that contains the histograms for all muons: histos.root.
+Hfile = "datafiles/histos.root"
+
+### Each plot is described by a PlotSpec: its name, the histograms drawn (file, histogram) and its style.
+plots = [
+        # Pt of all and selected muons drawn in the same canvas
+        PlotSpec("pt", [(Hfile, 'h_pt'), (Gfile, 'h_pt')], kind='overlay',
+                 # Title of the plot
+                 title="pt good/all Comparation",
+                 # Line colors of the histograms
+                 colors=(4, 6),
+                 # Bounds of the X axis
+                 xrange=(40, 120),
+                 # Merge the bins two by two (a divisor of the initial number of bins)
+                 rebin=2,
+                 # To not print the top-right box of the first histogram
+                 stats=False,
+                 # Legend: header and one label per histogram
+                 legend=("Muon Transverse Momentum", ["All pt", "Selected pt"]),
+                 # Logarithmic scale for the Y axis
+                 logy=True),
+        # Invariant mass of all and selected muons
+        PlotSpec("mass", [(Hfile, 'h_mass'), (Gfile, 'h_mass')], kind='overlay',
+                 title="Mass good/all Comparation",
+                 colors=(4, 6),
+                 xrange=(60, 120),
+                 stats=False,
+                 legend=("Muon Invariant Mass", ["All mass", "Selected mass"]),
+                 logy=True),
+]
+
+### Render every plot in ../output_histograms, each process of the pool reusing its canvas.
+### A plot whose histograms and style did not change since the last run is not drawn again:
+### change a style option above and run again to redraw only that plot.
+### (The rendering processes import this script again: only the main one renders.)
+if __name__ == "__main__":
+        ### The histograms of each file are listed from its keys, without reading them.
+        ### Running the cells again reuses the open files and the histograms already read.
+        files = HistogramFiles()
+        for path in (Hfile, Gfile):
+                print("{0}: {1}".format(path, files.keys(path)))
+        renderer = PlotRenderer("../output_histograms", workers=2, width=800, height=600, files=files)
+        rendered = renderer.render(plots)
+        print("Rendered: {0}".format(rendered))
@@ -4,9 +4,18 @@ import ROOT
 import sys
 import os
 import time
+import json
+import numpy
 
 from ROOT import TPySelector
 
+# Columnar kernels shared with the AnalysisDesigner analyzers
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'AnalysisDesigner'))
+from Columns import dimuonPairs, fillHistogramCounts
+from HistogramBank import HistogramBank
+from HistogramSpec import HistogramSpec, FusedFill
+from Profiler import newProfiler, mergeReports
+
 from Cuts_Config import Cuts
 ##############################################
 ###### Selector 
@@ -17,6 +26,50 @@ class Selec(TPySelector):
 
 	DEBUG = True
 
+	# Time the stages of Process on every worker, merged in profile.json by Terminate
+	PROFILE = False
+
+	# Bytes of the TTreeCache reading the baskets ahead, unzipped in parallel (0: no cache)
+	TREE_CACHE_SIZE = 30*1024*1024
+
+	# Number of cuts applied by selector
+	NUM_CUTS = 9
+
+	# Histograms of all muons (h_) and of the selected ones (g_), with the
+	# expression filling them (see HistogramSpec)
+	HISTOGRAMS = [
+		HistogramSpec('h_pt', 'Muons Transverse Momentun', (50, -2, 200), 'Muon_pt', stage='all'),
+		HistogramSpec('h_px', 'Muons x- Momentun', (50, -300, 300), 'Muon_px', stage='all'),
+		HistogramSpec('h_py', 'Muons y- Momentun', (50, -300, 300), 'Muon_py', stage='all'),
+		HistogramSpec('h_pz', 'Muons z- Momentun', (50, -300, 300), 'Muon_pz', stage='all'),
+		HistogramSpec('h_eta', 'Angle Transvese', (50, -8, 8), 'Muon_eta', stage='all'),
+		HistogramSpec('h_energy', 'Muons Energy', (50, -300, 300), 'Muon_energy', stage='all'),
+		HistogramSpec('h_distance', 'Distance from Primary vertex Z ', (50, -300, 300), 'Muon_distance', stage='all'),
+		HistogramSpec('h_charge', 'Muons Charge', (50, -2, 2), 'Muon_charge', stage='all'),
+		HistogramSpec('h_normChi2', 'Muons Chi2', (50, 20, 200), 'Muon_normChi2', stage='all'),
+		HistogramSpec('h_numberOfValidHits', 'Number of Valid Hits', (50, 0, 200), 'Muon_numberOfValidHits', stage='all'),
+		HistogramSpec('h_dB', 'Impact Parameter', (50, -1, 200), 'Muon_dB', stage='all'),
+		HistogramSpec('h_isolation_sumPt', 'IsolationX', (50, -300, 300), 'Muon_isolation_sumPt', stage='all'),
+		HistogramSpec('h_isolation_emEt', 'IsolationX', (50, -300, 300), 'Muon_isolation_emEt', stage='all'),
+		HistogramSpec('h_isolation_hadEt', 'IsolationX', (50, -300, 300), 'Muon_isolation_hadEt', stage='all'),
+		HistogramSpec('h_mass', 'Inv_mass', (500, 0, 200), 'mass', stage='all', objects='pairs'),
+		HistogramSpec('g_pt', 'Muons Transverse Momentun', (50, -2, 200), 'Muon_pt'),
+		HistogramSpec('g_px', 'Muons x- Momentun', (50, -300, 300), 'Muon_px'),
+		HistogramSpec('g_py', 'Muons y- Momentun', (50, -300, 300), 'Muon_py'),
+		HistogramSpec('g_pz', 'Muons z- Momentun', (50, -300, 300), 'Muon_pz'),
+		HistogramSpec('g_eta', 'Angle Transvese', (50, -50, 50), 'Muon_eta'),
+		HistogramSpec('g_energy', 'Muons Energy', (50, -300, 300), 'Muon_energy'),
+		HistogramSpec('g_distance', 'Distance from Primary vertex Z ', (50, -300, 300), 'Muon_distance'),
+		HistogramSpec('g_charge', 'Muons Charge', (50, -2, 2), 'Muon_charge'),
+		HistogramSpec('g_normChi2', 'Muons Chi2', (50, -200, 200), 'Muon_normChi2'),
+		HistogramSpec('g_numberOfValidHits', 'Number of Valid Hits', (50, -200, 200), 'Muon_numberOfValidHits'),
+		HistogramSpec('g_dB', 'Impact Parameter', (50, -1, 200), 'Muon_dB'),
+		HistogramSpec('g_isolation_sumPt', 'IsolationX', (50, -300, 300), 'Muon_isolation_sumPt'),
+		HistogramSpec('g_isolation_emEt', 'IsolationX', (50, -300, 300), 'Muon_isolation_emEt'),
+		HistogramSpec('g_isolation_hadEt', 'IsolationX', (50, -300, 300), 'Muon_isolation_hadEt'),
+		HistogramSpec('g_mass', 'Inv_mass', (60, 0, 200), 'mass', objects='pairs'),
+	]
+
 	def __init__(self):
 		# Instance of Cuts Class to select the muons  
                 self.cuts = Cuts()
@@ -72,6 +125,12 @@ class Selec(TPySelector):
                 self.fChain.SetBranchAddress("Muon_charge", self.Muon_charge);
                 self.fChain.SetBranchAddress("Muon_distance", self.Muon_distance);
 
+		if self.TREE_CACHE_SIZE:
+			# GetEntry reads the baskets in a few large requests, and background threads unzip them before Process needs them
+			ROOT.TTreeCacheUnzip.SetParallelUnzip(ROOT.TTreeCacheUnzip.kEnable)
+			self.fChain.SetCacheSize(self.TREE_CACHE_SIZE)
+			self.fChain.AddBranchToCache("*", True)
+
 
 	def SlaveBegin(self, tree):
     		'''
@@ -79,77 +138,17 @@ class Selec(TPySelector):
 		'''
 		self.Info('SlaveBegin',self.__class__.__name__ )
 		self.eventsProcessed = 0
-		#Declare histos for all muons
-		self.h_pt=ROOT.TH1F( 'h_pt', 'Muons Transverse Momentun', 50, -2, 200 )
-                self.h_px=ROOT.TH1F( 'h_px', 'Muons x- Momentun', 50, -300, 300 )
-                self.h_py=ROOT.TH1F( 'h_py', 'Muons y- Momentun', 50, -300, 300 )
-                self.h_pz=ROOT.TH1F( 'h_pz', 'Muons z- Momentun', 50, -300, 300 )
-                self.h_eta=ROOT.TH1F( 'h_eta', 'Angle Transvese', 50, -8 , 8 )
-                self.h_energy=ROOT.TH1F('h_energy','Muons Energy', 50, -300,300)
-                self.h_distance=ROOT.TH1F('h_distance','Distance from Primary vertex Z ', 50, -300,300)
-                self.h_charge=ROOT.TH1F('h_charge','Muons Charge', 50,-2,2)
-                self.h_normChi2=ROOT.TH1F('h_normChi2', 'Muons Chi2', 50, 20,200)
-                self.h_numberOfValidHits=ROOT.TH1F('h_numberOfValidHits', 'Number of Valid Hits', 50, 0,200)
-                self.h_dB=ROOT.TH1F('h_dB','Impact Parameter',50,-1,200)
-                #self.h_edB=ROOT.TH1F('h_edB','Impact Parameter Error',50,-1,200) >> Pintar como barras de error en el histograma?
-                self.h_isolation_sumPt=ROOT.TH1F('h_isolation_sumPt','IsolationX',50, -300,300)
-                self.h_isolation_emEt=ROOT.TH1F('h_isolation_emEt','IsolationX',50, -300,300)
-                self.h_isolation_hadEt=ROOT.TH1F('h_isolation_hadEt','IsolationX',50, -300,300)
-                self.h_efficiency=ROOT.TH1F('h_efficiency','efficiency',10,0,11)
-                self.h_mass=ROOT.TH1F('h_mass', 'Inv_mass',500, 0,200)
-
-		#Declare Good histos
-		self.g_pt=ROOT.TH1F( 'g_pt', 'Muons Transverse Momentun', 50, -2, 200 )
-                self.g_px=ROOT.TH1F( 'g_px', 'Muons x- Momentun', 50, -300, 300 )
-                self.g_py=ROOT.TH1F( 'g_py', 'Muons y- Momentun', 50, -300, 300 )
-                self.g_pz=ROOT.TH1F( 'g_pz', 'Muons z- Momentun', 50, -300, 300 )
-                self.g_eta=ROOT.TH1F( 'g_eta', 'Angle Transvese', 50, -50 , 50 )
-                self.g_energy=ROOT.TH1F('g_energy','Muons Energy', 50, -300,300)
-                self.g_distance=ROOT.TH1F('g_distance','Distance from Primary vertex Z ', 50, -300,300)
-                self.g_charge=ROOT.TH1F('g_charge','Muons Charge', 50,-2,2)
-                self.g_normChi2=ROOT.TH1F('g_normChi2', 'Muons Chi2', 50, -200,200)
-                self.g_numberOfValidHits=ROOT.TH1F('g_numberOfValidHits', 'Number of Valid Hits', 50, -200,200)
-                self.g_dB=ROOT.TH1F('g_dB','Impact Parameter',50,-1,200)
-                #self.g_edB=ROOT.TH1F('h_edB','Impact Parameter Error',50,-1,200) >> Pintar como barras de error en el histograma?
-                self.g_isolation_sumPt=ROOT.TH1F('g_isolation_sumPt','IsolationX',50, -300,300)
-                self.g_isolation_emEt=ROOT.TH1F('g_isolation_emEt','IsolationX',50, -300,300)
-                self.g_isolation_hadEt=ROOT.TH1F('g_isolation_hadEt','IsolationX',50, -300,300)
-                self.g_mass=ROOT.TH1F('g_mass', 'Inv_mass',60, 0,200)
-		
-		# Add histos to GetOutputList 
-                self.GetOutputList().Add(self.h_pt)
-                self.GetOutputList().Add(self.h_px)
-                self.GetOutputList().Add(self.h_py)
-                self.GetOutputList().Add(self.h_pz)
-                self.GetOutputList().Add(self.h_eta)
-                self.GetOutputList().Add(self.h_energy)
-                self.GetOutputList().Add(self.h_distance)
-                self.GetOutputList().Add(self.h_dB)
-                self.GetOutputList().Add(self.h_isolation_sumPt)
-                self.GetOutputList().Add(self.h_isolation_emEt)
-                self.GetOutputList().Add(self.h_isolation_hadEt)
-                self.GetOutputList().Add(self.h_numberOfValidHits)
-                self.GetOutputList().Add(self.h_normChi2)
-                self.GetOutputList().Add(self.h_charge)
-		self.GetOutputList().Add(self.h_mass)
+		self.profiler = newProfiler(self.PROFILE, self.__class__.__name__)
+		# Declare the histograms of the table and add them to GetOutputList
+		self.fusedFill = FusedFill(self.HISTOGRAMS)
+		for histo in self.fusedFill.book():
+			setattr(self, histo.GetName(), histo)
+			self.GetOutputList().Add(histo)
+		# Bin 1: every muon, bin k+2: the muons passing the cuts 0 to k; counted per entry
+		# and added to the histogram once, in SlaveTerminate
+		self.h_efficiency = ROOT.TH1F('h_efficiency', 'efficiency', 10, 0, 11)
 		self.GetOutputList().Add(self.h_efficiency)
-
-
-                self.GetOutputList().Add(self.g_pt)
-                self.GetOutputList().Add(self.g_px)
-                self.GetOutputList().Add(self.g_py)
-                self.GetOutputList().Add(self.g_pz)
-                self.GetOutputList().Add(self.g_eta)
-                self.GetOutputList().Add(self.g_energy)
-                self.GetOutputList().Add(self.g_distance)
-                self.GetOutputList().Add(self.g_dB)
-                self.GetOutputList().Add(self.g_isolation_sumPt)
-                self.GetOutputList().Add(self.g_isolation_emEt)
-                self.GetOutputList().Add(self.g_isolation_hadEt)
-                self.GetOutputList().Add(self.g_numberOfValidHits)
-                self.GetOutputList().Add(self.g_normChi2)
-                self.GetOutputList().Add(self.g_charge)
-                self.GetOutputList().Add(self.g_mass)
+		self.efficiencyCounts = numpy.zeros(self.NUM_CUTS + 1, dtype=numpy.int64)
 
 	def Notify( self ):
 		    self.Info('Notify', 'tree %s, file %s' % (self.fChain.GetName(), self.fChain.GetDirectory().GetName()))
@@ -159,172 +158,91 @@ class Selec(TPySelector):
 		SLAVE: Main function to read the entry(event), select the muon and fill histograms 
 		'''
 		# Address the data of each physical variable registed in this event or entry number to its branch associated listed above.  
-		self.fChain.GetEntry(entry)
+		with self.profiler.stage('read'):
+			self.fChain.GetEntry(entry)
+		self.profiler.count(1, self.Muon_pt.size())
+
+		# Evaluate the cuts once per muon for the whole entry
+		with self.profiler.stage('selection'):
+			self.muonBits = self.selectionBits()
+		with self.profiler.stage('fill'):
+			self.fillEfficiency()
 				
-		# Selected events in the event
-		self.event_selected_muons = []
-		
-		# print "processing entry: ", entry
-		#if ( entry%1000==0):
-		#	print ' Processing entry: ', entry
-
-		 # Loop all muons in each event 
-		for muon in range(0, self.Muon_pt.size()):
-		#	print "position in entry:", entry, " is ", position, " with charge: ", self.Muon_charge[position]
-			# Fill the histograms by calling fillHisto function(the variable for filling the histo, Muon_pt, for example; the value of that variable in the position within the event) .
-			
-			self.h_pt.Fill(self.Muon_pt[muon])
-                        self.h_px.Fill(self.Muon_px[muon])
-                        self.h_py.Fill(self.Muon_py[muon])
-                        self.h_pz.Fill(self.Muon_pz[muon])
-                        self.h_eta.Fill(self.Muon_eta[muon])
-                        self.h_energy.Fill(self.Muon_energy[muon])
-                        self.h_distance.Fill(self.Muon_distance[muon])
-                        self.h_charge.Fill(self.Muon_charge[muon])
-                        self.h_normChi2.Fill(self.Muon_normChi2[muon])
-                        self.h_numberOfValidHits.Fill(self.Muon_numberOfValidHits[muon])
-                        self.h_dB.Fill(self.Muon_dB[muon])
-                        self.h_isolation_sumPt.Fill(self.Muon_isolation_sumPt[muon])
-                        self.h_isolation_emEt.Fill(self.Muon_isolation_emEt[muon])
-                        self.h_isolation_hadEt.Fill(self.Muon_isolation_hadEt[muon])
-                        self.h_efficiency.Fill(1)
-	
-			if (self.Muon_pt.size()) > 1:
-                                    for j in range (muon+1,self.Muon_pt.size()):
-                                        if (self.Muon_charge[muon]*self.Muon_charge[j])<0:
-                                                        # get the Lorentz vector for the both muons through a ROOT function 
-                                                        tlv1=ROOT.TLorentzVector()
-                                                        tlv1.SetPxPyPzE(self.Muon_px[muon], self.Muon_py[muon], self.Muon_pz[muon],self.Muon_energy[muon])
-
-                                                        tlv2=ROOT.TLorentzVector()
-                                                        tlv2.SetPxPyPzE(self.Muon_px[j], self.Muon_py[j], self.Muon_pz[j],self.Muon_energy[j])
-
-                                                        # Get the mass = (TLV Muon1 + TLV Muon2).M()
-                                                        mass=(tlv1+tlv2).M()
-                                                        #print mass
-                                                        # Fill the histogram for the mass
-                                                        self.h_mass.Fill(mass)
-
-                                                        # If the both muons are selected between the cuts fill the histogram 
-                                                        if self.selector(muon) and self.selector(j):
-                                                                self.g_mass.Fill(mass)
-
-				# Apply the selection over all muons calling the selector function and fill the histograms for each variable
-			if self.selector(muon):
-                        	self.g_pt.Fill(self.Muon_pt[muon])
-                                self.g_px.Fill(self.Muon_px[muon])
-                                self.g_py.Fill(self.Muon_py[muon])
-                                self.g_pz.Fill(self.Muon_pz[muon])
-                                self.g_eta.Fill(self.Muon_eta[muon])
-                                self.g_energy.Fill(self.Muon_energy[muon])
-                                self.g_distance.Fill(self.Muon_distance[muon])
-                                self.g_charge.Fill(self.Muon_charge[muon])
-                                self.g_normChi2.Fill(self.Muon_normChi2[muon])
-                                self.g_numberOfValidHits.Fill(self.Muon_numberOfValidHits[muon])
-                                self.g_dB.Fill(self.Muon_dB[muon])
-                                self.g_isolation_sumPt.Fill(self.Muon_isolation_sumPt[muon])
-                                self.g_isolation_emEt.Fill(self.Muon_isolation_emEt[muon])
-                                self.g_isolation_hadEt.Fill(self.Muon_isolation_hadEt[muon])			
+		# Every muon fills the h_ histograms, the selected ones the g_ histograms, and the
+		# opposite-charge pairs the mass (g_mass: both muons selected); the entry is buffered
+		# and binned with the next ones in a single pass (see FusedFill)
+		pairs = None
+		with self.profiler.stage('pairs'):
+			if self.Muon_pt.size() > 1:
+				pairs = dimuonPairs([0, self.Muon_pt.size()], self.Muon_px, self.Muon_py, self.Muon_pz, self.Muon_energy, self.Muon_charge)
+		with self.profiler.stage('fill'):
+			muons = dict((branch, numpy.asarray(getattr(self, branch))) for branch in self.fusedFill.branches())
+			self.fusedFill.append(muons, self.muonBits == (1 << self.NUM_CUTS) - 1, pairs)
 	
 		return True	
 
 	def SlaveTerminate(self):
 		print "Slave Terminate"
+		# Bin the last buffered entries before the output list is sent
+		with self.profiler.stage('fill'):
+			self.fusedFill.flush(lambda name: getattr(self, name))
+			fillHistogramCounts(self.h_efficiency, numpy.arange(1., self.NUM_CUTS + 2), self.efficiencyCounts)
+		if self.profiler.enabled:
+			# One report per worker, under its own name so that PROOF does not merge them
+			ordinal = ROOT.gProofServ.GetOrdinal() if ROOT.gProofServ else "0"
+			self.GetOutputList().Add(ROOT.TNamed("profile_" + ordinal, json.dumps(self.profiler.report())))
 
 	
 	def Terminate(self):
-		print " Terminate "	
-		self.file = ROOT.TFile("histos.root","RECREATE");
-		
-#		for var in range(0, len(self.variable)):
-		self.GetOutputList().FindObject("h_pt").Write()
-		self.GetOutputList().FindObject("h_px").Write()
-		self.GetOutputList().FindObject("h_py").Write()
-		self.GetOutputList().FindObject("h_pz").Write()
-		self.GetOutputList().FindObject("h_eta").Write()
-		self.GetOutputList().FindObject("h_energy").Write()
-		self.GetOutputList().FindObject("h_distance").Write()
-		self.GetOutputList().FindObject("h_dB").Write()
-		self.GetOutputList().FindObject("h_isolation_sumPt").Write()
-		self.GetOutputList().FindObject("h_isolation_emEt").Write()
-		self.GetOutputList().FindObject("h_isolation_hadEt").Write()
-		self.GetOutputList().FindObject("h_numberOfValidHits").Write()
-		self.GetOutputList().FindObject("h_normChi2").Write()
-		self.GetOutputList().FindObject("h_charge").Write()
-		self.GetOutputList().FindObject("h_mass").Write()
-		self.GetOutputList().FindObject("h_efficiency").Write()
-		
-		self.file.Close()
-
-
-		self.fileG = ROOT.TFile("goodHistos.root","RECREATE");
-
-	        #for var in range(0, len(self.variable)):
-                self.GetOutputList().FindObject("g_pt").Write()
-                self.GetOutputList().FindObject("g_px").Write()
-                self.GetOutputList().FindObject("g_py").Write()
-                self.GetOutputList().FindObject("g_pz").Write()
-                self.GetOutputList().FindObject("g_eta").Write()
-                self.GetOutputList().FindObject("g_energy").Write()
-                self.GetOutputList().FindObject("g_distance").Write()
-                self.GetOutputList().FindObject("g_dB").Write()
-                self.GetOutputList().FindObject("g_isolation_sumPt").Write()
-                self.GetOutputList().FindObject("g_isolation_emEt").Write()
-                self.GetOutputList().FindObject("g_isolation_hadEt").Write()
-                self.GetOutputList().FindObject("g_numberOfValidHits").Write()
-                self.GetOutputList().FindObject("g_normChi2").Write()
-                self.GetOutputList().FindObject("g_charge").Write()
-		self.GetOutputList().FindObject("g_mass").Write()
-
-		
-                self.fileG.Close()
+		print " Terminate "
+		# Histograms of every worker, already merged by PROOF
+		bank = HistogramBank.fromOutputList(self.GetOutputList())
+		bank.subset([name for name in bank.names() if name.startswith('h_')]).spill("histos.root")
+		bank.subset([name for name in bank.names() if name.startswith('g_')]).spill("goodHistos.root")
+		reports = [json.loads(obj.GetTitle()) for obj in self.GetOutputList() if obj.GetName().startswith("profile_")]
+		if reports:
+			with open("profile.json", "w") as output:
+				json.dump({'job': mergeReports(reports, self.__class__.__name__), 'workers': reports}, output, indent=1, sort_keys=True)
 			
 
 	#####################################################################
         ###                        SELECTION                              ###
         #####################################################################
 
-        def selector(self,muon):
-                '''
-                Function to select the muons which are between a default cuts
-                '''
-                if not self.Muon_isGlobalMuon[muon]:
-                        return False
-                self.h_efficiency.Fill(2)
-
-                if not self.Muon_isTrackerMuon[muon]:
-                        return False
-                self.h_efficiency.Fill(3)
-
-                if self.Muon_pt [muon] < self.cuts.pt_min:
-                        return False
-                self.h_efficiency.Fill(4)
-
-                if self.Muon_eta[muon] > self.cuts.eta_max:
-                        return False
-                self.h_efficiency.Fill(5)
-
-                if self.Muon_dB[muon] > self.cuts.dB_max:
-                        return False
-
-                self.h_efficiency.Fill(6)
-		if ((self.Muon_isolation_sumPt[muon]+self.Muon_isolation_emEt[muon]+self.Muon_isolation_hadEt[muon])/self.Muon_pt [muon]) > self.cuts.isolation:
-                        return False
-                self.h_efficiency.Fill(7)
-
-                if self.Muon_distance[muon] > self.cuts.distance:
-                        return False
-
-                self.h_efficiency.Fill(8)
-
-                if self.Muon_normChi2[muon] > self.cuts.normChi2:
-                        return False
-
-                self.h_efficiency.Fill(9)
-
-                if self.Muon_numberOfValidHits[muon] < self.cuts.numValidHits:
-                        return False
-
-                self.h_efficiency.Fill(10)
-
-                return True
+	def selectionBits(self):
+		'''
+		Bitmask of the default cuts passed by every muon of the entry (bit k: cut k,
+		in the order of the efficiency bins), each cut evaluated once per muon
+		'''
+		pt = numpy.asarray(self.Muon_pt, dtype=numpy.float64)
+		isolation = (numpy.asarray(self.Muon_isolation_sumPt, dtype=numpy.float64) + numpy.asarray(self.Muon_isolation_emEt) + numpy.asarray(self.Muon_isolation_hadEt))/pt
+		passed = [
+			numpy.asarray(self.Muon_isGlobalMuon) != 0,
+			numpy.asarray(self.Muon_isTrackerMuon) != 0,
+			~(pt < self.cuts.pt_min),
+			~(numpy.asarray(self.Muon_eta, dtype=numpy.float64) > self.cuts.eta_max),
+			~(numpy.asarray(self.Muon_dB, dtype=numpy.float64) > self.cuts.dB_max),
+			~(isolation > self.cuts.isolation),
+			~(numpy.asarray(self.Muon_distance, dtype=numpy.float64) > self.cuts.distance),
+			~(numpy.asarray(self.Muon_normChi2, dtype=numpy.float64) > self.cuts.normChi2),
+			~(numpy.asarray(self.Muon_numberOfValidHits) < self.cuts.numValidHits),
+		]
+		bits = numpy.zeros(len(pt), dtype=numpy.uint16)
+		for k, cut in enumerate(passed):
+			bits |= cut.astype(numpy.uint16) << k
+		return bits
+
+	def fillEfficiency(self):
+		'''Count the muons of the entry in every efficiency bin, from the cached bitmask'''
+		alive = numpy.ones(len(self.muonBits), dtype=bool)
+		self.efficiencyCounts[0] += len(alive)
+		for k in range(self.NUM_CUTS):
+			alive &= (self.muonBits >> k) & 1 == 1
+			self.efficiencyCounts[k + 1] += numpy.count_nonzero(alive)
+
+	def selector(self,muon):
+		'''
+		Function to select the muons which are between a default cuts: reads the
+		bitmask computed once for the entry by selectionBits
+		'''
+		return self.muonBits[muon] == (1 << self.NUM_CUTS) - 1
@@ -1,21 +1,33 @@
 import ROOT as ROOT
 import sys
+import os
 import getopt
 from DataFormats.FWLite import Events, Handle
 from ROOT import gROOT, TH1F, TGraph, gStyle
 import matplotlib as plt
 import numpy
 
+# Batch plot renderer shared with the AnalysisDesigner scripts
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'AnalysisDesigner'))
+from PlotRenderer import PlotRenderer, PlotSpec
+from HistogramFiles import HistogramFiles
+
 class Histos(object):
 	'''
 	Class Histos which read the histos file and draw the histograms
 	'''
-	def __init__(self):
+	def __init__(self, workers=1):
 		'''
-		Constructor: only read the histograms from the both files
+		Constructor: the files of the histograms and the renderer of the plots
+		workers: number of processes rendering the plots; with 1 (default) each plot is
+		         drawn on its own canvas in the session, more render them in batch
 		'''
-		self.file=ROOT.TFile("../files/histos.root","read")
-		self.Gfile=ROOT.TFile("../files/goodHistos.root", "read")
+		self.histosFile = "../files/histos.root"
+		self.goodHistosFile = "../files/goodHistos.root"
+		# Each file opened once, the histograms read kept until the file changes
+		self.files = HistogramFiles()
+		# Plots whose histograms and style did not change are not saved again
+		self.renderer = PlotRenderer("$HOME/CmsOpendata/histos", workers, files=self.files)
 		
 	#### bins and bounds?????
 
@@ -23,31 +35,26 @@ class Histos(object):
 		'''
 		DrawHisto function just prints the histograms for all muons 
 		'''
-                for i in args:
-			self.histo=self.file.Get('h_'+i)
-                        self.createCanvas(self.histo, 'h_'+i)
+		self.render([PlotSpec('h_'+i, [(self.histosFile, 'h_'+i)]) for i in args])
 
 	def drawSelHisto(self, *args):
 		'''
 		DrawSelHisto function prints the histograms for the selected muons
 		'''
-                for i in args:
-                        self.gHisto=self.Gfile.Get('g_'+i)
-                        self.createCanvas(self.gHisto, 'g_'+ i)
+		self.render([PlotSpec('g_'+i, [(self.goodHistosFile, 'g_'+i)]) for i in args])
 
 	def drawTwoHistos(self, *args): 
 		'''
 		drawTwoHistos prints all and good muons in the same Histogram 
 		The efficiency is the only variable which has one histogram
 		'''
+		specs = []
 		for i in args:
 			if i != 'efficiency':
-				self.histo=self.file.Get('h_'+i)
-                                self.gHisto=self.Gfile.Get('g_'+i)
-                                self.createCanvas( self.histo, 'hg_'+i, self.gHisto)
+				specs.append(PlotSpec('hg_'+i, [(self.histosFile, 'h_'+i), (self.goodHistosFile, 'g_'+i)], kind='overlay'))
 			else:
-				self.histo=self.Gfile.Get('h_'+i)
-				self.createCanvas( self.histo, 'h_'+i)
+				specs.append(PlotSpec('h_'+i, [(self.goodHistosFile, 'h_'+i)]))
+		self.render(specs)
 		
 
 	def GaussianFit(self, histo):
@@ -55,35 +62,28 @@ class Histos(object):
 		Fit Histograms for Exercise 3. 
 		### FALTA Fit Breit Wigner  
 		'''
-		self.gHisto=self.Gfile.Get('g_'+histo)
-		self.gHisto.Fit("gaus")		
-		#self.fit1 = self.gHisto.GetFunction("gaus")
-		gStyle.SetOptFit()
-		self.createCanvas(self.gHisto, 'fit_'+histo)
+		self.render([PlotSpec('fit_'+histo, [(self.goodHistosFile, 'g_'+histo)], kind='fit', fit="gaus")])
 
-	def createCanvas(self, histo, i=None, gHisto=None):
-		'''
-		Create Canvas for only all muons histogram or both histograms: all and selected muons 
-		'''
-		# Create Canvas = canvas
-		canvas = ROOT.TCanvas("", "", 1)
-	
-		canvas.cd()
-		# Print histogram
-		histo.Draw()
-		# If we want to print both histograms in the same canvas:
-		if gHisto is not None:
-			gHisto.SetLineColor(2)
-			gHisto.Draw("same")
-		
-		canvas.Update()
-		canvas.Draw()		
+	def render(self, specs):
+		'''
+		Draw plots (see PlotSpec) and save them in the histos directory, all at once
+		returns: names of the plots saved, the others were up to date
+		'''
+		return self.renderer.render(specs)
 
-		# Save Canvas in histos directory
-		canvas.SaveAs("$HOME/CmsOpendata/histos/"+ i +".png")
+	def listHistos(self):
+		'''
+		Names of the histograms of both files, without reading them
+		returns: {file: [names]}
+		'''
+		return dict((path, self.files.keys(path)) for path in (self.histosFile, self.goodHistosFile))
 
-    		# ONLY WAY found to display and keep the canvas on screen
-		#ROOT.gApplication.Run()
+	def getHisto(self, path, name):
+		'''
+		Histogram of a file, read once and then taken from the cache.
+		Draw a Clone to change it: the cached one is shared.
+		'''
+		return self.files.get(path, name)
 
 #if __name__=="__main__":
 #	main()
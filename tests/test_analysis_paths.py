@@ -0,0 +1,134 @@
+'''
+The ways of running the analysis must fill the same histograms as the
+columnar mode, on a small synthetic column store where, as in the real data,
+Muon_NValidHitsSATk is only written for the standalone muons.
+'''
+import os
+import sys
+
+import pytest
+
+ROOT = pytest.importorskip("ROOT")
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'AnalysisDesigner'))
+
+from Analyzer import Analyzer
+from Analyzer_All import AnalyzerAll
+from Analyzer_Selection import AnalyzerSel
+from Cuts import Cuts
+from Selector import Selector
+from Synthetic import writeSynthetic
+
+EVENTS = 2000
+CONFIGURATIONS = [{}, {'pt_min': 10}, {'numValidHitsSTATk': 20}]
+
+
+@pytest.fixture(scope='module')
+def store(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp('synthetic') / 'store')
+    writeSynthetic(None, EVENTS, 1.5, seed=7, chunkSize=500, store=path, writeTree=False, zFraction=0.3)
+    return path
+
+
+@pytest.fixture(autouse=True)
+def settings(store, monkeypatch, tmp_path):
+    monkeypatch.setattr(Analyzer, 'dataset', store)
+    monkeypatch.setattr(Analyzer, 'cacheDirectory', None)
+    monkeypatch.setattr(Analyzer, 'readAheadThreads', 0)
+    monkeypatch.setattr(Analyzer, 'chunkSize', 700)
+    monkeypatch.setattr(Analyzer, 'selectionDirectory', str(tmp_path / 'selections'))
+
+
+def contents(histo):
+    '''Bin contents, under- and overflow included, and number of entries'''
+    nbins = histo.GetXaxis().GetNbins()
+    return [histo.GetBinContent(b) for b in range(nbins + 2)], histo.GetEntries()
+
+
+def assertSameHistograms(histograms, reference, names=None):
+    names = names or [histo.GetName() for histo in reference]
+    assert names
+    for name in names:
+        assert contents(histograms[name]) == contents(reference[name]), name
+
+
+def columnar(cls, *args):
+    analysis = cls()
+    analysis.beginJob()
+    for start, stop, columns in analysis.readAhead():
+        analysis.processColumns(start, stop, *args, columns=columns)
+    return analysis
+
+
+def eventLoop(cls, *args):
+    analysis = cls()
+    analysis.beginJob()
+    for event in range(analysis.numEntries):
+        analysis.process(event, *args)
+    return analysis
+
+
+def test_event_loop_matches_columnar():
+    assertSameHistograms(eventLoop(AnalyzerAll).Bank(), columnar(AnalyzerAll).Bank())
+
+
+@pytest.mark.parametrize('configuration', CONFIGURATIONS)
+def test_selection_event_loop_matches_columnar(configuration):
+    selector = Selector(Cuts(**configuration))
+    assertSameHistograms(eventLoop(AnalyzerSel, selector).Bank(), columnar(AnalyzerSel, selector).Bank())
+
+
+def test_muon_by_muon_matches_columnar():
+    analysis = AnalyzerAll()
+    analysis.beginJob()
+    for event in range(analysis.numEntries):
+        analysis.tree.GetEntry(event)
+        for particle in range(analysis.Muon_pt.size()):
+            analysis.FillHistograms(particle)
+    names = [spec.name for spec in AnalyzerAll.HISTOGRAMS if spec.objects == 'muons']
+    assertSameHistograms(analysis.Bank(), columnar(AnalyzerAll).Bank(), names)
+
+
+def test_fused_pass_matches_columnar():
+    cuts = Cuts()
+    fused = AnalyzerSel()
+    fused.beginJob()
+    fused.FillHistogramsInOnePass(cuts)
+    reference = columnar(AnalyzerSel, Selector(cuts))
+    # The one-pass fill keeps the tree.Project definitions of h_type and h_mass
+    names = [histo for histo, branch in AnalyzerSel.MUON_HISTOGRAMS] + ['h_isolation']
+    assertSameHistograms(dict((name, fused.Histogram(name)) for name in names), reference.Bank(), names)
+    # Relative isolation is (hadEt + emEt + sumPt)/pt on every path; most muons share its first bin
+    assert fused.Histogram('h_isolation').GetMean() == pytest.approx(reference.Bank()['h_isolation'].GetMean())
+
+
+def test_sweep_matches_columnar():
+    analysis = AnalyzerSel()
+    results = analysis.SweepCuts(CONFIGURATIONS).results()
+    for configuration, result in zip(CONFIGURATIONS, results):
+        reference = columnar(AnalyzerSel, Selector(Cuts(**configuration))).Bank()
+        assertSameHistograms(result['histograms'], reference, [histo.GetName() for histo in result['histograms']])
+        assert result['muons'] == reference['h_pt'].GetEntries()
+
+
+def test_sweep_rejects_parameters_without_column_cut():
+    # mass_min is a Cuts parameter but not one of the muon cuts
+    with pytest.raises(AssertionError):
+        AnalyzerSel().SweepCuts([{'mass_min': 10}], histograms=False)
+
+
+def test_sparse_matches_columnar():
+    cuts = Cuts(pt_min=10)
+    sparse = AnalyzerSel()
+    sparse.beginJob()
+    sparse.processIndex(sparse.SelectionIndex(cuts, cutFlow=True))
+    assertSameHistograms(sparse.Bank(), columnar(AnalyzerSel, Selector(cuts)).Bank())
+
+
+def test_selection_index_built_on_request():
+    cuts = Cuts(pt_min=10)
+    analysis = AnalyzerSel()
+    assert analysis.SelectionIndex(cuts, build=False) is None
+    assert not os.path.exists(analysis.selectionDirectory)
+    index = analysis.SelectionIndex(cuts)
+    assert list(analysis.SelectionIndex(cuts, build=False).entries) == list(index.entries)